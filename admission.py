@@ -0,0 +1,124 @@
+"""
+Admission control and load shedding
+
+Every request is charged against token buckets keyed on the user (or the
+client address before login): one bucket for all of the user's requests and
+one per rate-limited route. Expensive routes additionally share a global
+concurrency limit. Requests over a limit are rejected right away with 429 or
+503 and a Retry-After header instead of queueing behind everyone else.
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+
+class RouteLimit:
+    """Token bucket parameters: sustained requests per second and burst size"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+
+class TokenBuckets:
+    """Token buckets for many keys
+
+    Keys are spread over independently locked stripes, so concurrent requests
+    of different users rarely wait on the same lock.
+    """
+
+    def __init__(self, stripes: int = 32, max_keys_per_stripe: int = 10000):
+        self.max_keys_per_stripe = max_keys_per_stripe
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+
+    def take(self, key: Hashable, limit: RouteLimit) -> float:
+        """Take one token; returns 0 on success, otherwise seconds until one is available"""
+        buckets, lock = self._stripes[hash(key) % len(self._stripes)]
+        now = time.monotonic()
+        with lock:
+            tokens, updated = buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now)
+                return 0.0
+            buckets[key] = (tokens, now)
+            if len(buckets) > self.max_keys_per_stripe:
+                self._prune(buckets, now, limit)
+            return (1 - tokens) / limit.rate
+
+    @staticmethod
+    def _prune(buckets: dict, now: float, limit: RouteLimit):
+        """Forget buckets that have been idle long enough to be full again"""
+        idle = limit.burst / limit.rate
+        for key in [key for key, (_, updated) in buckets.items() if now - updated > idle]:
+            del buckets[key]
+
+
+class AdmissionController:
+    """Per-user/per-route rate limits plus a concurrency limit for expensive routes"""
+
+    def __init__(self, default: RouteLimit = RouteLimit(20, 40),
+                 routes: Optional[Dict[str, RouteLimit]] = None,
+                 expensive_prefixes: Iterable[str] = ('/api/reports/',),
+                 max_expensive: int = 4):
+        self.default = default
+        self.routes = routes or {}
+        self.expensive_prefixes = tuple(expensive_prefixes)
+        self.max_expensive = max_expensive
+        self._buckets = TokenBuckets()
+        self._stats_lock = threading.Lock()
+        self._admitted = 0
+        self._expensive_in_flight = 0
+        self._shed = {"rate_limited": Counter(), "overloaded": Counter()}
+
+    def is_expensive(self, path: str) -> bool:
+        return path.startswith(self.expensive_prefixes)
+
+    def admit(self, client: Hashable, endpoint: Optional[str], path: str) -> Tuple[Optional[tuple], bool]:
+        """Decide on a request
+
+        Returns ``(rejection, holds_slot)``: ``rejection`` is None when the
+        request is admitted, otherwise a ``(body, status, headers)`` response.
+        When ``holds_slot`` is True the caller must call ``release()`` once the
+        request has finished.
+        """
+        retry_after = self._buckets.take(client, self.default)
+        if not retry_after and endpoint in self.routes:
+            retry_after = self._buckets.take((client, endpoint), self.routes[endpoint])
+        if retry_after:
+            self._count_shed("rate_limited", endpoint)
+            return ({"error": "Too many requests"}, 429,
+                    {"Retry-After": str(math.ceil(retry_after))}), False
+
+        expensive = self.is_expensive(path)
+        with self._stats_lock:
+            if expensive:
+                if self._expensive_in_flight >= self.max_expensive:
+                    self._shed["overloaded"][endpoint or 'unknown'] += 1
+                    return ({"error": "Server is busy, try again later"}, 503, {"Retry-After": "1"}), False
+                self._expensive_in_flight += 1
+            self._admitted += 1
+        return None, expensive
+
+    def release(self):
+        """Free the concurrency slot of a finished expensive request"""
+        with self._stats_lock:
+            self._expensive_in_flight -= 1
+
+    def stats(self) -> Dict:
+        """Admission and shedding counters"""
+        with self._stats_lock:
+            return {
+                "admitted": self._admitted,
+                "shed": {reason: dict(counts) for reason, counts in self._shed.items()},
+                "shed_total": sum(sum(counts.values()) for counts in self._shed.values()),
+                "expensive_in_flight": self._expensive_in_flight,
+                "max_expensive": self.max_expensive
+            }
+
+    def _count_shed(self, reason: str, endpoint: Optional[str]):
+        with self._stats_lock:
+            self._shed[reason][endpoint or 'unknown'] += 1
\ No newline at end of file
@@ -0,0 +1,360 @@
+"""
+Payment-behaviour analytics over an in-memory columnar snapshot
+
+The invoice fields the statistics need (amount, issue/due/payment dates,
+payment status and customer) are kept as NumPy arrays per database. The
+snapshot is refreshed incrementally from ``updated_at``, so after the first
+load a report costs one small query plus vectorized array operations instead
+of a full SQL scan per statistic.
+
+NumPy is imported by the functions using it, on the first snapshot, so
+importing this module at server start stays cheap.
+"""
+
+from __future__ import annotations
+
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional
+
+from database import Database
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Dates are stored as days since 1970-01-01; missing or malformed dates as NO_DATE
+NO_DATE = -2 ** 31  # smallest int32
+
+# Days-to-pay histogram buckets: 0-7, 8-14, 15-30, 31-60, 61-90 and 91+ days
+DAY_BUCKET_EDGES = [8, 15, 31, 61, 91]
+DAY_BUCKET_LABELS = ['0-7', '8-14', '15-30', '31-60', '61-90', '91+']
+PERCENTILES = [50, 75, 90, 95, 99]
+
+# Sort keys of the per-customer report
+CUSTOMER_SORT_KEYS = ('outstanding', 'dso', 'avg_days_to_pay', 'late_payment_rate', 'invoiced')
+
+
+def day_number(value) -> int:
+    """Days since 1970-01-01 of a date or YYYY-MM-DD string"""
+    import numpy as np
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+def to_day_numbers(values: List[Optional[str]]) -> np.ndarray:
+    """YYYY-MM-DD strings as day numbers; missing or malformed dates become NO_DATE"""
+    import numpy as np
+    try:
+        days = np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        days = np.empty(len(values), dtype='datetime64[D]')
+        for i, value in enumerate(values):
+            try:
+                days[i] = np.datetime64(value, 'D') if value else np.datetime64('NaT')
+            except ValueError:
+                days[i] = np.datetime64('NaT')
+    missing = np.isnat(days)
+    numbers = days.astype(np.int64).astype(np.int32)
+    numbers[missing] = NO_DATE
+    return numbers
+
+
+class Columns(NamedTuple):
+    """Invoice fields as parallel arrays, sorted by invoice ID
+
+    Payment timing is derived once per refresh rather than per report.
+    """
+    id: np.ndarray
+    customer: np.ndarray  # customer ID, -1 while not migrated
+    amount: np.ndarray
+    issue: np.ndarray  # day numbers
+    due: np.ndarray
+    paid: np.ndarray
+    settled: np.ndarray  # paid with both issue and payment date known
+    days_to_pay: np.ndarray  # payment - issue date, 0 unless settled
+    late: np.ndarray  # settled after the due date
+
+    def select(self, since: Optional[str] = None, until: Optional[str] = None,
+               date_column: str = 'issue_date', customer_id: Optional[int] = None) -> np.ndarray:
+        """Boolean mask of the invoices within [since, until] (of the given customer)"""
+        import numpy as np
+        dates = self.issue if date_column == 'issue_date' else self.due
+        mask = np.ones(len(self.id), dtype=bool)
+        if since is not None:
+            mask &= dates >= day_number(since)
+        if until is not None:
+            mask &= (dates <= day_number(until)) & (dates != NO_DATE)
+        if customer_id is not None:
+            mask &= self.customer == customer_id
+        return mask
+
+
+def to_columns(rows) -> Columns:
+    """Columns from (id, customer_id, total_amount, issue_date, due_date, payment_date, paid) rows"""
+    import numpy as np
+    issue = to_day_numbers([row[3] for row in rows])
+    due = to_day_numbers([row[4] for row in rows])
+    payment = to_day_numbers([row[5] for row in rows])
+    paid = np.array([bool(row[6]) for row in rows], dtype=bool)
+    settled = paid & (issue != NO_DATE) & (payment != NO_DATE)
+    columns = Columns(
+        id=np.array([row[0] for row in rows], dtype=np.int64),
+        customer=np.array([-1 if row[1] is None else row[1] for row in rows], dtype=np.int64),
+        amount=np.array([row[2] for row in rows], dtype=np.float64),
+        issue=issue,
+        due=due,
+        paid=paid,
+        settled=settled,
+        days_to_pay=np.where(settled, payment - issue, 0).astype(np.int32),
+        late=settled & (due != NO_DATE) & (payment > due),
+    )
+    order = np.argsort(columns.id, kind='stable')
+    return Columns(*(column[order] for column in columns))
+
+
+class PaymentSnapshot:
+    """Columnar copy of the invoices of one database
+
+    ``columns`` is replaced as a whole on refresh, so a reader holding it keeps
+    a consistent view.
+    """
+
+    def __init__(self, database: Database, refresh_interval: float = 1.0):
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.watermark: Optional[str] = None  # newest updated_at seen
+        self.columns = to_columns([])
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False):
+        """Bring the snapshot up to date; at most once per refresh_interval unless forced"""
+        import numpy as np
+        # Once loaded, readers don't queue behind a refresh another thread is already doing
+        if not self._lock.acquire(blocking=force or self.watermark is None):
+            return
+        try:
+            if not force and time.monotonic() - self._refreshed < self.refresh_interval:
+                return
+            with self.database.get_connection() as conn:
+                source = self.database._invoices_source(conn)
+                select = f'''
+                    SELECT i.id, i.customer_id, i.total_amount, i.issue_date, i.due_date,
+                           i.payment_date, i.payment_status = 'zaplaceno', i.updated_at
+                    FROM {source} i'''
+                if self.watermark is None:
+                    self._load(conn.execute(select).fetchall())
+                else:
+                    # Rows of the watermark's second are read again, merging them is idempotent
+                    changed = conn.execute(f"{select} WHERE i.updated_at >= ?", (self.watermark,)).fetchall()
+                    self._merge(changed)
+                    # Deletes, archive moves and the customer backfill don't touch updated_at:
+                    # the snapshot holds every current invoice, so any difference means a reload
+                    total, with_customer = conn.execute(
+                        f"SELECT COUNT(*), COUNT(customer_id) FROM {source}"
+                    ).fetchone()
+                    if (total != len(self.columns.id)
+                            or with_customer != int(np.count_nonzero(self.columns.customer >= 0))):
+                        self._load(conn.execute(select).fetchall())
+            self._refreshed = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def refresh_in_background(self):
+        """Start a refresh on a background thread when the snapshot is stale
+
+        Readers keep getting the current columns meanwhile, so a report never
+        waits for the change queries.
+        """
+        if time.monotonic() - self._refreshed >= self.refresh_interval and not self._lock.locked():
+            threading.Thread(target=self.refresh, name='payment-snapshot', daemon=True).start()
+
+    def _load(self, rows):
+        self.columns = to_columns(rows)
+        self._advance_watermark(rows)
+
+    def _merge(self, rows):
+        """Overwrite changed invoices in place and append new ones"""
+        import numpy as np
+        if not rows:
+            return
+        current, changed = self.columns, to_columns(rows)
+        if len(current.id):
+            positions = np.minimum(np.searchsorted(current.id, changed.id), len(current.id) - 1)
+            existing = current.id[positions] == changed.id
+        else:
+            positions = np.zeros(len(rows), dtype=np.int64)
+            existing = np.zeros(len(rows), dtype=bool)
+        merged = []
+        for column, update in zip(current, changed):
+            column = column.copy()
+            column[positions[existing]] = update[existing]
+            merged.append(np.concatenate([column, update[~existing]]))
+        order = np.argsort(merged[0], kind='stable')
+        self.columns = Columns(*(column[order] for column in merged))
+        self._advance_watermark(rows)
+
+    def _advance_watermark(self, rows):
+        stamps = [row[7] for row in rows if row[7] is not None]
+        self.watermark = max([self.watermark or ''] + stamps)
+
+
+def _ratio(numerator, denominator) -> Optional[float]:
+    return float(numerator) / float(denominator) if denominator else None
+
+
+def _percentiles(counts: np.ndarray, offset: int) -> Dict[str, Optional[float]]:
+    """Percentiles (linear interpolation, as np.percentile) from per-day counts; None without values"""
+    import numpy as np
+    cumulative = np.cumsum(counts)
+    if not len(cumulative) or not cumulative[-1]:
+        return {f"p{p}": None for p in PERCENTILES}
+    ranks = np.array(PERCENTILES) / 100 * (cumulative[-1] - 1)
+    lower = np.searchsorted(cumulative, np.floor(ranks), side='right')
+    upper = np.searchsorted(cumulative, np.ceil(ranks), side='right')
+    values = lower + (upper - lower) * (ranks - np.floor(ranks)) + offset
+    return {f"p{p}": float(value) for p, value in zip(PERCENTILES, values)}
+
+
+def payment_stats(columns: Columns, mask: np.ndarray,
+                  today: Optional[datetime.date] = None) -> Dict[str, Any]:
+    """Days-to-pay distribution, late-payment rates and overdue totals of the selected invoices"""
+    import numpy as np
+    today = day_number(today or datetime.date.today())
+    settled = mask & columns.settled
+    unpaid = mask & ~columns.paid
+    overdue = unpaid & (columns.due < today) & (columns.due != NO_DATE)
+    late = settled & columns.late
+    settled_count = int(np.count_nonzero(settled))
+    # Sums over a mask as dot products, which is cheaper than copying out the selected rows
+    settled_amount = np.dot(settled, columns.amount)
+
+    days_to_pay = None
+    histogram = np.zeros(len(DAY_BUCKET_LABELS), dtype=np.int64)
+    if settled_count:
+        days = columns.days_to_pay[settled]
+        # Days to pay are small integers: one counting pass gives every percentile
+        offset = int(days.min())
+        counts = np.bincount(days - offset)
+        day_values = np.arange(len(counts)) + offset
+        days_to_pay = {
+            "mean": float(days.mean()),
+            "amount_weighted_mean": _ratio(np.dot(settled, columns.days_to_pay * columns.amount),
+                                           settled_amount),
+            "min": offset,
+            "max": int(day_values[-1]),
+            "percentiles": _percentiles(counts, offset)
+        }
+        histogram = np.bincount(np.searchsorted(DAY_BUCKET_EDGES, day_values, side='right'),
+                                weights=counts, minlength=len(DAY_BUCKET_LABELS))
+
+    return {
+        "invoices": int(np.count_nonzero(mask)),
+        "paid_invoices": settled_count,
+        "days_to_pay": days_to_pay,
+        "histogram": [{"days": label, "count": int(count)}
+                      for label, count in zip(DAY_BUCKET_LABELS, histogram)],
+        "late_payment_rate": _ratio(np.count_nonzero(late), settled_count),
+        "late_payment_amount_rate": _ratio(np.dot(late, columns.amount), settled_amount),
+        "unpaid_invoices": int(np.count_nonzero(unpaid)),
+        "unpaid_amount": float(np.dot(unpaid, columns.amount)),
+        "overdue_invoices": int(np.count_nonzero(overdue)),
+        "overdue_amount": float(np.dot(overdue, columns.amount))
+    }
+
+
+def customer_payments(columns: Columns, mask: np.ndarray, since: Optional[str] = None,
+                      until: Optional[str] = None, sort: str = 'outstanding',
+                      limit: Optional[int] = None,
+                      today: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+    """Per-customer DSO, average days to pay, late-payment rate and outstanding amount
+
+    DSO is outstanding / invoiced * days in the period ([since, until], by
+    default from the first selected issue date to today). Invoices whose
+    customer hasn't been migrated yet are reported under customer_id None.
+    """
+    import numpy as np
+    if sort not in CUSTOMER_SORT_KEYS:
+        raise ValueError(f"sort must be one of: {', '.join(CUSTOMER_SORT_KEYS)}")
+    today = day_number(today or datetime.date.today())
+    if not mask.any():
+        return []
+
+    # Customer IDs are dense integers, so they index the per-customer sums directly: bucket 0
+    # collects the invoices outside the selection, bucket 1 those not migrated yet (-1)
+    group = np.where(mask, columns.customer + 2, 0)
+    amount = columns.amount
+    unpaid = ~columns.paid
+
+    def per_customer(weights=None):
+        return np.bincount(group, weights=weights)
+
+    invoices = per_customer()
+    invoices[0] = 0
+    customers = np.flatnonzero(invoices)
+    invoiced = per_customer(amount)
+    outstanding = per_customer(amount * unpaid)
+    overdue = per_customer(amount * (unpaid & (columns.due < today) & (columns.due != NO_DATE)))
+    settled_amount = per_customer(amount * columns.settled)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_days_to_pay = per_customer(columns.days_to_pay * amount) / settled_amount
+        late_rate = per_customer(columns.late) / per_customer(columns.settled)
+
+    issued = np.where(mask & (columns.issue != NO_DATE), columns.issue, np.iinfo(np.int32).max)
+    start = day_number(since) if since else min(int(issued.min()), today)
+    end = day_number(until) if until else today
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dso = outstanding / invoiced * max(end - start + 1, 1)
+
+    metrics = {'outstanding': outstanding, 'dso': dso, 'avg_days_to_pay': avg_days_to_pay,
+               'late_payment_rate': late_rate, 'invoiced': invoiced}
+    # Customers without a value for the sort key go last
+    key = np.nan_to_num(metrics[sort][customers], nan=-np.inf, posinf=-np.inf)
+    order = customers[np.argsort(-key, kind='stable')[:limit]]
+
+    def number(value):
+        return float(value) if np.isfinite(value) else None
+
+    return [{
+        "customer_id": int(i) - 2 if i > 1 else None,
+        "invoices": int(invoices[i]),
+        "invoiced": float(invoiced[i]),
+        "outstanding": float(outstanding[i]),
+        "overdue": float(overdue[i]),
+        "avg_days_to_pay": number(avg_days_to_pay[i]),
+        "late_payment_rate": number(late_rate[i]),
+        "dso": number(dso[i])
+    } for i in order]
+
+
+class PaymentAnalytics:
+    """Snapshots of the most recently used databases, kept in an LRU"""
+
+    def __init__(self, max_snapshots: int = 16, refresh_interval: float = 1.0):
+        self.max_snapshots = max_snapshots
+        self.refresh_interval = refresh_interval
+        self._snapshots: 'OrderedDict[str, PaymentSnapshot]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def columns(self, database: Database) -> Columns:
+        """Columns of a database, loading its snapshot on first use
+
+        Later calls return at most about refresh_interval (plus one refresh)
+        stale data and refresh in the background.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(database.db_path)
+            if snapshot is None:
+                snapshot = self._snapshots[database.db_path] = PaymentSnapshot(
+                    database, self.refresh_interval
+                )
+                while len(self._snapshots) > self.max_snapshots:
+                    self._snapshots.popitem(last=False)
+            else:
+                self._snapshots.move_to_end(database.db_path)
+        if snapshot.watermark is None:
+            snapshot.refresh()
+        else:
+            snapshot.refresh_in_background()
+        return snapshot.columns
\ No newline at end of file
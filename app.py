@@ -1,17 +1,148 @@
 import functools
+import io
+import itertools
+import os
 import re
-from flask import Flask, request, session, jsonify
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, session, jsonify, g, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from database import Database
+from admission import AdmissionController, RouteLimit
+from analytics import CUSTOMER_SORT_KEYS, PaymentAnalytics, customer_payments, payment_stats
+from backup import BackupScheduler
+from database import ChangesCompacted, Database
+from documents import DOCUMENT_FORMATS, document_cache
+from jobs import JobRunner, JobLimitExceeded
+from maintenance import MaintenanceScheduler
+from passwords import VerificationBusy, VerificationPool
+from profiling import init_profiling
+from reconciliation import STATEMENT_FORMATS, parse_statement, reconcile
+from reporting import ReportSnapshots
+from rows import Rows, iter_json_object
+from sharding import ShardRouter
+from singleflight import SingleFlight, SingleFlightTimeout
+from werkzeug.test import EnvironBuilder
 from datetime import datetime, timedelta
 
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON, also accepting compact Rows (endpoints stream those with json_response())"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Rows):
+            return o.dicts()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.secret_key = 'your-secret-key-here'  # Change this in production
 CORS(app)  # Enable CORS for all routes
 
-# Initialize database
+# Initialize database (users and companies without a shard live here)
 db = Database()
 
+# Per-company invoice databases, opened lazily
+shards = ShardRouter(os.environ.get('INVOICE_SHARD_DIR', 'shards'), default=db)
+
+
+# Background jobs for heavy reports and exports
+jobs = JobRunner(db, os.environ.get('INVOICE_JOB_DIR', 'job_results'))
+
+
+# Per-user rate limits and a concurrency limit for the report routes
+admission = AdmissionController(
+    default=RouteLimit(rate=20, burst=40),
+    routes={
+        'login': RouteLimit(rate=1, burst=5),
+        'get_unpaid_invoices': RouteLimit(rate=2, burst=10),
+        'get_largest_debtors': RouteLimit(rate=2, burst=10),
+        'get_average_payment_time': RouteLimit(rate=2, burst=10),
+        'get_overdue_invoices': RouteLimit(rate=2, burst=10),
+    },
+    expensive_prefixes=('/api/reports/',),
+    max_expensive=4
+)
+
+
+@app.before_request
+def admit_request():
+    """Reject requests over the caller's rate limit or beyond the report concurrency limit"""
+    if request.method == 'OPTIONS':
+        return None
+    client = session.get('user_id') or f"addr:{request.remote_addr}"
+    rejection, g.admission_slot = admission.admit(client, request.endpoint, request.path)
+    return rejection
+
+
+@app.teardown_request
+def release_admission(exc=None):
+    if g.pop('admission_slot', False):
+        admission.release()
+
+
+def profiling_allowed():
+    """Only owners may profile requests"""
+    user = db.get_user_by_id(session['user_id']) if 'user_id' in session else None
+    return bool(user) and user['role'] == 'owner'
+
+
+# X-Profile: text|pstats|collapsed returns a profile of the request instead of its response
+init_profiling(app, profiling_allowed)
+
+
+# Identical report queries running at the same time share one execution
+report_flight = SingleFlight()
+REPORT_WAIT_TIMEOUT = 30.0
+
+# Largest block of invoice numbers one request can reserve
+MAX_RESERVED_NUMBERS = 1000
+
+# Largest page of the invoice change feed
+MAX_CHANGES_PAGE = 1000
+
+# Upper bound for ?limit= of the list reports
+MAX_REPORT_LIMIT = 1000
+
+# Sub-requests one POST /api/batch may carry, and threads running the read-only ones
+MAX_BATCH_REQUESTS = 20
+batch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='batch')
+BATCH_USER_KEY = 'invoices.batch_user'  # WSGI environ key, not settable from HTTP headers
+
+# Threads hashing login passwords and logins allowed to wait for them; the rest get 503
+password_pool = VerificationPool(workers=int(os.environ.get('LOGIN_VERIFY_WORKERS', '2')),
+                                 max_queue=int(os.environ.get('LOGIN_VERIFY_QUEUE', '16')))
+
+# Columnar invoice snapshots for the payment-behaviour reports
+payment_analytics = PaymentAnalytics()
+
+
+def backup_paths():
+    """Every database file of the server: main, archive, company shards and the items API"""
+    paths = [db.db_path, db.archive_path] + shards.database_paths()
+    return [path for path in paths + ['app.db'] if os.path.exists(path)]
+
+
+# Online backups every INVOICE_BACKUP_INTERVAL seconds (disabled when unset)
+backups = BackupScheduler(backup_paths, float(os.environ.get('INVOICE_BACKUP_INTERVAL', '0')))
+
+# Reports read copies of the databases at most INVOICE_REPORT_MAX_STALENESS seconds old
+# (disabled when unset), so they don't hold locks invoice writes wait for
+report_snapshots = ReportSnapshots(float(os.environ.get('INVOICE_REPORT_MAX_STALENESS', '0')))
+
+# ANALYZE, incremental vacuum and WAL checkpoints every INVOICE_MAINTENANCE_INTERVAL seconds
+# (default 6 hours, 0 disables), stepping aside while requests keep coming in
+maintenance = MaintenanceScheduler(backup_paths, float(os.environ.get('INVOICE_MAINTENANCE_INTERVAL', '21600')),
+                                   activity=lambda: admission.stats()['admitted'])
+
+
+def tenant_db() -> Database:
+    """Database of the company the authenticated user belongs to"""
+    return g.get('tenant_db', db)
+
 
 def require_auth(roles=None):
     """Decorator to require authentication and specific roles"""
@@ -22,13 +153,16 @@ def require_auth(roles=None):
             if 'user_id' not in session:
                 return {"error": "Authentication required"}, 401
 
-            user = db.get_user_by_id(session['user_id'])
+            # Sub-requests of a batch reuse the user the batch was authenticated as
+            user = request.environ.get(BATCH_USER_KEY) or db.get_user_by_id(session['user_id'])
             if not user:
                 return {"error": "User not found"}, 404
 
             if roles and user['role'] not in roles:
                 return {"error": "Insufficient permissions"}, 403
 
+            g.company_id = user['company_id']
+            g.tenant_db = shards.get(user['company_id'])
             return f(*args, **kwargs)
 
         return decorated_function
@@ -36,6 +170,39 @@ def require_auth(roles=None):
     return decorator
 
 
+def date_arg(name, params=None):
+    """Read an optional YYYY-MM-DD query parameter, raising ValueError when malformed"""
+    value = (request.args if params is None else params).get(name)
+    if value is not None:
+        datetime.strptime(value, '%Y-%m-%d')
+    return value
+
+
+def fields_arg(available, params=None):
+    """Fields requested by ?fields=a,b (a tuple, None for all), raising ValueError for unknown ones
+
+    The names are checked against ``available``, so they are safe to project into SQL.
+    """
+    value = (request.args if params is None else params).get('fields')
+    if value is None:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    if not fields or any(name not in available for name in fields):
+        raise ValueError(f"fields must be a comma-separated list of: {', '.join(available)}")
+    return fields
+
+
+def compact_dumps(value):
+    """Flask's JSON encoding of a value, without whitespace"""
+    return app.json.dumps(value, separators=(',', ':'))
+
+
+def json_response(body, status=200):
+    """JSON response streaming the Rows in ``body`` in chunks; same text as returning the dict"""
+    chunks = iter_json_object(body, compact_dumps, sort_keys=app.json.sort_keys)
+    return app.response_class(itertools.chain(chunks, ['\n']), status=status, mimetype='application/json')
+
+
 # === AUTHENTICATION ENDPOINTS ===
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -44,7 +211,13 @@ def login():
         return {"error": "Username and password are required"}, 400
 
     user = db.get_user_by_username(data['username'])
-    if user and user['password'] == Database.hash_password(data['password']):
+    try:
+        matches, new_hash = password_pool.check(data['password'], user['password'] if user else None)
+    except VerificationBusy:
+        return {"error": "Too many logins, try again later"}, 503, {"Retry-After": "1"}
+    if matches:
+        if new_hash:
+            db.rehash_user_password(user['id'], user['password'], new_hash)
         session['user_id'] = user['id']
         session['user_role'] = user['role']
         return {
@@ -83,9 +256,22 @@ def get_current_user():
 @app.route('/api/invoices', methods=['GET'])
 @require_auth()
 def get_invoices():
-    """Get all invoices"""
-    invoices = db.get_all_invoices()
-    return {"invoices": invoices}
+    """Get all invoices (optionally issued within ?since=&until=, only the ?fields=)
+
+    ``last_seq`` is the change log position the list reflects, the ?since= to
+    continue with at GET /api/invoices/changes.
+    """
+    try:
+        since, until = date_arg('since'), date_arg('until')
+    except ValueError:
+        return {"error": "Invalid date format. Use YYYY-MM-DD"}, 400
+    try:
+        fields = fields_arg(Database.INVOICE_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    invoices, last_seq = tenant_db().get_invoices_with_last_seq(since=since, until=until, fields=fields,
+                                                                compact=True)
+    return json_response({"invoices": invoices, "last_seq": last_seq})
 
 
 @app.route('/api/invoices', methods=['POST'])
@@ -93,13 +279,11 @@ def get_invoices():
 def create_invoice():
     """Create new invoice"""
     data = request.get_json()
-    if not data or 'invoice_number' not in data or 'customer_name' not in data:
-        return {"error": "Invoice number and customer name are required"}, 400
-
-    # Check if invoice number already exists
-    existing = db.get_invoice_by_number(data['invoice_number'])
-    if existing:
-        return {"error": "Invoice number already exists"}, 400
+    if not data or 'customer_name' not in data:
+        return {"error": "Customer name is required"}, 400
+    # Without an invoice_number the next one of the issue year is allocated
+    if not data.get('invoice_number') and 'issue_date' not in data:
+        return {"error": "Issue date is required"}, 400
 
     # Automatically calculate due date as 14 days after issue date if not provided
     if 'issue_date' in data and 'due_date' not in data:
@@ -111,28 +295,92 @@ def create_invoice():
             return {"error": "Invalid issue date format. Use YYYY-MM-DD"}, 400
 
     try:
-        new_invoice = db.create_invoice(data)
+        new_invoice = tenant_db().create_invoice(data)
         return new_invoice, 201
+    except sqlite3.IntegrityError as e:
+        # The UNIQUE constraint decides, so concurrent creators can't both pass a check
+        if 'invoice_number' in str(e):
+            return {"error": "Invoice number already exists"}, 400
+        return {"error": f"Failed to create invoice: {str(e)}"}, 400
     except Exception as e:
         return {"error": f"Failed to create invoice: {str(e)}"}, 400
 
 
+@app.route('/api/invoice-numbers', methods=['POST'])
+@require_auth(roles=['owner', 'accountant'])
+def reserve_invoice_numbers():
+    """Reserve a block of invoice numbers ({"count": N, "year": YYYY}) for bulk imports"""
+    data = request.get_json() or {}
+    count, year = data.get('count', 1), data.get('year', datetime.now().year)
+    if not isinstance(count, int) or not 1 <= count <= MAX_RESERVED_NUMBERS:
+        return {"error": f"count must be between 1 and {MAX_RESERVED_NUMBERS}"}, 400
+    if not isinstance(year, int) or not 1000 <= year <= 9999:
+        return {"error": "year must be a four-digit year"}, 400
+    return {"invoice_numbers": tenant_db().reserve_invoice_numbers(year, count)}, 201
+
+
+@app.route('/api/invoices/changes', methods=['GET'])
+@require_auth()
+def get_invoice_changes():
+    """Invoice inserts, updates and deletes after ?since=<seq>, in pages of ?limit=
+
+    A full resync starts at ?since=0 and passes ?resync=1 with every following page.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return {"error": "since and limit must be numbers"}, 400
+    resync = request.args.get('resync') in ('1', 'true')
+    if since < 0 or not 1 <= limit <= MAX_CHANGES_PAGE:
+        return {"error": f"since must be >= 0 and limit between 1 and {MAX_CHANGES_PAGE}"}, 400
+    try:
+        return tenant_db().get_invoice_changes(since, limit, resync)
+    except ChangesCompacted as e:
+        return {"error": f"{e}, resync from GET /api/invoices or from ?since=0&resync=1",
+                "purged_through": e.purged_through}, 410
+
+
 @app.route('/api/invoices/<int:invoice_id>', methods=['GET'])
 @require_auth()
 def get_invoice(invoice_id):
-    """Get specific invoice"""
-    invoice = db.get_invoice_by_id(invoice_id)
+    """Get specific invoice (only the ?fields=)"""
+    try:
+        fields = fields_arg(Database.INVOICE_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    # Whole invoices are cached, so a single one is trimmed rather than queried narrowly
+    invoice = tenant_db().get_invoice_by_id(invoice_id)
     if invoice:
-        return invoice
+        return {name: invoice[name] for name in fields} if fields else invoice
     else:
         return {"error": "Invoice not found"}, 404
 
 
+@app.route('/api/invoices/<int:invoice_id>/document', methods=['GET'])
+@require_auth()
+def get_invoice_document(invoice_id):
+    """Download the invoice as an ISDOC (?format=isdoc) or printable HTML (?format=html) document"""
+    fmt = request.args.get('format', 'isdoc')
+    if fmt not in DOCUMENT_FORMATS:
+        return {"error": f"Unknown format. Use one of: {', '.join(DOCUMENT_FORMATS)}"}, 400
+
+    invoice = tenant_db().get_invoice_by_id(invoice_id)
+    if not invoice:
+        return {"error": "Invoice not found"}, 404
+
+    path = document_cache.get_or_render(tenant_db(), invoice, fmt)
+    extension, mimetype = DOCUMENT_FORMATS[fmt]
+    return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=fmt != 'html',
+                     download_name=f"{invoice['invoice_number']}.{extension}",
+                     etag=os.path.basename(path).split('.')[0])
+
+
 @app.route('/api/invoices/<int:invoice_id>', methods=['PUT'])
 @require_auth(roles=['owner', 'accountant'])
 def update_invoice(invoice_id):
     """Update invoice"""
-    invoice = db.get_invoice_by_id(invoice_id)
+    invoice = tenant_db().get_invoice_by_id(invoice_id)
     if not invoice:
         return {"error": "Invoice not found"}, 404
 
@@ -148,11 +396,15 @@ def update_invoice(invoice_id):
             return {"error": "Invalid issue date format. Use YYYY-MM-DD"}, 400
 
     try:
-        updated_invoice = db.update_invoice(invoice_id, data)
+        updated_invoice = tenant_db().update_invoice(invoice_id, data)
         if updated_invoice:
             return updated_invoice
         else:
             return {"error": "Failed to update invoice"}, 400
+    except sqlite3.IntegrityError as e:
+        if 'invoice_number' in str(e):
+            return {"error": "Invoice number already exists"}, 400
+        return {"error": f"Failed to update invoice: {str(e)}"}, 400
     except Exception as e:
         return {"error": f"Failed to update invoice: {str(e)}"}, 400
 
@@ -161,47 +413,425 @@ def update_invoice(invoice_id):
 @require_auth(roles=['owner'])
 def delete_invoice(invoice_id):
     """Delete invoice (owner only)"""
-    invoice = db.get_invoice_by_id(invoice_id)
+    invoice = tenant_db().get_invoice_by_id(invoice_id)
     if not invoice:
         return {"error": "Invoice not found"}, 404
 
-    if db.delete_invoice(invoice_id):
+    if tenant_db().delete_invoice(invoice_id):
         return {"message": "Invoice deleted successfully"}
     else:
         return {"error": "Failed to delete invoice"}, 400
 
 
+# === BANK STATEMENT ENDPOINTS ===
+@app.route('/api/bank-statements', methods=['POST'])
+@require_auth(roles=['owner', 'accountant'])
+def import_bank_statement():
+    """Match a bank statement (CSV or ABO/GPC) to unpaid invoices and mark them paid
+
+    The statement is uploaded as the multipart field ``file`` or as the raw
+    request body. ?format=csv|gpc overrides the detection, ?encoding= the
+    default (cp1250 for GPC, utf-8-sig for CSV) and ?dry_run=1 only reports
+    the matches.
+    """
+    fmt = request.args.get('format')
+    if fmt is not None and fmt not in STATEMENT_FORMATS:
+        return {"error": f"Unknown format. Use one of: {', '.join(STATEMENT_FORMATS)}"}, 400
+    upload = request.files.get('file')
+    stream = io.BufferedReader(upload.stream if upload else request.stream)
+    if fmt is None:
+        fmt = 'gpc' if stream.peek(3)[:3] == b'074' else 'csv'
+    encoding = request.args.get('encoding', 'cp1250' if fmt == 'gpc' else 'utf-8-sig')
+
+    try:
+        lines = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        return reconcile(tenant_db(), parse_statement(lines, fmt),
+                         dry_run=request.args.get('dry_run') in ('1', 'true'))
+    except (ValueError, LookupError) as e:
+        return {"error": f"Invalid bank statement: {e}"}, 400
+
+
+# === CUSTOMER ENDPOINTS ===
+@app.route('/api/customers', methods=['GET'])
+@require_auth()
+def search_customers():
+    """Customers whose name or IČ starts with ?q= (for autocomplete)"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+    except ValueError:
+        return {"error": "limit must be a number"}, 400
+    if not query:
+        return {"customers": []}
+    return {"customers": tenant_db().search_customers(query, limit)}
+
+
+@app.route('/api/customers/<ic>', methods=['GET'])
+@require_auth()
+def get_customer(ic):
+    """Get customer by IČ"""
+    customer = tenant_db().get_customer_by_ic(ic)
+    if customer:
+        return customer
+    return {"error": "Customer not found"}, 404
+
+
+@app.route('/api/customers/<ic>', methods=['PUT'])
+@require_auth(roles=['owner', 'accountant'])
+def update_customer(ic):
+    """Edit a customer's name, DIČ or address; all of its invoices show the new details"""
+    data = request.get_json()
+    if not data or not any(key in data for key in Database.CUSTOMER_COLUMNS):
+        return {"error": "name, dic or address is required"}, 400
+    if 'name' in data and not data['name']:
+        return {"error": "Customer name is required"}, 400
+    customer = tenant_db().update_customer(ic, data)
+    if customer:
+        return customer
+    return {"error": "Customer not found"}, 404
+
+
 # === REPORT ENDPOINTS ===
+def reports_db():
+    """Database the reports of the user's company read (its snapshot when enabled) and the time of its data"""
+    return report_snapshots.source(tenant_db())
+
+
+def as_of(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+
+def coalesced_report(database, name, *args, **kwargs):
+    """Run report ``name`` (method get_<name>) on ``database``, or wait for the same one already in flight"""
+    def release_admission_slot():
+        # Waiting costs no database work, so leave the report slot to others
+        if g.pop('admission_slot', False):
+            admission.release()
+
+    compute = getattr(database, f"get_{name}")
+    return report_flight.do((database.db_path, name) + args + tuple(sorted(kwargs.items())),
+                            lambda: compute(*args, **kwargs),
+                            timeout=REPORT_WAIT_TIMEOUT, on_wait=release_admission_slot)
+
+
+@app.errorhandler(SingleFlightTimeout)
+def report_timeout(e):
+    return {"error": "Report computation timed out"}, 504
+
+
+def report_args(with_limit=True, params=None):
+    """Report parameters from ?since=&until=&date=issue|due&customer=<IČ>&limit=
+
+    Returned as a tuple in the order the report methods take them, so it also
+    serves as part of the coalescing key. Raises ValueError when malformed.
+    ``params`` defaults to the query string of the current request.
+    """
+    params = request.args if params is None else params
+    date_column = {'issue': 'issue_date', 'due': 'due_date'}.get(params.get('date', 'issue'))
+    if date_column is None:
+        raise ValueError("date must be 'issue' or 'due'")
+    try:
+        since, until = date_arg('since', params), date_arg('until', params)
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+    args = (since, until, date_column, params.get('customer') or None)
+    if with_limit:
+        limit = params.get('limit')
+        if limit is not None:
+            if not limit.isdigit() or not 1 <= int(limit) <= MAX_REPORT_LIMIT:
+                raise ValueError(f"limit must be between 1 and {MAX_REPORT_LIMIT}")
+            limit = int(limit)
+        args += (limit,)
+    return args
+
+
 @app.route('/api/reports/unpaid', methods=['GET'])
 @require_auth()
 def get_unpaid_invoices():
-    """Get all unpaid invoices"""
-    unpaid_invoices = db.get_unpaid_invoices()
-    return {"invoices": unpaid_invoices}
+    """Get unpaid invoices (only the ?fields=)"""
+    try:
+        args = report_args() + (fields_arg(Database.INVOICE_FIELDS),)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    database, data_time = reports_db()
+    unpaid_invoices = coalesced_report(database, 'unpaid_invoices', *args, compact=True)
+    return json_response({"invoices": unpaid_invoices, "as_of": as_of(data_time)})
 
 
 @app.route('/api/reports/largest-debtors', methods=['GET'])
 @require_auth()
 def get_largest_debtors():
-    """Get largest debtors by total unpaid amount"""
-    debtors = db.get_largest_debtors()
-    return {"debtors": debtors}
+    """Get largest debtors by total unpaid amount (only the ?fields=)"""
+    try:
+        args = report_args() + (fields_arg(Database.DEBTOR_FIELDS),)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    database, data_time = reports_db()
+    debtors = coalesced_report(database, 'largest_debtors', *args, compact=True)
+    return json_response({"debtors": debtors, "as_of": as_of(data_time)})
 
 
 @app.route('/api/reports/average-payment-time', methods=['GET'])
 @require_auth()
 def get_average_payment_time():
     """Get average payment time"""
-    avg_time = db.get_average_payment_time()
-    return {"average_payment_days": avg_time}
+    try:
+        args = report_args(with_limit=False)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    database, data_time = reports_db()
+    avg_time = coalesced_report(database, 'average_payment_time', *args)
+    return {"average_payment_days": avg_time, "as_of": as_of(data_time)}
 
 
 @app.route('/api/reports/overdue', methods=['GET'])
 @require_auth()
 def get_overdue_invoices():
-    """Get overdue invoices"""
-    overdue_invoices = db.get_overdue_invoices()
-    return {"invoices": overdue_invoices}
+    """Get overdue invoices (only the ?fields=)"""
+    try:
+        args = report_args() + (fields_arg(Database.OVERDUE_FIELDS),)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    database, data_time = reports_db()
+    overdue_invoices = coalesced_report(database, 'overdue_invoices', *args, compact=True)
+    return json_response({"invoices": overdue_invoices, "as_of": as_of(data_time)})
+
+
+def analytics_selection(since, until, date_column, customer_ic):
+    """Snapshot columns of the current company and the mask of the invoices a report covers"""
+    columns = payment_analytics.columns(tenant_db())
+    customer_id = None
+    if customer_ic is not None:
+        customer = tenant_db().get_customer_by_ic(customer_ic)
+        customer_id = customer['id'] if customer else 0  # no invoice has customer 0
+    return columns, columns.select(since, until, date_column, customer_id)
+
+
+@app.route('/api/reports/payment-stats', methods=['GET'])
+@require_auth()
+def get_payment_stats():
+    """Days-to-pay percentiles and histogram, late-payment rates and overdue totals"""
+    try:
+        args = report_args(with_limit=False)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return payment_stats(*analytics_selection(*args))
+
+
+@app.route('/api/reports/customer-payments', methods=['GET'])
+@require_auth()
+def get_customer_payments():
+    """Per-customer DSO, days to pay and late-payment rate (?sort=, ?limit=)"""
+    sort = request.args.get('sort', 'outstanding')
+    if sort not in CUSTOMER_SORT_KEYS:
+        return {"error": f"sort must be one of: {', '.join(CUSTOMER_SORT_KEYS)}"}, 400
+    try:
+        since, until, date_column, customer_ic, limit = report_args()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    columns, mask = analytics_selection(since, until, date_column, customer_ic)
+    result = customer_payments(columns, mask, since, until, sort, limit)
+    customers = tenant_db().get_customers_by_ids([row['customer_id'] for row in result
+                                                  if row['customer_id'] is not None])
+    for row in result:
+        customer = customers.get(row['customer_id'], {})
+        row['customer_name'], row['customer_ic'] = customer.get('name'), customer.get('ic')
+    return {"customers": result}
+
+
+@app.route('/api/admission/stats', methods=['GET'])
+@require_auth(roles=['owner'])
+def get_admission_stats():
+    """Admitted and shed request counts plus report coalescing and login verification metrics (owner only)"""
+    return {**admission.stats(), "report_coalescing": report_flight.stats(),
+            "password_verification": password_pool.stats()}
+
+
+@app.route('/api/backups/stats', methods=['GET'])
+@require_auth(roles=['owner'])
+def get_backup_stats():
+    """Progress and duration of the scheduled backups (owner only)"""
+    return backups.stats()
+
+
+@app.route('/api/report-snapshots/stats', methods=['GET'])
+@require_auth(roles=['owner'])
+def get_report_snapshot_stats():
+    """Age and refresh counts of the reporting snapshots (owner only)"""
+    return report_snapshots.stats()
+
+
+@app.route('/api/maintenance', methods=['POST'])
+@require_auth(roles=['owner'])
+def run_maintenance():
+    """Start a database maintenance run now, regardless of load (owner only)"""
+    if not maintenance.trigger():
+        return {"error": "Maintenance is already running"}, 409
+    return {"message": "Maintenance started"}, 202
+
+
+@app.route('/api/maintenance/stats', methods=['GET'])
+@require_auth(roles=['owner'])
+def get_maintenance_stats():
+    """Duration and space reclaimed of the last maintenance run per database (owner only)"""
+    return maintenance.stats()
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+@require_auth(roles=['owner'])
+def get_cache_stats():
+    """Hit rates of the invoice cache of the user's company database and of the user cache (owner only)"""
+    return {"invoices": tenant_db().invoice_cache.stats(), "users": db.user_cache.stats()}
+
+
+# === JOB ENDPOINTS ===
+def job_owner():
+    """Submitter the current user's jobs are restricted to: None for owners, who see all of their company's"""
+    return None if session.get('user_role') == 'owner' else session['user_id']
+
+
+def get_user_job(job_id):
+    """Get a job if it belongs to the current user (owners see every job of their company)"""
+    return jobs.get(job_id, g.company_id, job_owner())
+
+
+def job_response(job):
+    """Job as returned by the API (without the server-side result path)"""
+    job = {key: value for key, value in job.items() if key != 'result_path'}
+    if job['status'] == 'done':
+        job['result_url'] = f"/api/jobs/{job['id']}/result"
+    return job
+
+
+@app.route('/api/jobs', methods=['POST'])
+@require_auth()
+def submit_job():
+    """Submit a background job ({"type": ..., "params": {...}})"""
+    data = request.get_json()
+    if not data or 'type' not in data:
+        return {"error": "Job type is required"}, 400
+
+    try:
+        job = jobs.submit(session['user_id'], data['type'], data.get('params') or {}, tenant_db(),
+                          g.company_id)
+    except JobLimitExceeded as e:
+        return {"error": str(e)}, 429
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return job_response(job), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+@require_auth()
+def get_jobs():
+    """Get the current user's jobs (owners: every job of their company)"""
+    user_jobs = jobs.list_for_user(session['user_id'], g.company_id, whole_company=job_owner() is None)
+    return {"jobs": [job_response(job) for job in user_jobs]}
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@require_auth()
+def get_job(job_id):
+    """Get job status and progress"""
+    job = get_user_job(job_id)
+    if job:
+        return job_response(job)
+    return {"error": "Job not found"}, 404
+
+
+@app.route('/api/jobs/<int:job_id>/result', methods=['GET'])
+@require_auth()
+def get_job_result(job_id):
+    """Download the result of a finished job"""
+    job = get_user_job(job_id)
+    if not job:
+        return {"error": "Job not found"}, 404
+
+    result = jobs.result_file(job)
+    if not result:
+        return {"error": f"Job has no result (status: {job['status']})"}, 409
+    path, mimetype = result
+    return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True,
+                     download_name=os.path.basename(path))
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['DELETE'])
+@require_auth()
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = get_user_job(job_id)
+    if not job:
+        return {"error": "Job not found"}, 404
+
+    if jobs.cancel(job_id, g.company_id, job_owner()):
+        return {"message": "Job cancelled"}
+    job = get_user_job(job_id) or job
+    return {"error": f"Job already finished (status: {job['status']})"}, 409
+
+
+# === BATCH ENDPOINT ===
+def subrequest_environ(sub, user):
+    """WSGI environ of a sub-request, carrying the batch's session cookie and user"""
+    builder = EnvironBuilder(path=sub['path'], method=sub['method'], json=sub.get('body'),
+                             headers={'Cookie': request.headers.get('Cookie', '')},
+                             environ_overrides={'REMOTE_ADDR': request.remote_addr, BATCH_USER_KEY: user})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def dispatch_subrequest(environ):
+    """Run one sub-request through the app; returns its status and body"""
+    # A fresh app context gives the sub-request its own ``g``, also when nested in the batch request
+    with app.app_context(), app.request_context(environ):
+        response = app.make_response(app.full_dispatch_request())
+    try:
+        if response.is_json:
+            body = response.get_json(silent=True)
+        elif response.mimetype.startswith('text/') and not response.direct_passthrough:
+            body = response.get_data(as_text=True)
+        else:
+            body = None  # files are downloaded with a normal request
+        return {"status": response.status_code, "content_type": response.mimetype, "body": body}
+    finally:
+        response.close()
+
+
+@app.route('/api/batch', methods=['POST'])
+@require_auth()
+def batch():
+    """Run several API calls in one round trip
+
+    Body: {"requests": [{"method": "GET", "path": "/api/reports/unpaid"}, ...]}.
+    Consecutive GET requests run concurrently, others one at a time in the
+    given order; results come back in request order, each with its status.
+    """
+    data = request.get_json(silent=True) or {}
+    subs = data.get('requests')
+    if not isinstance(subs, list) or not 1 <= len(subs) <= MAX_BATCH_REQUESTS:
+        return {"error": f"requests must be a list of 1 to {MAX_BATCH_REQUESTS} sub-requests"}, 400
+    for sub in subs:
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), str) \
+                or not sub['path'].startswith('/api/'):
+            return {"error": "Every sub-request needs a path starting with /api/"}, 400
+        sub['method'] = str(sub.get('method', 'GET')).upper()
+        if sub['path'].split('?')[0] in ('/api/batch', '/api/login', '/api/logout'):
+            return {"error": f"{sub['path']} can't be part of a batch"}, 400
+
+    user = db.get_user_by_id(session['user_id'])
+    results = []
+    pending = []  # futures of the current run of GET requests
+    for sub in subs:
+        environ = subrequest_environ(sub, user)
+        if sub['method'] == 'GET':
+            pending.append(batch_pool.submit(dispatch_subrequest, environ))
+            continue
+        results += [future.result() for future in pending]
+        pending = []
+        results.append(dispatch_subrequest(environ))
+    results += [future.result() for future in pending]
+    return {"responses": results}
 
 
 @app.route('/')
@@ -209,10 +839,45 @@ def index():
     return 'Vitejte v systemu Evidence Faktur'
 
 
-def start_server(host='0.0.0.0', port=80, debug=False):
-    """Start the Flask server"""
+def prepare_server(timings=None):
+    """Sample data and background work, shared by the WSGI and the ASGI server"""
+    started = time.perf_counter()
     db.initialize_sample_data()
-    app.run(host=host, port=port, debug=debug)
+    if timings is not None:
+        timings.append(("initialize_sample_data", time.perf_counter() - started))
+
+    # Move customer details of existing invoices into the customers table without delaying startup
+    threading.Thread(target=db.migrate_customers, name='migrate-customers', daemon=True).start()
+    if backups.interval > 0:
+        backups.start()
+    if maintenance.interval > 0:
+        maintenance.start()
+    if report_snapshots.enabled:
+        report_snapshots.start()
+
+
+def start_server(host='0.0.0.0', port=80, debug=False, ready=None, timings=None):
+    """Start the Flask server
+
+    When a ``ready`` event is given, it is set as soon as the listening socket
+    is bound, so callers don't have to poll the server over HTTP. Phase
+    durations are appended to ``timings`` when provided.
+    """
+    prepare_server(timings)
+
+    if ready is None:
+        app.run(host=host, port=port, debug=debug)
+        return
+
+    from werkzeug.serving import make_server
+
+    started = time.perf_counter()
+    app.debug = debug
+    server = make_server(host, port, app, threaded=True)
+    if timings is not None:
+        timings.append(("bind server socket", time.perf_counter() - started))
+    ready.set()
+    server.serve_forever()
 
 
 if __name__ == '__main__':
@@ -3,7 +3,9 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from flask_restx import Api, Resource, fields, reqparse
 from flask_cors import CORS
+import hmac
 import os
+from profiling import init_profiling
 
 app = Flask(__name__)
 # Konfigurace DB (soubor app.db vedle app.py)
@@ -11,10 +13,18 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Enable CORS for all routes
-CORS(app)
+# Enable CORS for all routes (expose the total count used by the paginated frontend)
+CORS(app, expose_headers=['X-Total-Count'])
 
 db = SQLAlchemy(app)
+
+# Per-request profiling (X-Profile header), allowed only with the ITEMS_PROFILE_TOKEN token
+def profiling_allowed():
+    token = os.environ.get('ITEMS_PROFILE_TOKEN')
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Profile-Token', ''), token)
+
+init_profiling(app, profiling_allowed)
+
 api = Api(app,
           version='1.0',
           title='Simple Items API',
@@ -66,15 +76,20 @@ class ItemList(Resource):
     @ns.expect(list_parser)
     @ns.marshal_list_with(item_model)
     def get(self):
-        """Get list of items (with optional ?limit=&offset=)"""
+        """Get list of items (with optional ?limit=&offset=)
+
+        The total number of items is returned in the X-Total-Count header so
+        clients can size their view without downloading the whole collection.
+        """
         args = list_parser.parse_args()
-        query = ItemModel.query.order_by(ItemModel.created_at.desc())
+        total = ItemModel.query.count()
+        query = ItemModel.query.order_by(ItemModel.created_at.desc(), ItemModel.id.desc())
         if args.get('offset'):
             query = query.offset(args['offset'])
         if args.get('limit'):
             query = query.limit(args['limit'])
         items = query.all()
-        return [i.to_dict() for i in items], 200
+        return [i.to_dict() for i in items], 200, {'X-Total-Count': str(total)}
 
     @ns.expect(create_item_model, validate=True)
     @ns.marshal_with(item_model)
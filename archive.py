@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Hot/cold archival of old paid invoices
+
+Paid invoices issued before the cutoff are moved, in batched transactions,
+from the hot database into <db>_archive.db. Database reads union the archive
+in only when the requested date range reaches into it. Old entries of the
+invoice change log are compacted the same way.
+
+Usage:
+    python archive.py run [--years N] [--batch-size N] [--vacuum]
+    python archive.py restore [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+    python archive.py status
+    python archive.py compact-changes [--change-days N] [--tombstone-days N]
+"""
+
+import argparse
+import datetime
+import os
+
+from database import Database
+from sharding import ShardRouter
+
+# Paid invoices older than this many years are archived by default
+DEFAULT_ARCHIVE_YEARS = int(os.environ.get('INVOICE_ARCHIVE_YEARS', '3'))
+
+# Superseded change log entries, and delete tombstones, are kept this many days
+DEFAULT_CHANGE_DAYS = int(os.environ.get('INVOICE_CHANGE_RETENTION_DAYS', '30'))
+DEFAULT_TOMBSTONE_DAYS = int(os.environ.get('INVOICE_TOMBSTONE_RETENTION_DAYS', '90'))
+
+
+def archive_cutoff(years: int, today: datetime.date = None) -> str:
+    """Issue date before which paid invoices are archived"""
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=365 * years)).isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old paid invoices")
+    parser.add_argument('command', choices=['run', 'restore', 'status', 'compact-changes'])
+    parser.add_argument('--db', default='invoices.db', help='Hot database file')
+    parser.add_argument('--all-shards', action='store_true',
+                        help='Also process every company shard')
+    parser.add_argument('--shard-dir', default=os.environ.get('INVOICE_SHARD_DIR', 'shards'))
+    parser.add_argument('--years', type=int, default=DEFAULT_ARCHIVE_YEARS)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--since')
+    parser.add_argument('--until')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='VACUUM the hot database after archiving to shrink the file')
+    parser.add_argument('--change-days', type=int, default=DEFAULT_CHANGE_DAYS)
+    parser.add_argument('--tombstone-days', type=int, default=DEFAULT_TOMBSTONE_DAYS)
+    args = parser.parse_args()
+
+    databases = [Database(args.db)]
+    if args.all_shards:
+        router = ShardRouter(args.shard_dir)
+        databases += [router.open_shard(tenant_id) for tenant_id in router.tenants()]
+
+    for database in databases:
+        path = database.db_path
+        if args.command == 'run':
+            cutoff = archive_cutoff(args.years)
+            moved = database.archive_paid_invoices(cutoff, batch_size=args.batch_size)
+            if args.vacuum:
+                database.vacuum()
+            print(f"✓ {path}: archived {moved} paid invoices issued before {cutoff}")
+        elif args.command == 'restore':
+            restored = database.restore_archived_invoices(args.since, args.until,
+                                                          batch_size=args.batch_size)
+            print(f"✓ {path}: restored {restored} invoices")
+        elif args.command == 'compact-changes':
+            dropped = database.compact_invoice_changes(args.change_days, args.tombstone_days)
+            print(f"✓ {path}: dropped {dropped} change log entries")
+        else:
+            print(f"{path}: {database.get_archive_status()}")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
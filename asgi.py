@@ -0,0 +1,288 @@
+"""
+ASGI (asyncio) serving mode of the invoice API
+
+The event loop holds the connections, so thousands of mostly idle dashboard
+clients cost a socket each instead of a worker thread each. All SQLite work
+runs on a dedicated thread pool through the same Database methods, admission
+control and report coalescing as the WSGI app.
+
+The dashboard's read endpoints (/api/me, the invoice list and detail and the
+four reports) are served natively; every other request is passed to the
+Flask app on the same pool, so endpoints, sessions and auth behave exactly as
+under WSGI. Run with:
+
+    uvicorn asgi:application --port 80
+"""
+
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+import app as flask_app
+from database import Database
+from rows import Rows, iter_json_object
+
+# Threads doing the SQLite work (and the requests handed to Flask)
+DB_THREADS = int(os.environ.get('INVOICE_ASGI_DB_THREADS', '16'))
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='asgi-db')
+
+
+class Request:
+    """The parts of an ASGI HTTP request the native handlers need"""
+
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.body = body
+
+    @property
+    def remote_addr(self) -> Optional[str]:
+        client = self.scope.get('client')
+        return client[0] if client else None
+
+    def session(self) -> Dict[str, Any]:
+        """Flask session from the signed cookie (empty when missing or tampered with)"""
+        cookie_name = flask_app.app.config['SESSION_COOKIE_NAME']
+        value = parse_cookie(self.headers.get('cookie', '')).get(cookie_name)
+        serializer = flask_app.app.session_interface.get_signing_serializer(flask_app.app)
+        if not value or serializer is None:
+            return {}
+        try:
+            return serializer.loads(value, max_age=int(flask_app.app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return {}
+
+
+# === NATIVE HANDLERS ===
+# Each runs on the database pool as (request, user, tenant database, on_wait, **path params)
+# -> (body, status); on_wait releases the report slot while waiting for a coalesced report
+
+def get_current_user(request, user, database, on_wait):
+    return {"id": user['id'], "username": user['username'], "role": user['role']}, 200
+
+
+def get_invoices(request, user, database, on_wait):
+    try:
+        since, until = flask_app.date_arg('since', request.args), flask_app.date_arg('until', request.args)
+    except ValueError:
+        return {"error": "Invalid date format. Use YYYY-MM-DD"}, 400
+    try:
+        fields = flask_app.fields_arg(Database.INVOICE_FIELDS, request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    invoices, last_seq = database.get_invoices_with_last_seq(since=since, until=until, fields=fields, compact=True)
+    return {"invoices": invoices, "last_seq": last_seq}, 200
+
+
+def get_invoice(request, user, database, on_wait, invoice_id):
+    try:
+        fields = flask_app.fields_arg(Database.INVOICE_FIELDS, request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    invoice = database.get_invoice_by_id(int(invoice_id))
+    if invoice:
+        return ({name: invoice[name] for name in fields} if fields else invoice), 200
+    return {"error": "Invoice not found"}, 404
+
+
+def report(name: str, method: str, key: str, with_limit: bool = True,
+           fields: Optional[Dict[str, str]] = None) -> Callable:
+    """Native handler of a coalesced report (with ?fields= out of ``fields`` and compact rows when given)"""
+    def handler(request, user, database, on_wait):
+        try:
+            args = flask_app.report_args(with_limit=with_limit, params=request.args)
+            if fields is not None:
+                args += (flask_app.fields_arg(fields, request.args),)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        source, data_time = flask_app.report_snapshots.source(database)
+        compute = getattr(source, method)
+        kwargs = {'compact': True} if fields is not None else {}
+        try:
+            result = flask_app.report_flight.do((source.db_path, name) + args + tuple(sorted(kwargs.items())),
+                                                lambda: compute(*args, **kwargs),
+                                                timeout=flask_app.REPORT_WAIT_TIMEOUT, on_wait=on_wait)
+        except flask_app.SingleFlightTimeout:
+            return {"error": "Report computation timed out"}, 504
+        return {key: result, "as_of": flask_app.as_of(data_time)}, 200
+    return handler
+
+
+# (method, path pattern, Flask endpoint name for rate limits, handler)
+ROUTES: List[Tuple[str, 're.Pattern', str, Callable]] = [
+    ('GET', re.compile(r'^/api/me$'), 'get_current_user', get_current_user),
+    ('GET', re.compile(r'^/api/invoices$'), 'get_invoices', get_invoices),
+    ('GET', re.compile(r'^/api/invoices/(?P<invoice_id>\d+)$'), 'get_invoice', get_invoice),
+    ('GET', re.compile(r'^/api/reports/unpaid$'), 'get_unpaid_invoices',
+     report('unpaid_invoices', 'get_unpaid_invoices', 'invoices', fields=Database.INVOICE_FIELDS)),
+    ('GET', re.compile(r'^/api/reports/largest-debtors$'), 'get_largest_debtors',
+     report('largest_debtors', 'get_largest_debtors', 'debtors', fields=Database.DEBTOR_FIELDS)),
+    ('GET', re.compile(r'^/api/reports/average-payment-time$'), 'get_average_payment_time',
+     report('average_payment_time', 'get_average_payment_time', 'average_payment_days', with_limit=False)),
+    ('GET', re.compile(r'^/api/reports/overdue$'), 'get_overdue_invoices',
+     report('overdue_invoices', 'get_overdue_invoices', 'invoices', fields=Database.OVERDUE_FIELDS)),
+]
+
+
+def run_native(request: Request, handler: Callable, params: Dict[str, str],
+               release_slot: Callable[[], None]) -> Tuple[Any, int]:
+    """Authenticate like require_auth() and run a native handler (on the database pool)"""
+    session = request.session()
+    if 'user_id' not in session:
+        return {"error": "Authentication required"}, 401
+    user = flask_app.db.get_user_by_id(session['user_id'])
+    if not user:
+        return {"error": "User not found"}, 404
+    database: Database = flask_app.shards.get(user['company_id'])
+    return handler(request, user, database, release_slot, **params)
+
+
+def run_wsgi(request: Request) -> Tuple[str, List[Tuple[str, str]], bytes]:
+    """Run a request through the Flask app (on the database pool)"""
+    scope = request.scope
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': request.path,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': request.remote_addr or '',
+        'CONTENT_LENGTH': str(len(request.body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ[key] = value
+        elif key != 'CONTENT_LENGTH':
+            environ[f'HTTP_{key}'] = value
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = status, headers
+
+    result = flask_app.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def send_response(send, status: int, headers: List[Tuple[str, str]], body: bytes):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, request: Request, body: Any, status: int, extra_headers=()):
+    # Same serialization as Flask's JSON responses
+    headers = [('Content-Type', 'application/json'), *extra_headers]
+    if 'origin' in request.headers:
+        headers.append(('Access-Control-Allow-Origin', '*'))
+    if isinstance(body, dict) and any(isinstance(value, Rows) for value in body.values()):
+        return await send_streamed_json(send, body, status, headers)
+    data = f"{flask_app.compact_dumps(body)}\n".encode()
+    await send_response(send, status, headers + [('Content-Length', str(len(data)))], data)
+
+
+async def send_streamed_json(send, body: Dict[str, Any], status: int, headers: List[Tuple[str, str]]):
+    """Send a body with compact Rows in chunks, encoding each chunk on the database pool"""
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    chunks = iter_json_object(body, flask_app.compact_dumps, sort_keys=flask_app.app.json.sort_keys)
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(db_executor, next, chunks, None)
+        if chunk is None:
+            break
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'\n'})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(db_executor, flask_app.prepare_server)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, await read_body(receive))
+    loop = asyncio.get_running_loop()
+    match = None
+    # Profiled requests go through Flask, where the profiling hook lives
+    if 'x-profile' not in request.headers and '_profile' not in request.args:
+        for method, pattern, endpoint, handler in ROUTES:
+            match = pattern.match(request.path) if method == request.method else None
+            if match:
+                break
+    if match is None:
+        status, headers, body = await loop.run_in_executor(db_executor, run_wsgi, request)
+        return await send_response(send, int(status.split()[0]), headers, body)
+
+    # Same admission control as the WSGI app's before_request hook
+    client = request.session().get('user_id') or f"addr:{request.remote_addr}"
+    rejection, holds_slot = flask_app.admission.admit(client, endpoint, request.path)
+    if rejection:
+        body, status, headers = rejection
+        return await send_json(send, request, body, status, headers.items())
+
+    slot = {'held': holds_slot}
+
+    def release_slot():
+        if slot.pop('held', False):
+            flask_app.admission.release()
+
+    try:
+        body, status = await loop.run_in_executor(db_executor, run_native, request, handler,
+                                                  match.groupdict(), release_slot)
+    finally:
+        release_slot()
+    await send_json(send, request, body, status)
\ No newline at end of file
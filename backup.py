@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Online backups of the SQLite databases
+
+Backups use the SQLite online backup API and copy a bounded number of pages
+per step, pausing in between, so the source is only read-locked for short
+moments and request handling keeps going while a backup runs. A write between
+two steps restarts the copy; it is then retried after a growing pause with
+larger (but still bounded) steps, and never finished under one long lock.
+Databases in WAL mode are copied from a single read transaction instead,
+which writers don't wait for. Every copy is written to a temporary file,
+checked with PRAGMA integrity_check and only then renamed into the backup
+directory, so a listed backup is always usable. A restore bumps the cache
+generations of the database, so running servers drop what they cached.
+
+Usage:
+    python backup.py run [--db FILE ...] [--all-shards] [--keep N]
+    python backup.py list [--db FILE ...]
+    python backup.py restore BACKUP_FILE [--db FILE] [--shard-dir DIR]
+    python backup.py schedule [--interval SECONDS] [--keep N]
+"""
+
+import argparse
+import datetime
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from coherence import CACHE_SLOTS, generation, generation_path, release
+from sharding import ARCHIVE_DIR, ShardRouter
+
+DEFAULT_BACKUP_DIR = os.environ.get('INVOICE_BACKUP_DIR', 'backups')
+
+# Newest backups kept per database
+DEFAULT_KEEP = int(os.environ.get('INVOICE_BACKUP_KEEP', '7'))
+
+# Pages copied per step and pause between steps; 256 pages of 4 KiB = 1 MiB per lock
+DEFAULT_PAGES_PER_STEP = 256
+DEFAULT_STEP_PAUSE = 0.005
+
+# Restarts caused by concurrent writes before a copy gives up, the first pause after
+# one (doubled after each further restart) and the cap of the growing step size
+DEFAULT_MAX_RESTARTS = 8
+RESTART_BACKOFF = 0.05
+MAX_PAGES_PER_STEP = 4096  # 16 MiB of 4 KiB pages per lock
+
+BACKUP_TIME_FORMAT = '%Y%m%d-%H%M%S'
+BACKUP_FILE_PATTERN = re.compile(r'^-\d{8}-\d{6}\.db$')
+
+
+class BackupError(Exception):
+    """Raised when a backup or restore copy fails its integrity check"""
+
+
+def integrity_check(path: str) -> str:
+    """Result of PRAGMA integrity_check ('ok' for a healthy database)"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return '; '.join(row[0] for row in conn.execute("PRAGMA integrity_check"))
+    finally:
+        conn.close()
+
+
+class _ChasingWriters(Exception):
+    """The source changed under a stepwise copy"""
+
+
+def copy_database(source: str, target: str, pages: int, pause: float,
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  max_restarts: int = DEFAULT_MAX_RESTARTS) -> Dict[str, Any]:
+    """Copy ``source`` into ``target`` with the online backup API
+
+    A WAL source is read within one read transaction: the copy is a single
+    snapshot, never restarts, and writers carry on meanwhile. Otherwise a
+    write through another connection restarts the copy from the first page;
+    it is retried after RESTART_BACKOFF (doubling) with doubled steps up to
+    MAX_PAGES_PER_STEP, and BackupError is raised after ``max_restarts``.
+    """
+    state = {"steps": 0, "total": 0, "done": 0, "restarts": 0, "attempt_steps": 0}
+
+    def on_step(status, remaining, total):
+        done = total - remaining
+        if state["attempt_steps"] and done <= state["done"]:
+            state["restarts"] += 1
+            raise _ChasingWriters()
+        state.update(steps=state["steps"] + 1, attempt_steps=state["attempt_steps"] + 1, total=total, done=done)
+        if progress:
+            progress(done, total)
+        if remaining and pause:
+            time.sleep(pause)
+
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # starts the read transaction
+        step_pages, backoff = pages, RESTART_BACKOFF
+        while True:
+            try:
+                src.backup(dst, pages=step_pages, progress=on_step)
+                break
+            except _ChasingWriters:
+                if state["restarts"] > max_restarts:
+                    raise BackupError(f"{source} kept changing, copy restarted {state['restarts']} times")
+                time.sleep(backoff)
+                backoff *= 2
+                if step_pages > 0:
+                    step_pages = min(step_pages * 2, MAX_PAGES_PER_STEP)
+                state.update(attempt_steps=0, done=0)
+        page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return {"pages": state["total"], "steps": state["steps"], "restarts": state["restarts"],
+            "bytes": state["total"] * page_size}
+
+
+def backup_name(path: str) -> str:
+    """File name prefix of the backups of a database"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    # A shard's archive (shards/archive/acme.db) must not share the shard's prefix
+    if os.path.basename(os.path.dirname(path)) == ARCHIVE_DIR:
+        name += '_archive'
+    return name
+
+
+def list_backups(path: str, backup_dir: str = DEFAULT_BACKUP_DIR) -> List[str]:
+    """Backups of a database, newest first"""
+    name = backup_name(path)
+    pattern = os.path.join(backup_dir, f"{glob.escape(name)}-*.db")
+    return sorted((backup for backup in glob.glob(pattern)
+                   if BACKUP_FILE_PATTERN.match(os.path.basename(backup)[len(name):])), reverse=True)
+
+
+def prune_backups(path: str, keep: int, backup_dir: str = DEFAULT_BACKUP_DIR) -> int:
+    """Delete all but the ``keep`` newest backups of a database"""
+    expired = list_backups(path, backup_dir)[keep:]
+    for backup in expired:
+        os.remove(backup)
+    return len(expired)
+
+
+def backup_database(path: str, backup_dir: str = DEFAULT_BACKUP_DIR, keep: Optional[int] = DEFAULT_KEEP,
+                    pages: int = DEFAULT_PAGES_PER_STEP, pause: float = DEFAULT_STEP_PAUSE,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """Back up one database into ``backup_dir`` and return the backup metrics"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime(BACKUP_TIME_FORMAT)
+    target = os.path.join(backup_dir, f"{backup_name(path)}-{stamp}.db")
+    partial = target + '.partial'
+
+    started = time.perf_counter()
+    try:
+        metrics = copy_database(path, partial, pages, pause, progress)
+        copied = time.perf_counter()
+        result = integrity_check(partial)
+        if result != 'ok':
+            raise BackupError(f"Backup of {path} failed the integrity check: {result}")
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    pruned = prune_backups(path, keep, backup_dir) if keep else 0
+    return {
+        "database": path,
+        "backup": target,
+        **metrics,
+        "copy_seconds": round(copied - started, 3),
+        "verify_seconds": round(time.perf_counter() - copied, 3),
+        "duration_seconds": round(time.perf_counter() - started, 3),
+        "pruned": pruned
+    }
+
+
+def restore_database(backup: str, path: str, pages: int = DEFAULT_PAGES_PER_STEP,
+                     pause: float = DEFAULT_STEP_PAUSE) -> Dict[str, Any]:
+    """Replace the contents of ``path`` with a verified backup
+
+    The copy goes through the backup API as well, so connections the server
+    holds open see the restored data instead of a swapped-out file, and the
+    servers' caches of the database are invalidated.
+    """
+    result = integrity_check(backup)
+    if result != 'ok':
+        raise BackupError(f"{backup} failed the integrity check: {result}")
+    started = time.perf_counter()
+    metrics = copy_database(backup, path, pages, pause)
+    invalidate_caches(path)
+    return {"database": path, "backup": backup, **metrics,
+            "duration_seconds": round(time.perf_counter() - started, 3)}
+
+
+def invalidate_caches(path: str):
+    """Make every process drop its cached rows of ``path`` (of the hot database, for an archive)"""
+    directory, name = os.path.split(path)
+    if os.path.basename(directory) == ARCHIVE_DIR:  # shards/archive/acme.db -> shards/acme.db
+        path = os.path.join(os.path.dirname(directory), name)
+    elif os.path.splitext(name)[0].endswith('_archive'):  # invoices_archive.db -> invoices.db
+        base, extension = os.path.splitext(path)
+        path = base[:-len('_archive')] + extension
+    # Without a generation file no process has cached anything of the database
+    if os.path.exists(generation_path(path)):
+        counters = [generation(path, name) for name in CACHE_SLOTS]
+        for counter in counters:
+            counter.bump()
+        release(*counters)
+
+
+# Invoice database with its archive, and the items API database
+DEFAULT_DATABASES = ('invoices.db', 'invoices_archive.db', 'app.db')
+
+
+def default_databases() -> List[str]:
+    """Default databases present in the working directory"""
+    return [path for path in DEFAULT_DATABASES if os.path.exists(path)]
+
+
+def restore_target(backup: str, router: ShardRouter) -> str:
+    """Database a backup file belongs to: a default database or a file of an existing shard
+
+    Raises ValueError when the backup's name matches none of them or more than
+    one (a company called "invoices"), the target must then be given explicitly.
+    """
+    name = os.path.basename(backup)
+    prefix = name.rsplit('-', 2)[0]
+    if not BACKUP_FILE_PATTERN.match(name[len(prefix):]):
+        raise ValueError(f"{backup} is not named like a backup")
+    candidates = [path for path in DEFAULT_DATABASES if path == prefix + '.db']
+    tenants = router.tenants()
+    if prefix in tenants:
+        candidates.append(router.shard_path(prefix))
+    if prefix.endswith('_archive') and prefix[:-len('_archive')] in tenants:
+        candidates.append(router.archive_path(prefix[:-len('_archive')]))
+    if len(candidates) != 1:
+        found = f"could be any of {', '.join(candidates)}" if candidates else "matches no database"
+        raise ValueError(f"{backup} {found}, give the target with --db")
+    return candidates[0]
+
+
+class BackupScheduler:
+    """Background thread backing up a set of databases at a fixed interval"""
+
+    def __init__(self, paths: Callable[[], List[str]], interval: float, backup_dir: str = DEFAULT_BACKUP_DIR,
+                 keep: int = DEFAULT_KEEP):
+        self.paths = paths
+        self.interval = interval
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._failures = 0
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._progress: Dict[str, float] = {}
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._loop, name='backup-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self) -> List[Dict[str, Any]]:
+        """Back up every database now; a failing database doesn't stop the others"""
+        results = []
+        for path in self.paths():
+            def progress(done, total, path=path):
+                with self._lock:
+                    self._progress[path] = round(done / total, 3) if total else 1.0
+            try:
+                result = backup_database(path, self.backup_dir, self.keep, progress=progress)
+            except Exception as e:
+                result = {"database": path, "error": str(e)}
+            with self._lock:
+                self._progress.pop(path, None)
+                self._runs += 1
+                self._failures += 'error' in result
+                self._last[path] = {**result, "finished_at": datetime.datetime.now().isoformat(timespec='seconds')}
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Run counts, backups in progress and the last result per database"""
+        with self._lock:
+            return {
+                "interval_seconds": self.interval,
+                "runs": self._runs,
+                "failures": self._failures,
+                "in_progress": dict(self._progress),
+                "last": dict(self._last)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the SQLite databases")
+    parser.add_argument('command', choices=['run', 'list', 'restore', 'schedule'])
+    parser.add_argument('backup', nargs='?', help='Backup file to restore')
+    parser.add_argument('--db', action='append', help='Database file (repeatable, default: all present)')
+    parser.add_argument('--all-shards', action='store_true', help='Also back up every company shard')
+    parser.add_argument('--shard-dir', default=os.environ.get('INVOICE_SHARD_DIR', 'shards'))
+    parser.add_argument('--backup-dir', default=DEFAULT_BACKUP_DIR)
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP)
+    parser.add_argument('--interval', type=float, default=24 * 3600, help='Seconds between scheduled runs')
+    args = parser.parse_args()
+
+    def paths():
+        selected = list(args.db or default_databases())
+        if args.all_shards:
+            router = ShardRouter(args.shard_dir)
+            selected += router.database_paths()
+        return selected
+
+    if args.command == 'restore':
+        if not args.backup:
+            parser.error("restore needs the backup file")
+        try:
+            target = (args.db or [None])[0] or restore_target(args.backup, ShardRouter(args.shard_dir))
+        except ValueError as e:
+            parser.error(str(e))
+        result = restore_database(args.backup, target)
+        print(f"✓ {target}: restored {result['pages']} pages from {args.backup} "
+              f"in {result['duration_seconds']} s")
+    elif args.command == 'list':
+        for path in paths():
+            for backup in list_backups(path, args.backup_dir):
+                print(f"{path}: {backup} ({os.path.getsize(backup)} bytes)")
+    elif args.command == 'schedule':
+        scheduler = BackupScheduler(paths, args.interval, args.backup_dir, args.keep)
+        print(f"Backing up every {args.interval:g} s into {args.backup_dir}/ (Ctrl+C to stop)")
+        try:
+            while True:
+                for result in scheduler.run_once():
+                    print(result)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+    else:
+        for path in paths():
+            result = backup_database(path, args.backup_dir, args.keep,
+                                     progress=lambda done, total: print(f"\r{path}: {done}/{total} pages",
+                                                                         end='', flush=True))
+            print(f"\r✓ {path}: {result['backup']} ({result['bytes']} bytes, {result['steps']} steps, "
+                  f"{result['duration_seconds']} s)")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the WSGI (threaded werkzeug) and ASGI (uvicorn) serving modes
+
+Both servers run the same app on a copy of the sample database with extra
+invoices. The client holds a number of idle connections, like open
+dashboards waiting for their next refresh, while active connections request
+a report in a loop, and reports throughput, latency percentiles, errors and the server's thread
+count and memory. Rate limits are lifted in the benchmarked servers, so the
+numbers show serving capacity rather than admission control.
+
+Usage:
+    python bench_asgi.py [--idle 2000] [--active 50] [--seconds 10] [--invoices 5000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_SETUP = '''
+import app
+from admission import RouteLimit
+app.admission.default = RouteLimit(rate=1e9, burst=10 ** 9)
+app.admission.routes = dict()
+app.admission.max_expensive = 10 ** 6
+'''
+
+SERVERS = {
+    'wsgi': SERVER_SETUP + '''
+from werkzeug.serving import make_server
+app.prepare_server()
+make_server('127.0.0.1', {port}, app.app, threaded=True).serve_forever()
+''',
+    'asgi': SERVER_SETUP + '''
+import uvicorn
+uvicorn.run('asgi:application', host='127.0.0.1', port={port}, log_level='warning',
+            backlog=4096, timeout_keep_alive=300)
+''',
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_database(work_dir: str, invoices: int):
+    """Sample data plus ``invoices`` extra invoices in work_dir/invoices.db"""
+    sys.path.insert(0, REPO_DIR)
+    from database import Database
+    database = Database(os.path.join(work_dir, 'invoices.db'))
+    database.initialize_sample_data()
+    with database.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO invoices (invoice_number, customer_name, issue_date, due_date, total_amount, "
+            "payment_status) VALUES (?, ?, ?, ?, ?, ?)",
+            # A generator, so millions of rows are never held in memory at once
+            ((f"B{n:08d}", f"Customer {n % 300}", '2025-01-01', '2025-01-15', 100 + n % 900,
+              'nezaplaceno' if n % 3 else 'zaplaceno') for n in range(invoices))
+        )
+        conn.commit()
+    database.migrate_customers()
+
+
+def server_usage(pid: int) -> dict:
+    """Thread count and resident memory of a process (Linux)"""
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    usage['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    usage['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+async def http(reader, writer, method: str, path: str, body: bytes = b'', cookie: str = ''):
+    """One request on a keep-alive connection; returns (status, headers, body)"""
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+    if body:
+        head += "Content-Type: application/json\r\n"
+    if cookie:
+        head += f"Cookie: {cookie}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split()[1]), headers, data
+
+
+async def wait_until_up(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+async def run_load(port: int, idle: int, active: int, seconds: float, path: str, pid: int) -> dict:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    credentials = json.dumps({'username': 'owner', 'password': 'owner123'}).encode()
+    _, headers, _ = await http(reader, writer, 'POST', '/api/login', credentials)
+    cookie = headers['set-cookie'].split(';')[0]
+    writer.close()
+
+    # Idle dashboards: connected, but not sending anything
+    idle_connections = []
+    for _ in range(idle):
+        try:
+            idle_connections.append((await asyncio.open_connection('127.0.0.1', port))[1])
+        except OSError:
+            break
+
+    latencies, errors = [], 0
+    deadline = time.monotonic() + seconds
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status, headers, _ = await http(reader, writer, 'GET', path, cookie=cookie)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                continue
+            if headers.get('connection') == 'close':  # the werkzeug server doesn't keep connections alive
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        writer.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(active)))
+    elapsed = time.monotonic() - started
+    usage = server_usage(pid)
+    for writer in idle_connections:
+        writer.close()
+
+    latencies.sort()
+    return {
+        "idle_connections": len(idle_connections),
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1) if latencies else None,
+        **usage
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the WSGI and ASGI serving modes")
+    parser.add_argument('--idle', type=int, default=2000, help='Idle keep-alive connections held open')
+    parser.add_argument('--active', type=int, default=50, help='Connections sending requests in a loop')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--invoices', type=int, default=5000, help='Extra invoices in the benchmark database')
+    parser.add_argument('--path', default='/api/reports/unpaid?limit=50')
+    parser.add_argument('--modes', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-asgi-')
+    try:
+        seed_database(work_dir, args.invoices)
+        for mode in args.modes.split(','):
+            port = free_port()
+            env = {**os.environ, 'PYTHONPATH': REPO_DIR}
+            server = subprocess.Popen([sys.executable, '-c', SERVERS[mode].format(port=port)],
+                                      cwd=work_dir, env=env, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+            try:
+                asyncio.run(wait_until_up(port))
+                result = asyncio.run(run_load(port, args.idle, args.active, args.seconds, args.path, server.pid))
+                print(f"{mode}: {result}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
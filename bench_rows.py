@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the dict and the compact (tuple) row modes on a large invoice listing
+
+Seeds a database with the given number of invoices, then runs each mode in a
+fresh process: GET /api/invoices' work of reading every invoice and encoding
+the JSON body, as dicts plus one JSON string (the old path) or as compact
+Rows streamed in chunks (the new one). Reports the time of both phases, the
+garbage collector's pause time and the peak resident memory above the
+process's baseline.
+
+Usage:
+    python bench_rows.py [--invoices 1000000] [--modes dict,compact]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_asgi import seed_database
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MEASURE = '''
+import gc, json, resource, sys, time
+sys.path.insert(0, {repo_dir!r})
+import app
+from rows import iter_json_object
+
+gc_pause = [0.0, None]
+def on_gc(phase, info):
+    if phase == 'start':
+        gc_pause[1] = time.perf_counter()
+    elif gc_pause[1] is not None:
+        gc_pause[0] += time.perf_counter() - gc_pause[1]
+gc.callbacks.append(on_gc)
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+invoices = app.db.get_all_invoices(compact={compact})
+fetched = time.perf_counter()
+if {compact}:
+    size = sum(len(chunk) for chunk in iter_json_object({{"invoices": invoices}}, app.compact_dumps))
+else:
+    size = len(app.compact_dumps({{"invoices": invoices}}))
+finished = time.perf_counter()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "rows": len(invoices),
+    "fetch_s": round(fetched - started, 2),
+    "serialize_s": round(finished - fetched, 2),
+    "total_s": round(finished - started, 2),
+    "gc_pause_s": round(gc_pause[0], 2),
+    "json_mb": round(size / 2 ** 20, 1),
+    "peak_rss_mb": round((peak - baseline) / 1024, 1)
+}}))
+'''
+
+MODES = {'dict': False, 'compact': True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the dict and compact row modes")
+    parser.add_argument('--invoices', type=int, default=1000000, help='Invoices in the benchmark database')
+    parser.add_argument('--modes', default='dict,compact')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-rows-')
+    try:
+        started = time.perf_counter()
+        seed_database(work_dir, args.invoices)
+        print(f"Seeded {args.invoices} invoices in {time.perf_counter() - started:.1f} s")
+        for mode in args.modes.split(','):
+            code = MEASURE.format(repo_dir=REPO_DIR, compact=MODES[mode])
+            output = subprocess.run([sys.executable, '-c', code], cwd=work_dir, check=True,
+                                    capture_output=True, text=True).stdout
+            print(f"{mode}: {json.loads(output.strip().splitlines()[-1])}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Cross-process cache invalidation through shared generation counters
+
+Every database gets a small memory-mapped file next to it holding one 64-bit
+counter per cache. A process that writes bumps the counter of the affected
+cache; every process compares the counter with the value it last saw before
+using its cache, which costs one memory read, and drops the cache when it
+changed. No server or extra query is needed, so in-process caches stay safe
+with several worker processes on the same database files.
+
+A file is mapped once per process and shared by every counter handed out for
+it; it is unmapped and closed when the last of them is released.
+"""
+
+import contextlib
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: bumps aren't serialized between processes, but still change the value
+    fcntl = None
+
+SLOT = struct.Struct('<Q')
+SLOTS = 8
+CACHE_SLOTS = {'invoices': 0, 'users': 1}
+
+_files: Dict[str, 'GenerationFile'] = {}
+_files_lock = threading.Lock()
+
+
+class GenerationFile:
+    """Memory-mapped file of SLOTS generation counters"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        with self._locked():
+            if os.fstat(self._fd).st_size < SLOT.size * SLOTS:
+                os.ftruncate(self._fd, SLOT.size * SLOTS)
+        self._map = mmap.mmap(self._fd, SLOT.size * SLOTS)
+        self.references = 0  # Generations handed out and not released yet
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exclusive against the other threads of this process and against other processes"""
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def read(self, slot: int) -> int:
+        return SLOT.unpack_from(self._map, slot * SLOT.size)[0]
+
+    def bump(self, slot: int) -> Tuple[int, int]:
+        """Increment a counter; returns (previous, new)"""
+        with self._locked():
+            previous = self.read(slot)
+            SLOT.pack_into(self._map, slot * SLOT.size, previous + 1)
+            return previous, previous + 1
+
+    def close(self):
+        """Unmap the counters and close the file"""
+        with self._lock:
+            self._map.close()
+            os.close(self._fd)
+
+
+class Generation:
+    """One cache's counter in a GenerationFile"""
+
+    def __init__(self, file: GenerationFile, name: str):
+        self.file = file
+        self.slot = CACHE_SLOTS[name]
+
+    def value(self) -> int:
+        return self.file.read(self.slot)
+
+    def bump(self) -> Tuple[int, int]:
+        return self.file.bump(self.slot)
+
+
+def generation_path(db_path: str) -> str:
+    """Generation file of a database (invoices.db -> invoices.generations)"""
+    return os.path.splitext(db_path)[0] + '.generations'
+
+
+def generation(db_path: str, name: str) -> Generation:
+    """Counter of cache ``name`` of a database, mapping its file once per process
+
+    Pass the counter to release() once it is no longer used.
+    """
+    path = os.path.abspath(generation_path(db_path))
+    with _files_lock:
+        if path not in _files:
+            _files[path] = GenerationFile(path)
+        _files[path].references += 1
+        return Generation(_files[path], name)
+
+
+def release(*generations: Generation):
+    """Give up counters; a file is closed when no counter of it is left"""
+    with _files_lock:
+        for counter in generations:
+            file = counter.file
+            file.references -= 1
+            if not file.references:
+                del _files[file.path]
+                file.close()
\ No newline at end of file
@@ -1,25 +1,87 @@
+import os
+import re
 import sqlite3
-import hashlib
-import datetime
-from typing import List, Dict, Any, Optional
+import weakref
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
+
+import passwords
+from coherence import generation, release
+from entity_cache import EntityCache
+from rows import Rows
+
+# Invoices kept in each database's lookup cache
+INVOICE_CACHE_SIZE = int(os.environ.get('INVOICE_CACHE_SIZE', '10000'))
+# Users kept in each database's lookup cache (every authenticated request looks one up)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1000'))
+
+
+class ChangesCompacted(ValueError):
+    """Raised when change log entries a delta sync needs have been compacted away"""
+
+    def __init__(self, purged_through: int):
+        super().__init__(f"Changes up to {purged_through} have been compacted")
+        self.purged_through = purged_through
 
 
 class Database:
-    def __init__(self, db_path: str = 'invoices.db'):
+    # Bump whenever init_db gains a migration step so existing databases re-run it
+    SCHEMA_VERSION = 8
+
+    def __init__(self, db_path: str = 'invoices.db', archive_path: Optional[str] = None,
+                 cache_size: int = INVOICE_CACHE_SIZE):
         self.db_path = db_path
+        # Old paid invoices are moved to this file, attached as the 'archive' schema
+        self.archive_path = archive_path or os.path.splitext(db_path)[0] + '_archive.db'
+        # Single-invoice and user lookups; every write invalidates them, also in the
+        # other processes serving this database (through its .generations file)
+        self.invoice_cache = EntityCache(cache_size, key='id', alt_key='invoice_number',
+                                         shared=generation(db_path, 'invoices'))
+        self.user_cache = EntityCache(USER_CACHE_SIZE, key='id', alt_key='username',
+                                      shared=generation(db_path, 'users'))
+        # The generation file stays mapped while this object lives or until close()
+        self._release = weakref.finalize(self, release, self.invoice_cache.shared, self.user_cache.shared)
         self.init_db()
 
+    def close(self):
+        """Release the generation file; the caches must not be used afterwards"""
+        self._release()
+
     def get_connection(self):
         """Get a database connection"""
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row  # This enables column access by name
         return conn
 
+    @staticmethod
+    def _cursor(conn, compact: bool = False):
+        """Cursor returning sqlite3.Row, or plain tuples for a compact result"""
+        cursor = conn.cursor()
+        if compact:
+            cursor.row_factory = None
+        return cursor
+
+    @staticmethod
+    def _fetch_all(cursor, compact: bool = False) -> Union[List[Dict[str, Any]], Rows]:
+        """Remaining rows as dicts, or as compact Rows (see rows.py)"""
+        if compact:
+            return Rows.from_cursor(cursor)
+        return [dict(row) for row in cursor.fetchall()]
+
     def init_db(self):
         """Initialize database tables for invoice management"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
 
+            # Skip the DDL entirely when the schema is already up to date
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return
+
+            # New files return freed pages in small steps (maintenance.py); must precede the first table
+            if version == 0:
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
             # Users table for owner and accountant roles
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -51,8 +113,102 @@ class Database:
                 )
             ''')
 
+            # Version 2: users belong to a company (tenant), NULL means the default database
+            if version < 2:
+                self._add_column(cursor, 'users', 'company_id TEXT')
+
+            # Version 3: hot/cold archival of old paid invoices
+            if version < 3:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS archive_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        max_issue_date DATE -- newest issue date in the archive, NULL when empty
+                    )
+                ''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_issue_date ON invoices(issue_date)")
+
+            # Version 4: customers normalized into their own table, keyed by IČ.
+            # Existing invoices are moved over by migrate_customers() in the background.
+            if version < 4:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS customers (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ic TEXT UNIQUE, -- IČ, NULL for customers without one
+                        dic TEXT, -- DIČ
+                        name TEXT NOT NULL COLLATE NOCASE,
+                        address TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name)")
+                self._add_column(cursor, 'invoices', 'customer_id INTEGER REFERENCES customers(id)')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_customer "
+                               "ON invoices(customer_id, payment_status)")
+
+            # Version 5: reports filter on payment status plus an issue or due date range
+            if version < 5:
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status_due "
+                               "ON invoices(payment_status, due_date)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status_issue "
+                               "ON invoices(payment_status, issue_date)")
+
+            # Version 6: incremental refresh of the analytics snapshot reads changed invoices
+            if version < 6:
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_updated_at ON invoices(updated_at)")
+
+            # Version 7: server-side invoice numbers from per-year sequences
+            if version < 7:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS invoice_sequences (
+                        year INTEGER PRIMARY KEY,
+                        next_seq INTEGER NOT NULL -- next number to hand out
+                    )
+                ''')
+                self._seed_invoice_sequences(conn)
+
+            # Version 8: append-only change log for delta sync, starting with every existing invoice
+            if version < 8:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS invoice_changes (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        invoice_id INTEGER NOT NULL,
+                        operation TEXT NOT NULL, -- 'insert', 'update' or 'delete'
+                        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoice_changes_invoice "
+                               "ON invoice_changes(invoice_id, seq)")
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS change_log_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        purged_through INTEGER NOT NULL -- tombstones up to this seq were dropped
+                    )
+                ''')
+                self._seed_change_log(conn)
+
+            cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
             conn.commit()
 
+            # Keep the archive schema in step with the hot table
+            if os.path.exists(self.archive_path):
+                self._attach_archive(conn, create=True)
+
+    @staticmethod
+    def _add_column(cursor, table: str, column_def: str):
+        """Add a column to an existing table unless it is already there"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column_def.split()[0] not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
+
+    def vacuum(self):
+        """Rebuild the database file to reclaim free pages"""
+        conn = self.get_connection()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
     def initialize_sample_data(self):
         """Initialize sample data for the invoice system"""
         with self.get_connection() as conn:
@@ -89,38 +245,41 @@ class Database:
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                 invoices
             )
+            self._seed_invoice_sequences(conn)
+            self._seed_change_log(conn)
 
             conn.commit()
 
     @staticmethod
     def hash_password(password: str) -> str:
-        """Hash password"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Salted KDF hash of a password (see passwords.py)"""
+        return passwords.hash_password(password)
 
     # User methods
-    def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Get user by ID"""
+    def _load_user(self, column: str, value) -> Optional[Dict[str, Any]]:
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            cursor.execute(f"SELECT * FROM users WHERE {column} = ?", (value,))
             row = cursor.fetchone()
             return dict(row) if row else None
 
+    def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        return self.user_cache.get_or_load('id', user_id, lambda: self._load_user('id', user_id))
+
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user by username"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return self.user_cache.get_or_load('username', username,
+                                           lambda: self._load_user('username', username))
 
-    def create_user(self, username: str, password: str, role: str) -> Dict[str, Any]:
-        """Create new user"""
+    def create_user(self, username: str, password: str, role: str,
+                    company_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create new user, optionally bound to a company shard"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                (username, self.hash_password(password), role)
+                "INSERT INTO users (username, password, role, company_id) VALUES (?, ?, ?, ?)",
+                (username, self.hash_password(password), role, company_id)
             )
             user_id = cursor.lastrowid
             conn.commit()
@@ -128,14 +287,15 @@ class Database:
             return {
                 "id": user_id,
                 "username": username,
-                "role": role
+                "role": role,
+                "company_id": company_id
             }
 
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Get all users (without passwords)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id, username, role, created_at FROM users")
+            cursor.execute("SELECT id, username, role, company_id, created_at FROM users")
             return [dict(row) for row in cursor.fetchall()]
 
     def update_user_password(self, user_id: int, new_password: str):
@@ -147,48 +307,479 @@ class Database:
                 (self.hash_password(new_password), user_id)
             )
             conn.commit()
+        self.user_cache.invalidate([user_id])
 
-    # Invoice methods
-    def get_all_invoices(self) -> List[Dict[str, Any]]:
-        """Get all invoices"""
+    def rehash_user_password(self, user_id: int, old_hash: str, new_hash: str):
+        """Replace an outdated password hash, unless the password changed meanwhile"""
+        with self.get_connection() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                         (new_hash, user_id, old_hash))
+            conn.commit()
+        self.user_cache.invalidate([user_id])
+
+    # Archive methods
+    def _attach_archive(self, conn, create: bool = False) -> bool:
+        """Attach the archive database as schema 'archive'
+
+        Without ``create`` nothing is attached (and False is returned) while the
+        archive is empty, so reads of the hot data never pay for it.
+        """
+        if not create:
+            row = conn.execute("SELECT max_issue_date FROM archive_state WHERE id = 1").fetchone()
+            if not row or row[0] is None:
+                return False
+
+        if 'archive' not in [row[1] for row in conn.execute("PRAGMA database_list")]:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        if create:
+            conn.execute("PRAGMA archive.auto_vacuum = INCREMENTAL")  # only takes effect on a new file
+            # Create the archive table from the hot table's DDL, then add columns added since.
+            # Foreign keys are dropped: their parent tables live in the main database.
+            sql = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'invoices'"
+            ).fetchone()[0]
+            sql = re.sub(r'\s+REFERENCES\s+\w+\s*\(\w+\)', '', sql)
+            conn.execute(re.sub(r'^CREATE TABLE\s+"?invoices"?',
+                                'CREATE TABLE IF NOT EXISTS archive.invoices', sql))
+            archived = [row[1] for row in conn.execute("PRAGMA archive.table_info(invoices)")]
+            for row in conn.execute("PRAGMA main.table_info(invoices)").fetchall():
+                if row[1] not in archived:
+                    conn.execute(f"ALTER TABLE archive.invoices ADD COLUMN {row[1]} {row[2]}")
+            conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_invoices_issue_date "
+                         "ON invoices(issue_date)")
+        return True
+
+    @staticmethod
+    def _date_range(column: str, since: Optional[str], until: Optional[str]):
+        """WHERE clause (and its parameters) restricting a date column to [since, until]"""
+        conditions, params = [], []
+        if since is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(until)
+        return ("WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+    def _invoices_source(self, conn, since: Optional[str] = None) -> str:
+        """Table expression for invoice reads starting at ``since`` (issue date)
+
+        The archive is unioned in only when the requested range reaches into it.
+        """
+        row = conn.execute("SELECT max_issue_date FROM archive_state WHERE id = 1").fetchone()
+        if not row or row[0] is None or (since is not None and since > row[0]):
+            return "invoices"
+        self._attach_archive(conn)
+        return "(SELECT * FROM main.invoices UNION ALL SELECT * FROM archive.invoices)"
+
+    def _move_invoices(self, conn, source: str, target: str, ids: List[int]):
+        """Move invoices between the hot and archive schemas and refresh the watermark"""
+        placeholders = ', '.join('?' * len(ids))
+        conn.execute(f"INSERT INTO {target}.invoices SELECT * FROM {source}.invoices "
+                     f"WHERE id IN ({placeholders})", ids)
+        conn.execute(f"DELETE FROM {source}.invoices WHERE id IN ({placeholders})", ids)
+        conn.execute('''
+            INSERT OR REPLACE INTO main.archive_state (id, max_issue_date)
+            VALUES (1, (SELECT MAX(issue_date) FROM archive.invoices))
+        ''')
+
+    def _move_in_batches(self, source: str, target: str, select_ids: str,
+                         params: tuple, batch_size: int) -> int:
+        """Move the invoices returned by ``select_ids`` one transaction per batch"""
+        conn = self.get_connection()
+        conn.isolation_level = None  # explicit transactions below
+        moved = 0
+        try:
+            self._attach_archive(conn, create=True)
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    ids = [row[0] for row in conn.execute(select_ids, params + (batch_size,))]
+                    if ids:
+                        self._move_invoices(conn, source, target, ids)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                self.invoice_cache.invalidate(ids)
+                moved += len(ids)
+                if len(ids) < batch_size:
+                    return moved
+        finally:
+            conn.close()
+
+    def archive_paid_invoices(self, cutoff: str, batch_size: int = 500) -> int:
+        """Move paid invoices issued before ``cutoff`` (YYYY-MM-DD) to the archive"""
+        return self._move_in_batches(
+            'main', 'archive',
+            '''SELECT id FROM main.invoices
+               WHERE payment_status = 'zaplaceno' AND issue_date < ?
+               ORDER BY issue_date LIMIT ?''',
+            (cutoff,), batch_size
+        )
+
+    def restore_archived_invoices(self, since: Optional[str] = None, until: Optional[str] = None,
+                                  batch_size: int = 500) -> int:
+        """Move archived invoices issued within [since, until] back to the hot table"""
+        where, params = self._date_range('issue_date', since, until)
+        return self._move_in_batches(
+            'archive', 'main',
+            f"SELECT id FROM archive.invoices {where} ORDER BY issue_date LIMIT ?",
+            params, batch_size
+        )
+
+    def get_archive_status(self) -> Dict[str, Any]:
+        """Sizes of the hot and archive databases and the archive watermark"""
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT max_issue_date FROM archive_state WHERE id = 1").fetchone()
+            hot_count = conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+            archived_count = 0
+            if self._attach_archive(conn):
+                archived_count = conn.execute("SELECT COUNT(*) FROM archive.invoices").fetchone()[0]
+            return {
+                "hot_invoices": hot_count,
+                "archived_invoices": archived_count,
+                "archive_max_issue_date": row[0] if row else None,
+                "hot_size_bytes": os.path.getsize(self.db_path),
+                "archive_size_bytes": (os.path.getsize(self.archive_path)
+                                       if os.path.exists(self.archive_path) else 0)
+            }
+
+    # Customer methods
+    # Customer details as stored on invoices before they were normalized into customers
+    CUSTOMER_FIELDS = ['customer_name', 'customer_ic', 'customer_dic', 'customer_address']
+
+    @staticmethod
+    def _normalize_ic(customer_ic: Optional[str]) -> Optional[str]:
+        return (customer_ic or '').replace(' ', '') or None
+
+    def _customer_id(self, cursor, customer_name: str, customer_ic: Optional[str] = None,
+                     customer_dic: Optional[str] = None, customer_address: Optional[str] = None) -> int:
+        """ID of the customer with this IČ, created from these details when there is none
+
+        An existing customer is left as it is, so a new invoice or one moved to
+        another IČ never rewrites what that customer's other invoices show.
+        Customers without an IČ are told apart by all their details.
+        """
+        ic = self._normalize_ic(customer_ic)
+        if ic is None:
+            cursor.execute("SELECT id FROM customers WHERE ic IS NULL AND name = ? AND dic IS ? AND address IS ?",
+                           (customer_name, customer_dic, customer_address))
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            cursor.execute("INSERT INTO customers (name, dic, address) VALUES (?, ?, ?)",
+                           (customer_name, customer_dic, customer_address))
+            return cursor.lastrowid
+
+        cursor.execute("INSERT INTO customers (ic, name, dic, address) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT(ic) DO NOTHING", (ic, customer_name, customer_dic, customer_address))
+        if cursor.rowcount == 1:
+            return cursor.lastrowid
+        cursor.execute("SELECT id FROM customers WHERE ic = ?", (ic,))
+        return cursor.fetchone()[0]
+
+    # Columns of the customers table a customer edit may change
+    CUSTOMER_COLUMNS = ['name', 'dic', 'address']
+
+    def _update_customer(self, cursor, customer_id: int, changes: Dict[str, Any], archive_attached: bool) -> bool:
+        """Apply ``changes`` (of CUSTOMER_COLUMNS) to a customer; True when its invoices now read differently
+
+        Archived invoices of the customer are logged as changed too, so the
+        archive must be attached whenever it isn't empty.
+        """
+        columns = [column for column in self.CUSTOMER_COLUMNS if column in changes]
+        if not columns:
+            return False
+        values = [changes[column] for column in columns]
+        cursor.execute(f'''
+            UPDATE customers SET {', '.join(f"{column} = ?" for column in columns)}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND ({' OR '.join(f"{column} IS NOT ?" for column in columns)})
+            RETURNING id
+        ''', values + [customer_id] + values)
+        if cursor.fetchone() is None:
+            return False
+        # The customer's details are part of every one of its invoices, archived ones included
+        if not archive_attached:
+            # Checked under the write lock the UPDATE took, so archiving can't start anymore
+            row = cursor.execute("SELECT max_issue_date FROM archive_state WHERE id = 1").fetchone()
+            if row and row[0] is not None:
+                raise sqlite3.OperationalError("The archive changed while saving the customer, try again")
+        for table in ('main.invoices', 'archive.invoices') if archive_attached else ('main.invoices',):
+            cursor.execute("INSERT INTO invoice_changes (invoice_id, operation) "
+                           f"SELECT id, 'update' FROM {table} WHERE customer_id = ?", (customer_id,))
+        return True
+
+    def update_customer(self, ic: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Edit the customer with this IČ; every one of its invoices shows the new details"""
+        ic = self._normalize_ic(ic)
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM invoices ORDER BY issue_date DESC")
-            return [dict(row) for row in cursor.fetchall()]
+            archive_attached = self._attach_archive(conn)
+            cursor.execute("SELECT id FROM customers WHERE ic = ?", (ic,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            changed = self._update_customer(cursor, row[0], changes, archive_attached)
+            conn.commit()
+            if changed:
+                self.invoice_cache.clear()
+            cursor.execute("SELECT * FROM customers WHERE id = ?", (row[0],))
+            return dict(cursor.fetchone())
 
-    def get_invoice_by_id(self, invoice_id: int) -> Optional[Dict[str, Any]]:
-        """Get invoice by ID"""
+    def migrate_customers(self, batch_size: int = 500) -> int:
+        """Move the customer details repeated on invoices into the customers table
+
+        Runs online: every batch is a short transaction of its own, and reads
+        handle invoices on both sides of the migration.
+        """
+        migrated = 0
+        while True:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    SELECT id, customer_name, customer_ic, customer_dic, customer_address
+                    FROM invoices WHERE customer_id IS NULL ORDER BY id LIMIT ?
+                ''', (batch_size,))
+                rows = cursor.fetchall()
+                for row in rows:
+                    customer_id = self._customer_id(cursor, *row[1:])
+                    cursor.execute(f"UPDATE invoices SET customer_id = ?, {self.LEGACY_CUSTOMER_CLEARED} "
+                                   "WHERE id = ?", (customer_id, row[0]))
+                conn.commit()
+            migrated += len(rows)
+            if len(rows) < batch_size:
+                return migrated
+
+    def get_customer_by_ic(self, ic: str) -> Optional[Dict[str, Any]]:
+        """Get customer by IČ"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
+            cursor.execute("SELECT * FROM customers WHERE ic = ?", (ic.replace(' ', ''),))
             row = cursor.fetchone()
             return dict(row) if row else None
 
-    def get_invoice_by_number(self, invoice_number: str) -> Optional[Dict[str, Any]]:
-        """Get invoice by invoice number"""
+    def get_customers_by_ids(self, customer_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get customers by ID, as a dict keyed by ID"""
+        customers = {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Chunked to stay under SQLite's bound parameter limit
+            for start in range(0, len(customer_ids), 500):
+                chunk = customer_ids[start:start + 500]
+                cursor.execute(f"SELECT * FROM customers WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                customers.update((row['id'], dict(row)) for row in cursor.fetchall())
+        return customers
+
+    def search_customers(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Customers whose name or IČ starts with the query (autocomplete)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM invoices WHERE invoice_number = ?", (invoice_number,))
+            if query.isdigit():
+                # IČ prefix as an index range: '123' -> ['123', '124')
+                upper = query[:-1] + chr(ord(query[-1]) + 1)
+                cursor.execute("SELECT * FROM customers WHERE ic >= ? AND ic < ? ORDER BY ic LIMIT ?",
+                               (query, upper, limit))
+            else:
+                # name is COLLATE NOCASE, so this prefix LIKE is served by idx_customers_name
+                pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                cursor.execute("SELECT * FROM customers WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT ?",
+                               (pattern, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    # Invoice number methods
+    # Invoice numbers are F<year><sequence>, the sequence zero-padded to at least 3 digits
+    INVOICE_NUMBER_PATTERN = re.compile(r'^F(\d{4})(\d{3,})$')
+
+    @staticmethod
+    def format_invoice_number(year: int, seq: int) -> str:
+        return f"F{year}{seq:03d}"
+
+    def _seed_invoice_sequences(self, conn):
+        """Start each year's sequence after the highest number already issued (archive included)"""
+        source = self._invoices_source(conn)
+        conn.execute(f'''
+            INSERT INTO invoice_sequences (year, next_seq)
+            SELECT CAST(substr(invoice_number, 2, 4) AS INTEGER) AS year,
+                   MAX(CAST(substr(invoice_number, 6) AS INTEGER)) + 1
+            FROM {source}
+            WHERE invoice_number GLOB 'F[0-9][0-9][0-9][0-9][0-9][0-9][0-9]*'
+                AND substr(invoice_number, 6) NOT GLOB '*[^0-9]*'
+            GROUP BY year
+            ON CONFLICT(year) DO UPDATE SET next_seq = max(next_seq, excluded.next_seq)
+        ''')
+
+    @staticmethod
+    def _allocate_invoice_numbers(cursor, year: int, count: int = 1) -> List[int]:
+        """Take the next ``count`` sequence numbers of a year in one atomic statement"""
+        cursor.execute('''
+            INSERT INTO invoice_sequences (year, next_seq) VALUES (?, 1 + ?)
+            ON CONFLICT(year) DO UPDATE SET next_seq = next_seq + excluded.next_seq - 1
+            RETURNING next_seq
+        ''', (year, count))
+        end = cursor.fetchone()[0]
+        return list(range(end - count, end))
+
+    def _claim_invoice_number(self, cursor, invoice_number: str):
+        """Move the sequence past a number chosen by the client, so it's never handed out again"""
+        match = self.INVOICE_NUMBER_PATTERN.match(invoice_number)
+        if match:
+            cursor.execute('''
+                INSERT INTO invoice_sequences (year, next_seq) VALUES (?, ?)
+                ON CONFLICT(year) DO UPDATE SET next_seq = max(next_seq, excluded.next_seq)
+            ''', (int(match.group(1)), int(match.group(2)) + 1))
+
+    @staticmethod
+    def _check_not_archived(cursor, invoice_number: str, archive_attached: bool,
+                            invoice_id: Optional[int] = None):
+        """Raise IntegrityError when an archived invoice (other than ``invoice_id``) has this number"""
+        if not archive_attached:
+            # Archiving may have started since the archive wasn't attached; fail rather than skip the check
+            cursor.execute("SELECT max_issue_date FROM archive_state WHERE id = 1")
             row = cursor.fetchone()
-            return dict(row) if row else None
+            if row and row[0] is not None:
+                raise sqlite3.OperationalError("The archive changed while saving the invoice, try again")
+            return
+        cursor.execute("SELECT 1 FROM archive.invoices WHERE invoice_number = ? AND id IS NOT ?",
+                       (invoice_number, invoice_id))
+        if cursor.fetchone():
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: archive.invoices.invoice_number")
+
+    def reserve_invoice_numbers(self, year: int, count: int) -> List[str]:
+        """Reserve a block of consecutive invoice numbers, e.g. for a bulk import"""
+        with self.get_connection() as conn:
+            numbers = self._allocate_invoice_numbers(conn.cursor(), year, count)
+            conn.commit()
+        return [self.format_invoice_number(year, seq) for seq in numbers]
+
+    # Invoice methods
+    # Invoice fields as returned by reads and their SQL: customer details come from the
+    # customers join, or from the invoice itself while it hasn't been migrated yet
+    INVOICE_FIELDS = {
+        'id': 'i.id',
+        'invoice_number': 'i.invoice_number',
+        'issue_date': 'i.issue_date',
+        'due_date': 'i.due_date',
+        'customer_id': 'i.customer_id',
+        'customer_name': 'CASE WHEN c.id IS NULL THEN i.customer_name ELSE c.name END',
+        'customer_ic': 'CASE WHEN c.id IS NULL THEN i.customer_ic ELSE c.ic END',
+        'customer_dic': 'CASE WHEN c.id IS NULL THEN i.customer_dic ELSE c.dic END',
+        'customer_address': 'CASE WHEN c.id IS NULL THEN i.customer_address ELSE c.address END',
+        'total_amount': 'i.total_amount',
+        'payment_status': 'i.payment_status',
+        'payment_date': 'i.payment_date',
+        'service_description': 'i.service_description',
+        'created_at': 'i.created_at',
+        'updated_at': 'i.updated_at',
+    }
+    # Computed field of the overdue report
+    OVERDUE_FIELDS = {**INVOICE_FIELDS, 'days_overdue': "julianday('now') - julianday(i.due_date)"}
+    # Fields of the largest debtors report
+    DEBTOR_FIELDS = {
+        'customer_id': 'i.customer_id',
+        'customer_name': INVOICE_FIELDS['customer_name'],
+        'customer_ic': INVOICE_FIELDS['customer_ic'],
+        'total_debt': 'SUM(i.total_amount)',
+    }
+
+    @staticmethod
+    def _columns(available: Dict[str, str], fields: Optional[Sequence[str]] = None) -> str:
+        """Select list of ``fields`` (all of ``available`` when None); names must be validated"""
+        return ', '.join(f"{available[name]} AS {name}" for name in fields or available)
+
+    # Invoices pointing at a customer no longer repeat its details
+    LEGACY_CUSTOMER_CLEARED = ("customer_name = '', customer_ic = NULL, customer_dic = NULL, "
+                               "customer_address = NULL")
+
+    def _select_invoices(self, source: str = 'invoices', fields: Optional[Sequence[str]] = None,
+                         available: Optional[Dict[str, str]] = None) -> str:
+        """SELECT ... FROM for invoice reads of ``fields`` (default all), joining the customers table"""
+        return (f"SELECT {self._columns(available or self.INVOICE_FIELDS, fields)} "
+                f"FROM {source} i LEFT JOIN main.customers c ON c.id = i.customer_id")
+
+    def _get_invoice(self, conn, column: str, value) -> Optional[Dict[str, Any]]:
+        """Get one invoice by a unique column, from the hot table first, then the archive"""
+        cursor = conn.cursor()
+        cursor.execute(f"{self._select_invoices('main.invoices')} WHERE i.{column} = ?", (value,))
+        row = cursor.fetchone()
+        if row is None and self._attach_archive(conn):
+            cursor.execute(f"{self._select_invoices('archive.invoices')} WHERE i.{column} = ?", (value,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_all_invoices(self, since: Optional[str] = None, until: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None,
+                         compact: bool = False) -> Union[List[Dict[str, Any]], Rows]:
+        """Get all invoices, optionally only those issued within [since, until] and only some fields"""
+        with self.get_connection() as conn:
+            cursor = self._cursor(conn, compact)
+            source = self._invoices_source(conn, since)
+            return self._list_invoices(cursor, source, since, until, fields, compact)
+
+    def get_invoices_with_last_seq(self, since: Optional[str] = None, until: Optional[str] = None,
+                                   fields: Optional[Sequence[str]] = None,
+                                   compact: bool = False) -> Tuple[Union[List[Dict[str, Any]], Rows], int]:
+        """get_all_invoices() plus the newest change log sequence number they include
+
+        Both are read in one transaction, so a client holding the list continues
+        with get_invoice_changes(since=last_seq) without missing a change.
+        """
+        with self.get_connection() as conn:
+            cursor = self._cursor(conn, compact)
+            source = self._invoices_source(conn, since)  # may ATTACH, which a transaction doesn't allow
+            cursor.execute("BEGIN")
+            last_seq = self._change_log_end(cursor)
+            return self._list_invoices(cursor, source, since, until, fields, compact), last_seq
+
+    def _list_invoices(self, cursor, source: str, since: Optional[str], until: Optional[str],
+                       fields: Optional[Sequence[str]], compact: bool) -> Union[List[Dict[str, Any]], Rows]:
+        where, params = self._date_range('i.issue_date', since, until)
+        cursor.execute(f"{self._select_invoices(source, fields)} {where} ORDER BY i.issue_date DESC", params)
+        return self._fetch_all(cursor, compact)
+
+    def _load_invoice(self, column: str, value) -> Optional[Dict[str, Any]]:
+        with self.get_connection() as conn:
+            return self._get_invoice(conn, column, value)
+
+    def get_invoice_by_id(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        """Get invoice by ID (cache, then the hot table, then the archive)"""
+        return self.invoice_cache.get_or_load('id', invoice_id,
+                                              lambda: self._load_invoice('id', invoice_id))
+
+    def get_invoice_by_number(self, invoice_number: str) -> Optional[Dict[str, Any]]:
+        """Get invoice by invoice number (cache, then the hot table, then the archive)"""
+        return self.invoice_cache.get_or_load('invoice_number', invoice_number,
+                                              lambda: self._load_invoice('invoice_number', invoice_number))
 
     def create_invoice(self, invoice_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create new invoice"""
+        """Create new invoice, numbered from its issue year's sequence unless a number is given"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            invoice_number = invoice_data.get('invoice_number')
+            if invoice_number:
+                # The UNIQUE constraint only covers the hot table, so a chosen number is also
+                # looked up in the archive, within the write transaction (attached before it)
+                archive_attached = self._attach_archive(conn)
+                cursor.execute("BEGIN IMMEDIATE")
+                self._check_not_archived(cursor, invoice_number, archive_attached)
+                self._claim_invoice_number(cursor, invoice_number)
+            else:
+                year = int(invoice_data['issue_date'][:4])
+                invoice_number = self.format_invoice_number(
+                    year, self._allocate_invoice_numbers(cursor, year)[0]
+                )
+            customer_id = self._customer_id(cursor, **{key: invoice_data.get(key) for key in self.CUSTOMER_FIELDS})
             cursor.execute(
                 '''INSERT INTO invoices 
-                (invoice_number, issue_date, due_date, customer_name, customer_ic, customer_dic, 
-                customer_address, total_amount, payment_status, payment_date, service_description) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (invoice_number, issue_date, due_date, customer_id, customer_name, total_amount,
+                payment_status, payment_date, service_description) 
+                VALUES (?, ?, ?, ?, '', ?, ?, ?, ?)''',
                 (
-                    invoice_data['invoice_number'],
+                    invoice_number,
                     invoice_data['issue_date'],
                     invoice_data['due_date'],
-                    invoice_data['customer_name'],
-                    invoice_data.get('customer_ic'),
-                    invoice_data.get('customer_dic'),
-                    invoice_data.get('customer_address'),
+                    customer_id,
                     invoice_data['total_amount'],
                     invoice_data.get('payment_status', 'nezaplaceno'),
                     invoice_data.get('payment_date'),
@@ -196,11 +787,11 @@ class Database:
                 )
             )
             invoice_id = cursor.lastrowid
+            self._log_change(cursor, invoice_id, 'insert')
             conn.commit()
 
             # Return the created invoice
-            cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
-            return dict(cursor.fetchone())
+            return self._get_invoice(conn, 'id', invoice_id)
 
     def update_invoice(self, invoice_id: int, invoice_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update invoice"""
@@ -212,79 +803,317 @@ class Database:
             values = []
             
             for key, value in invoice_data.items():
-                if key in ['invoice_number', 'issue_date', 'due_date', 'customer_name', 'customer_ic', 
-                          'customer_dic', 'customer_address', 'total_amount', 'payment_status', 
+                if key in ['invoice_number', 'issue_date', 'due_date', 'total_amount', 'payment_status', 
                           'payment_date', 'service_description']:
                     fields.append(f"{key} = ?")
                     values.append(value)
+
+            # Attached before any write, as the transaction that starts then doesn't allow it
+            archive_attached = self._attach_archive(conn)
+
+            # A new number gets the same archive check and sequence claim as a chosen one on create
+            invoice_number = invoice_data.get('invoice_number')
+            if invoice_number:
+                cursor.execute("BEGIN IMMEDIATE")
+                self._check_not_archived(cursor, invoice_number, archive_attached, invoice_id)
+                self._claim_invoice_number(cursor, invoice_number)
+
+            # With its IČ kept, changed customer details edit the invoice's customer (and so all
+            # of its invoices); another IČ, or a customer without one, is looked up or created
+            customer_changes = {key: invoice_data[key] for key in self.CUSTOMER_FIELDS if key in invoice_data}
+            customer_changed = False
+            if customer_changes:
+                current = self._get_invoice(conn, 'id', invoice_id)
+                if not current:
+                    return None
+                ic = self._normalize_ic(customer_changes.get('customer_ic', current['customer_ic']))
+                if current['customer_id'] is not None and ic is not None and ic == current['customer_ic']:
+                    customer_id = current['customer_id']
+                    customer_changed = self._update_customer(cursor, customer_id, {
+                        key[len('customer_'):]: value for key, value in customer_changes.items() if key != 'customer_ic'
+                    }, archive_attached)
+                else:
+                    customer = {key: current[key] for key in self.CUSTOMER_FIELDS}
+                    customer.update(customer_changes)
+                    customer_id = self._customer_id(cursor, **customer)
+                fields.append(f"customer_id = ?, {self.LEGACY_CUSTOMER_CLEARED}")
+                values.append(customer_id)
             
             if not fields:
                 return None
                 
-            # Add updated_at timestamp
-            fields.append("updated_at = ?")
-            values.append(datetime.datetime.now())
+            # Add updated_at timestamp, in the same (UTC) format as the column default so that
+            # updated_at values compare in time order
+            fields.append("updated_at = CURRENT_TIMESTAMP")
             
             # Add invoice_id for WHERE clause
             values.append(invoice_id)
             
             query = f"UPDATE invoices SET {', '.join(fields)} WHERE id = ?"
             cursor.execute(query, values)
+
+            # An edited archived invoice becomes hot again: restore it, then apply the update
+            # (committing first, as the archive can't be attached inside a transaction)
+            if cursor.rowcount == 0:
+                conn.commit()
+                if self._attach_archive(conn):
+                    self._move_invoices(conn, 'archive', 'main', [invoice_id])
+                    cursor.execute(query, values)
+            if cursor.rowcount > 0:
+                self._log_change(cursor, invoice_id, 'update')
             conn.commit()
+            if customer_changed:
+                self.invoice_cache.clear()
+            else:
+                self.invoice_cache.invalidate([invoice_id])
 
             # Return the updated invoice
-            cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            return self._get_invoice(conn, 'id', invoice_id)
 
     def delete_invoice(self, invoice_id: int) -> bool:
         """Delete invoice"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+            if cursor.rowcount == 0:
+                conn.commit()
+                if self._attach_archive(conn):
+                    self._move_invoices(conn, 'archive', 'main', [invoice_id])
+                    cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+            deleted = cursor.rowcount > 0
+            if deleted:
+                self._log_change(cursor, invoice_id, 'delete')
             conn.commit()
-            return cursor.rowcount > 0
+            self.invoice_cache.invalidate([invoice_id])
+            return deleted
 
-    def get_unpaid_invoices(self) -> List[Dict[str, Any]]:
-        """Get all unpaid invoices"""
+    def get_unpaid_invoice_amounts(self) -> List[Dict[str, Any]]:
+        """ID, number and amount of every unpaid invoice (for payment matching)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM invoices WHERE payment_status = 'nezaplaceno' ORDER BY due_date ASC")
+            cursor.execute("SELECT id, invoice_number, total_amount FROM invoices "
+                           "WHERE payment_status = 'nezaplaceno'")
             return [dict(row) for row in cursor.fetchall()]
 
-    def get_largest_debtors(self) -> List[Dict[str, Any]]:
-        """Get largest debtors by total unpaid amount"""
+    def mark_invoices_paid(self, payments: List[tuple], batch_size: int = 1000) -> int:
+        """Mark invoices as paid from (invoice_id, payment_date) pairs, one transaction per batch
+
+        Invoices paid in the meantime are left alone; returns the number updated.
+        """
+        updated = 0
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(payments), batch_size):
+                batch = payments[start:start + batch_size]
+                cursor.execute("BEGIN IMMEDIATE")
+                for invoice_id, payment_date in batch:
+                    cursor.execute('''
+                        UPDATE invoices SET payment_status = 'zaplaceno', payment_date = ?,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND payment_status = 'nezaplaceno'
+                    ''', (payment_date, invoice_id))
+                    if cursor.rowcount:
+                        self._log_change(cursor, invoice_id, 'update')
+                        updated += 1
+                conn.commit()
+                self.invoice_cache.invalidate(invoice_id for invoice_id, _ in batch)
+        return updated
+
+    # Change log methods
+    # Unchanged invoices never show up in a delta, so sync cost follows the number of changes
+    @staticmethod
+    def _log_change(cursor, invoice_id: int, operation: str):
+        cursor.execute("INSERT INTO invoice_changes (invoice_id, operation) VALUES (?, ?)",
+                       (invoice_id, operation))
+
+    def _seed_change_log(self, conn):
+        """Log an insert for every invoice not in the change log yet, so a sync from 0 sees them"""
+        source = self._invoices_source(conn)
+        conn.execute(f'''
+            INSERT INTO invoice_changes (invoice_id, operation)
+            SELECT i.id, 'insert' FROM {source} i
+            WHERE NOT EXISTS (SELECT 1 FROM invoice_changes c WHERE c.invoice_id = i.id)
+            ORDER BY i.id
+        ''')
+
+    @staticmethod
+    def _change_log_end(cursor) -> int:
+        """Highest sequence number ever handed out, also when its entry was compacted away"""
+        row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'invoice_changes'").fetchone()
+        return row[0] if row else 0
+
+    def get_invoice_changes(self, since: int = 0, limit: int = 500, resync: bool = False) -> Dict[str, Any]:
+        """Changes after sequence number ``since``, oldest first, with the current invoice state
+
+        Raises ChangesCompacted when tombstones after ``since`` have already been
+        compacted away, as the client then has to resync. A resync is a full
+        read from ``since`` 0, paged with ``resync`` set: compaction keeps the
+        newest entry of every invoice that still exists, and a client starting
+        from scratch can't hold any invoice whose tombstone was dropped. The
+        last page's ``last_seq`` is past every compacted entry.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            source = self._invoices_source(conn)  # may ATTACH, which a transaction doesn't allow
+            cursor.execute("BEGIN")  # the page and the end of the log from one snapshot
+            row = cursor.execute("SELECT purged_through FROM change_log_state WHERE id = 1").fetchone()
+            if row and not resync and 0 < since < row[0]:
+                raise ChangesCompacted(row[0])
+
             cursor.execute('''
-                SELECT customer_name, SUM(total_amount) as total_debt
-                FROM invoices 
-                WHERE payment_status = 'nezaplaceno'
-                GROUP BY customer_name
-                ORDER BY total_debt DESC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+                SELECT seq, invoice_id, operation, changed_at FROM invoice_changes
+                WHERE seq > ? ORDER BY seq LIMIT ?
+            ''', (since, limit + 1))
+            changes = [dict(row) for row in cursor.fetchall()]
+            has_more = len(changes) > limit
+            changes = changes[:limit]
 
-    def get_average_payment_time(self) -> float:
-        """Calculate average payment time in days"""
+            # Inserts and updates carry the invoice as it is now; one query per page
+            ids = list({change['invoice_id'] for change in changes if change['operation'] != 'delete'})
+            invoices = {}
+            if ids:
+                cursor.execute(f"{self._select_invoices(source)} "
+                               f"WHERE i.id IN ({', '.join('?' * len(ids))})", ids)
+                invoices = {row['id']: dict(row) for row in cursor.fetchall()}
+            for change in changes:
+                if change['operation'] != 'delete':
+                    # None when the invoice was deleted later on; its tombstone follows
+                    change['invoice'] = invoices.get(change['invoice_id'])
+
+            return {
+                "changes": changes,
+                "last_seq": changes[-1]['seq'] if has_more else max(since, self._change_log_end(cursor)),
+                "has_more": has_more
+            }
+
+    def compact_invoice_changes(self, retention_days: int = 30,
+                                tombstone_retention_days: int = 90) -> int:
+        """Drop change log entries older than the retention that a later entry supersedes,
+        and tombstones older than their own retention; returns the number dropped"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT AVG(julianday(payment_date) - julianday(issue_date)) as avg_payment_days
-                FROM invoices 
-                WHERE payment_status = 'zaplaceno' AND payment_date IS NOT NULL
-            ''')
+                DELETE FROM invoice_changes
+                WHERE changed_at < datetime('now', ?)
+                    AND EXISTS (SELECT 1 FROM invoice_changes later
+                                WHERE later.invoice_id = invoice_changes.invoice_id
+                                    AND later.seq > invoice_changes.seq)
+            ''', (f'-{int(retention_days)} days',))
+            dropped = cursor.rowcount
+
+            # Clients that last synced before a dropped tombstone can't learn about the
+            # delete any more, so remember how far the log is incomplete
+            cursor.execute('''
+                DELETE FROM invoice_changes
+                WHERE operation = 'delete' AND changed_at < datetime('now', ?)
+                RETURNING seq
+            ''', (f'-{int(tombstone_retention_days)} days',))
+            purged = [row[0] for row in cursor.fetchall()]
+            if purged:
+                cursor.execute('''
+                    INSERT INTO change_log_state (id, purged_through) VALUES (1, ?)
+                    ON CONFLICT(id) DO UPDATE SET purged_through = max(purged_through, excluded.purged_through)
+                ''', (max(purged),))
+            conn.commit()
+            return dropped + len(purged)
+
+    # Report methods
+    # Date columns reports can be restricted on (?date=issue|due)
+    REPORT_DATE_COLUMNS = ('issue_date', 'due_date')
+
+    def _report_filter(self, since: Optional[str] = None, until: Optional[str] = None,
+                       date_column: str = 'issue_date', customer_ic: Optional[str] = None):
+        """Extra AND-ed conditions (and their parameters) shared by the reports
+
+        Every condition compares a bare indexed column with a constant, so the
+        status/date and customer indexes can narrow the scan.
+        """
+        if date_column not in self.REPORT_DATE_COLUMNS:
+            raise ValueError(f"Unknown date column: {date_column}")
+        conditions, params = [], []
+        if since is not None:
+            conditions.append(f"i.{date_column} >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append(f"i.{date_column} <= ?")
+            params.append(until)
+        if customer_ic is not None:
+            # Invoices migrate_customers() hasn't reached yet still carry the IČ themselves
+            conditions.append("(i.customer_id = (SELECT id FROM main.customers WHERE ic = ?)"
+                              " OR (i.customer_id IS NULL AND replace(i.customer_ic, ' ', '') = ?))")
+            params += [customer_ic.replace(' ', '')] * 2
+        return ''.join(f" AND {condition}" for condition in conditions), params
+
+    @staticmethod
+    def _limit(limit: Optional[int]):
+        """LIMIT clause (and its parameters) for top-N reports"""
+        return (" LIMIT ?", [limit]) if limit is not None else ("", [])
+
+    def get_unpaid_invoices(self, since: Optional[str] = None, until: Optional[str] = None,
+                            date_column: str = 'issue_date', customer_ic: Optional[str] = None,
+                            limit: Optional[int] = None,
+                            fields: Optional[Sequence[str]] = None,
+                            compact: bool = False) -> Union[List[Dict[str, Any]], Rows]:
+        """Get unpaid invoices, earliest due first"""
+        where, params = self._report_filter(since, until, date_column, customer_ic)
+        limit_clause, limit_params = self._limit(limit)
+        with self.get_connection() as conn:
+            cursor = self._cursor(conn, compact)
+            cursor.execute(f"{self._select_invoices(fields=fields)} WHERE i.payment_status = 'nezaplaceno'{where} "
+                           f"ORDER BY i.due_date ASC{limit_clause}", params + limit_params)
+            return self._fetch_all(cursor, compact)
+
+    def get_largest_debtors(self, since: Optional[str] = None, until: Optional[str] = None,
+                            date_column: str = 'issue_date', customer_ic: Optional[str] = None,
+                            limit: Optional[int] = None,
+                            fields: Optional[Sequence[str]] = None,
+                            compact: bool = False) -> Union[List[Dict[str, Any]], Rows]:
+        """Get largest debtors by total unpaid amount, per customer"""
+        where, params = self._report_filter(since, until, date_column, customer_ic)
+        limit_clause, limit_params = self._limit(limit)
+        with self.get_connection() as conn:
+            cursor = self._cursor(conn, compact)
+            # Invoices not migrated to a customer yet are grouped by their name
+            cursor.execute(f'''
+                SELECT {self._columns(self.DEBTOR_FIELDS, fields)}
+                FROM invoices i LEFT JOIN customers c ON c.id = i.customer_id
+                WHERE i.payment_status = 'nezaplaceno'{where}
+                GROUP BY coalesce(i.customer_id, 'name:' || i.customer_name)
+                ORDER BY SUM(i.total_amount) DESC{limit_clause}
+            ''', params + limit_params)
+            return self._fetch_all(cursor, compact)
+
+    def get_average_payment_time(self, since: Optional[str] = None, until: Optional[str] = None,
+                                 date_column: str = 'issue_date',
+                                 customer_ic: Optional[str] = None) -> float:
+        """Calculate average payment time in days"""
+        where, params = self._report_filter(since, until, date_column, customer_ic)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Paid invoices may have been archived, so this report reads both tables
+            # (the archive only when an issue date range reaches into it)
+            source = self._invoices_source(conn, since if date_column == 'issue_date' else None)
+            cursor.execute(f'''
+                SELECT AVG(julianday(i.payment_date) - julianday(i.issue_date)) as avg_payment_days
+                FROM {source} i
+                WHERE i.payment_status = 'zaplaceno' AND i.payment_date IS NOT NULL{where}
+            ''', params)
             row = cursor.fetchone()
             return row[0] if row and row[0] else 0.0
 
-    def get_overdue_invoices(self) -> List[Dict[str, Any]]:
-        """Get overdue invoices (not paid and past due date)"""
+    def get_overdue_invoices(self, since: Optional[str] = None, until: Optional[str] = None,
+                             date_column: str = 'issue_date', customer_ic: Optional[str] = None,
+                             limit: Optional[int] = None,
+                             fields: Optional[Sequence[str]] = None,
+                             compact: bool = False) -> Union[List[Dict[str, Any]], Rows]:
+        """Get overdue invoices (not paid and past due date), most overdue first"""
+        where, params = self._report_filter(since, until, date_column, customer_ic)
+        limit_clause, limit_params = self._limit(limit)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT *, julianday('now') - julianday(due_date) as days_overdue
-                FROM invoices 
-                WHERE payment_status = 'nezaplaceno' AND due_date < date('now')
-                ORDER BY due_date ASC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
\ No newline at end of file
+            cursor = self._cursor(conn, compact)
+            cursor.execute(f'''
+                {self._select_invoices(fields=fields, available=self.OVERDUE_FIELDS)}
+                WHERE i.payment_status = 'nezaplaceno' AND i.due_date < date('now'){where}
+                ORDER BY i.due_date ASC{limit_clause}
+            ''', params + limit_params)
+            return self._fetch_all(cursor, compact)
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""
+Invoice documents: ISDOC XML and printable HTML
+
+Rendered documents are kept in a content-addressed cache keyed on the
+invoice's updated_at, so re-downloads are free and batch runs only re-render
+invoices that changed. Large batches are rendered on a process pool.
+"""
+
+import hashlib
+import html
+import multiprocessing
+import os
+import re
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, List, Optional
+
+ISDOC_NAMESPACE = 'http://isdoc.cz/namespace/2013'
+ISDOC_VERSION = '6.0.1'
+
+# Bump when the templates change so cached documents are rendered again
+RENDERER_VERSION = 1
+
+# total_amount includes VAT; the base and tax are derived with this rate (%)
+VAT_RATE = Decimal(os.environ.get('INVOICE_VAT_RATE', '21'))
+
+# The issuing company, printed on every document
+SUPPLIER = {
+    "name": os.environ.get('INVOICE_SUPPLIER_NAME', 'Evidence Faktur s.r.o.'),
+    "ic": os.environ.get('INVOICE_SUPPLIER_IC', ''),
+    "dic": os.environ.get('INVOICE_SUPPLIER_DIC', ''),
+    "address": os.environ.get('INVOICE_SUPPLIER_ADDRESS', ''),
+}
+
+# format -> (file extension, MIME type)
+DOCUMENT_FORMATS = {
+    'isdoc': ('isdoc', 'application/xml'),
+    'html': ('html', 'text/html'),
+}
+
+# Batches with fewer invoices to render than this are rendered in-process
+PROCESS_POOL_THRESHOLD = 32
+
+
+def variable_symbol(invoice_number: str) -> str:
+    """Payment variable symbol of an invoice: the digits of its number (max. 10)"""
+    return re.sub(r'\D', '', invoice_number)[-10:]
+
+
+def _money(value) -> str:
+    return str(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def _amounts(invoice: Dict[str, Any]) -> Dict[str, str]:
+    """Tax base, VAT and total of an invoice whose total_amount includes VAT"""
+    total = Decimal(str(invoice['total_amount'])).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    base = (total * 100 / (100 + VAT_RATE)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return {"base": _money(base), "vat": _money(total - base), "total": _money(total)}
+
+
+def _sub(parent, tag: str, text: Optional[str] = None, **attrib):
+    element = ET.SubElement(parent, f"{{{ISDOC_NAMESPACE}}}{tag}", attrib)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+def _party(parent, tag: str, name: str, ic: Optional[str], dic: Optional[str],
+           address: Optional[str]):
+    party = _sub(_sub(parent, tag), 'Party')
+    _sub(_sub(party, 'PartyIdentification'), 'ID', ic or '')
+    _sub(_sub(party, 'PartyName'), 'Name', name)
+    postal = _sub(party, 'PostalAddress')
+    _sub(postal, 'StreetName', address or '')
+    _sub(postal, 'BuildingNumber', '')
+    _sub(postal, 'CityName', '')
+    _sub(postal, 'PostalZone', '')
+    country = _sub(postal, 'Country')
+    _sub(country, 'IdentificationCode', 'CZ')
+    _sub(country, 'Name', 'Česká republika')
+    if dic:
+        tax_scheme = _sub(party, 'PartyTaxScheme')
+        _sub(tax_scheme, 'CompanyID', dic)
+        _sub(tax_scheme, 'TaxScheme', 'VAT')
+
+
+def render_isdoc(invoice: Dict[str, Any]) -> bytes:
+    """Render an invoice as an ISDOC 6.0.1 XML document"""
+    ET.register_namespace('', ISDOC_NAMESPACE)
+    amounts = _amounts(invoice)
+    root = ET.Element(f"{{{ISDOC_NAMESPACE}}}Invoice", {"version": ISDOC_VERSION})
+    _sub(root, 'DocumentType', '1')  # 1 = invoice
+    _sub(root, 'ID', invoice['invoice_number'])
+    _sub(root, 'UUID', str(uuid.uuid5(uuid.NAMESPACE_URL, f"invoice:{invoice['invoice_number']}")).upper())
+    _sub(root, 'IssueDate', invoice['issue_date'])
+    _sub(root, 'TaxPointDate', invoice['issue_date'])
+    _sub(root, 'VATApplicable', 'true')
+    _sub(root, 'ElectronicPossibilityAgreementReference', '')
+    _sub(root, 'LocalCurrencyCode', 'CZK')
+    _sub(root, 'CurrRate', '1')
+    _sub(root, 'RefCurrRate', '1')
+    _party(root, 'AccountingSupplierParty', SUPPLIER['name'], SUPPLIER['ic'], SUPPLIER['dic'],
+           SUPPLIER['address'])
+    _party(root, 'AccountingCustomerParty', invoice['customer_name'], invoice.get('customer_ic'),
+           invoice.get('customer_dic'), invoice.get('customer_address'))
+
+    line = _sub(_sub(root, 'InvoiceLines'), 'InvoiceLine')
+    _sub(line, 'ID', '1')
+    _sub(line, 'InvoicedQuantity', '1', unitCode='ks')
+    _sub(line, 'LineExtensionAmount', amounts['base'])
+    _sub(line, 'LineExtensionAmountTaxInclusive', amounts['total'])
+    _sub(line, 'LineExtensionTaxAmount', amounts['vat'])
+    _sub(line, 'UnitPrice', amounts['base'])
+    _sub(line, 'UnitPriceTaxInclusive', amounts['total'])
+    category = _sub(line, 'ClassifiedTaxCategory')
+    _sub(category, 'Percent', str(VAT_RATE))
+    _sub(category, 'VATCalculationMethod', '0')
+    _sub(_sub(line, 'Item'), 'Description', invoice.get('service_description') or '')
+
+    tax_total = _sub(root, 'TaxTotal')
+    sub_total = _sub(tax_total, 'TaxSubTotal')
+    for tag, value in [('TaxableAmount', amounts['base']), ('TaxAmount', amounts['vat']),
+                       ('TaxInclusiveAmount', amounts['total']),
+                       ('AlreadyClaimedTaxableAmount', '0.00'), ('AlreadyClaimedTaxAmount', '0.00'),
+                       ('AlreadyClaimedTaxInclusiveAmount', '0.00'),
+                       ('DifferenceTaxableAmount', amounts['base']), ('DifferenceTaxAmount', amounts['vat']),
+                       ('DifferenceTaxInclusiveAmount', amounts['total'])]:
+        _sub(sub_total, tag, value)
+    _sub(_sub(sub_total, 'TaxCategory'), 'Percent', str(VAT_RATE))
+    _sub(tax_total, 'TaxAmount', amounts['vat'])
+
+    monetary_total = _sub(root, 'LegalMonetaryTotal')
+    for tag, value in [('TaxExclusiveAmount', amounts['base']), ('TaxInclusiveAmount', amounts['total']),
+                       ('AlreadyClaimedTaxExclusiveAmount', '0.00'),
+                       ('AlreadyClaimedTaxInclusiveAmount', '0.00'),
+                       ('DifferenceTaxExclusiveAmount', amounts['base']),
+                       ('DifferenceTaxInclusiveAmount', amounts['total']),
+                       ('PaidDepositsAmount', '0.00'), ('PayableAmount', amounts['total'])]:
+        _sub(monetary_total, tag, value)
+
+    payment = _sub(_sub(root, 'PaymentMeans'), 'Payment')
+    _sub(payment, 'PaidAmount', amounts['total'])
+    _sub(payment, 'PaymentMeansCode', '42')  # 42 = bank transfer
+    details = _sub(payment, 'Details')
+    _sub(details, 'PaymentDueDate', invoice['due_date'])
+    _sub(details, 'VariableSymbol', variable_symbol(invoice['invoice_number']))
+
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def render_html(invoice: Dict[str, Any]) -> bytes:
+    """Render an invoice as a printable HTML page"""
+    amounts = _amounts(invoice)
+    e = lambda value: html.escape(str(value)) if value is not None else ''
+    paid = invoice['payment_status'] == 'zaplaceno'
+    return f'''<!DOCTYPE html>
+<html lang="cs">
+<head>
+    <meta charset="UTF-8">
+    <title>Faktura {e(invoice['invoice_number'])}</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }}
+        h1 {{ font-size: 24px; }}
+        table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
+        th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+        .parties {{ display: flex; justify-content: space-between; }}
+        .amount {{ text-align: right; }}
+        @page {{ size: A4; margin: 15mm; }}
+    </style>
+</head>
+<body>
+    <h1>Faktura - daňový doklad č. {e(invoice['invoice_number'])}</h1>
+    <div class="parties">
+        <div>
+            <h2>Dodavatel</h2>
+            <div>{e(SUPPLIER['name'])}</div>
+            <div>{e(SUPPLIER['address'])}</div>
+            <div>IČ: {e(SUPPLIER['ic'])}</div>
+            <div>DIČ: {e(SUPPLIER['dic'])}</div>
+        </div>
+        <div>
+            <h2>Odběratel</h2>
+            <div>{e(invoice['customer_name'])}</div>
+            <div>{e(invoice.get('customer_address'))}</div>
+            <div>IČ: {e(invoice.get('customer_ic'))}</div>
+            <div>DIČ: {e(invoice.get('customer_dic'))}</div>
+        </div>
+    </div>
+    <table>
+        <tr><th>Datum vystavení</th><td>{e(invoice['issue_date'])}</td></tr>
+        <tr><th>Datum zdanitelného plnění</th><td>{e(invoice['issue_date'])}</td></tr>
+        <tr><th>Datum splatnosti</th><td>{e(invoice['due_date'])}</td></tr>
+        <tr><th>Variabilní symbol</th><td>{e(variable_symbol(invoice['invoice_number']))}</td></tr>
+        <tr><th>Stav</th><td>{'Zaplaceno ' + e(invoice.get('payment_date')) if paid else 'Nezaplaceno'}</td></tr>
+    </table>
+    <table>
+        <tr><th>Popis</th><th class="amount">Základ</th><th class="amount">DPH {e(VAT_RATE)} %</th><th class="amount">Celkem</th></tr>
+        <tr>
+            <td>{e(invoice.get('service_description'))}</td>
+            <td class="amount">{amounts['base']}</td>
+            <td class="amount">{amounts['vat']}</td>
+            <td class="amount">{amounts['total']}</td>
+        </tr>
+    </table>
+    <h2>Celkem k úhradě: {amounts['total']} Kč</h2>
+</body>
+</html>'''.encode('utf-8')
+
+
+RENDERERS = {
+    'isdoc': render_isdoc,
+    'html': render_html,
+}
+
+
+def render_document(invoice: Dict[str, Any], fmt: str) -> bytes:
+    """Render an invoice in the given format (top-level so process pools can pickle it)"""
+    return RENDERERS[fmt](invoice)
+
+
+class DocumentCache:
+    """Content-addressed store of rendered invoice documents"""
+
+    def __init__(self, cache_dir: str = 'document_cache'):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(database, invoice: Dict[str, Any], fmt: str) -> str:
+        """Cache key of a document: changes whenever the invoice's updated_at or its customer does"""
+        # Customer details live in the customers table, so editing them doesn't touch updated_at
+        customer = [invoice.get(key) for key in ('customer_name', 'customer_ic',
+                                                 'customer_dic', 'customer_address')]
+        parts = [RENDERER_VERSION, fmt, VAT_RATE, sorted(SUPPLIER.items()),
+                 os.path.abspath(database.db_path), invoice['id'], invoice['updated_at'], customer]
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{DOCUMENT_FORMATS[fmt][0]}")
+
+    def store(self, path: str, content: bytes):
+        """Write a document atomically so concurrent readers never see partial files"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def get_or_render(self, database, invoice: Dict[str, Any], fmt: str) -> str:
+        """Path of the rendered document, rendering it only when not cached yet"""
+        path = self.path(self.key(database, invoice, fmt), fmt)
+        if not os.path.exists(path):
+            self.store(path, render_document(invoice, fmt))
+        return path
+
+    def render_many(self, database, invoices: List[Dict[str, Any]], fmt: str,
+                    workers: Optional[int] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """Paths of the documents of many invoices, rendering the missing ones in parallel"""
+        paths = [self.path(self.key(database, invoice, fmt), fmt) for invoice in invoices]
+        missing = [(invoice, path) for invoice, path in zip(invoices, paths) if not os.path.exists(path)]
+        done = len(invoices) - len(missing)
+
+        def rendered(results):
+            nonlocal done
+            for (_, path), content in zip(missing, results):
+                self.store(path, content)
+                done += 1
+                if progress:
+                    progress(done, len(invoices))
+
+        if len(missing) < PROCESS_POOL_THRESHOLD:
+            rendered(render_document(invoice, fmt) for invoice, _ in missing)
+        else:
+            # spawn: forking a multi-threaded server process is not safe
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=multiprocessing.get_context('spawn'))
+            try:
+                rendered(executor.map(render_document, [invoice for invoice, _ in missing],
+                                      [fmt] * len(missing), chunksize=16))
+            finally:
+                executor.shutdown(cancel_futures=True)
+        if progress and not missing:
+            progress(done, len(invoices))
+        return paths
+
+
+document_cache = DocumentCache(os.environ.get('INVOICE_DOCUMENT_CACHE', 'document_cache'))
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Bounded read-through LRU cache of entities
+
+Entities are cached under their primary key and can also be looked up by one
+alternate unique key (e.g. invoice number). Writers invalidate entries after
+committing; a reader that loaded an entity while an invalidation happened
+drops its result instead of caching something that may already be stale.
+
+With a shared generation counter (see coherence.py), invalidations also
+reach the caches of other processes: each lookup compares the counter with
+the value this cache last saw and starts over empty when another process
+wrote in the meantime.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from coherence import Generation
+
+
+class EntityCache:
+    """LRU of entity dicts indexed by ``key`` and by the unique ``alt_key``"""
+
+    def __init__(self, max_entries: int = 10000, key: str = 'id', alt_key: Optional[str] = None,
+                 shared: Optional[Generation] = None):
+        self.max_entries = max_entries
+        self.key = key
+        self.alt_key = alt_key
+        self.shared = shared
+        self._shared_seen = shared.value() if shared else 0
+        self._entries: 'OrderedDict[Hashable, Dict[str, Any]]' = OrderedDict()
+        self._alt_index: Dict[Hashable, Hashable] = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; loads that started before a bump are not cached
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._remote_clears = 0
+
+    def get_or_load(self, field: str, value: Hashable,
+                    load: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """Entity whose ``field`` (the key or the alternate key) equals ``value``
+
+        On a miss ``load()`` is called without holding the lock. Missing
+        entities (None) are not cached.
+        """
+        with self._lock:
+            if self.shared and self.shared.value() != self._shared_seen:
+                self._clear_remote(self.shared.value())
+            key = value if field == self.key else self._alt_index.get(value)
+            entity = self._entries.get(key) if key is not None else None
+            if entity is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return dict(entity)
+            self._misses += 1
+            generation = self._generation
+
+        entity = load()
+        if entity is not None and self.max_entries > 0:
+            with self._lock:
+                if self._generation == generation:
+                    self._store(dict(entity))
+        return entity
+
+    def _store(self, entity: Dict[str, Any]):
+        key = entity[self.key]
+        self._remove(key)
+        self._entries[key] = entity
+        if self.alt_key and entity.get(self.alt_key) is not None:
+            self._alt_index[entity[self.alt_key]] = key
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: Hashable):
+        entity = self._entries.pop(key, None)
+        if entity is not None and self.alt_key:
+            self._alt_index.pop(entity.get(self.alt_key), None)
+
+    def _clear_remote(self, seen: int):
+        """Another process wrote: nothing cached can be trusted any more"""
+        self._generation += 1
+        self._entries.clear()
+        self._alt_index.clear()
+        self._shared_seen = seen
+        self._remote_clears += 1
+
+    def _publish(self):
+        """Tell the other processes to drop their copies (under the lock)"""
+        if self.shared:
+            previous, current = self.shared.bump()
+            if previous != self._shared_seen:
+                self._clear_remote(current)
+            self._shared_seen = current
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        """Drop the entities with these primary keys (call after the write committed)"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._remove(key)
+                self._invalidations += 1
+            self._publish()
+
+    def clear(self):
+        """Drop every entity, e.g. after a change that affects many of them"""
+        with self._lock:
+            self._generation += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._alt_index.clear()
+            self._publish()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hits, misses, hit rate, evictions and invalidations"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "remote_clears": self._remote_clears
+            }
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+Background jobs for long-running reports and exports
+
+Heavy work (full-year exports, multi-year reports) is submitted as a job and
+runs on a small bounded worker pool instead of inside a request thread. Jobs
+are persisted in the 'jobs' table, report their progress, can be cancelled
+and keep their result on disk until it expires. The table lives in the shared
+default database, so every job records the submitting user's company and is
+only visible within it.
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from database import Database
+from documents import DOCUMENT_FORMATS, document_cache
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class JobLimitExceeded(Exception):
+    """Raised when a user, or the runner as a whole, has too many unfinished jobs"""
+
+
+class JobContext:
+    """What a job function gets: the database, its parameters and progress reporting"""
+
+    # Progress is written to the jobs table at most this often (seconds)
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, runner: 'JobRunner', job_id: int, database: Database,
+                 params: Dict[str, Any], result_path: str):
+        self.runner = runner
+        self.job_id = job_id
+        self.database = database
+        self.params = params
+        self.result_path = result_path
+        self._last_report = 0.0
+
+    def progress(self, done: int, total: int):
+        """Report progress; raises JobCancelled when the job has been cancelled"""
+        if self.runner.is_cancelled(self.job_id):
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - self._last_report >= self.PROGRESS_INTERVAL or done >= total:
+            self._last_report = now
+            self.runner._update(self.job_id, progress=done / total if total else 1.0)
+
+
+def export_invoices(ctx: JobContext):
+    """Export invoices issued within [since, until] as CSV"""
+    invoices = ctx.database.get_all_invoices(since=ctx.params.get('since'),
+                                             until=ctx.params.get('until'), compact=True)
+    with open(ctx.result_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if invoices.data:
+            writer.writerow(invoices.columns)
+        for done, row in enumerate(invoices.data, 1):
+            writer.writerow(row)
+            ctx.progress(done, len(invoices))
+
+
+def run_reports(ctx: JobContext):
+    """Run every invoice report and store the results as one JSON document"""
+    reports = {
+        "unpaid": ctx.database.get_unpaid_invoices,
+        "largest_debtors": ctx.database.get_largest_debtors,
+        "average_payment_days": ctx.database.get_average_payment_time,
+        "overdue": ctx.database.get_overdue_invoices,
+    }
+    result = {}
+    for done, (name, report) in enumerate(reports.items(), 1):
+        result[name] = report()
+        ctx.progress(done, len(reports))
+    with open(ctx.result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def render_documents(ctx: JobContext):
+    """Render the documents of invoices issued within [since, until] into one ZIP archive"""
+    fmt = ctx.params.get('format', 'isdoc')
+    if fmt not in DOCUMENT_FORMATS:
+        raise ValueError(f"Unknown document format: {fmt}")
+    invoices = ctx.database.get_all_invoices(since=ctx.params.get('since'),
+                                             until=ctx.params.get('until'))
+    paths = document_cache.render_many(ctx.database, invoices, fmt, progress=ctx.progress)
+    extension = DOCUMENT_FORMATS[fmt][0]
+    with zipfile.ZipFile(ctx.result_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for invoice, path in zip(invoices, paths):
+            archive.write(path, f"{invoice['invoice_number']}.{extension}")
+
+
+# job type -> (function, result file extension, result MIME type)
+JOB_TYPES: Dict[str, tuple] = {
+    'export_invoices': (export_invoices, 'csv', 'text/csv'),
+    'reports': (run_reports, 'json', 'application/json'),
+    'render_documents': (render_documents, 'zip', 'application/zip'),
+}
+
+
+class JobRunner:
+    """Bounded in-process worker pool backed by the 'jobs' table"""
+
+    def __init__(self, db: Database, result_dir: str = 'job_results', workers: int = 2,
+                 per_user_limit: int = 2, max_pending: int = 50, result_ttl: int = 24 * 3600):
+        self.db = db
+        self.result_dir = result_dir
+        self.per_user_limit = per_user_limit
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._futures = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self.init_schema()
+
+    def init_schema(self):
+        """Create the jobs table; jobs left unfinished by a previous process are failed"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    company_id TEXT, -- company of the submitting user, NULL without one
+                    job_type TEXT NOT NULL,
+                    params TEXT, -- JSON
+                    status TEXT NOT NULL, -- 'queued', 'running', 'done', 'failed' or 'cancelled'
+                    progress REAL NOT NULL DEFAULT 0,
+                    result_path TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    expires_at TIMESTAMP
+                )
+            ''')
+            Database._add_column(cursor, 'jobs', 'company_id TEXT')
+            # Jobs from before company_id was recorded belong to their user's company
+            cursor.execute('''
+                UPDATE jobs SET company_id = (SELECT company_id FROM users WHERE users.id = jobs.user_id)
+                WHERE company_id IS NULL
+                  AND user_id IN (SELECT id FROM users WHERE company_id IS NOT NULL)
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs(user_id, status)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_company ON jobs(company_id)")
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart',
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE status IN ('queued', 'running')
+            ''')
+            conn.commit()
+
+    def submit(self, user_id: int, job_type: str, params: Dict[str, Any],
+               database: Optional[Database] = None, company_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a job for the given user of ``company_id`` and return it"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        self.purge_expired()
+
+        with self._lock, self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*), SUM(user_id = ?) FROM jobs WHERE status IN ('queued', 'running')
+            ''', (user_id,))
+            pending, pending_for_user = cursor.fetchone()
+            if (pending_for_user or 0) >= self.per_user_limit:
+                raise JobLimitExceeded(f"At most {self.per_user_limit} unfinished jobs per user")
+            if pending >= self.max_pending:
+                raise JobLimitExceeded("Too many jobs queued, try again later")
+
+            cursor.execute(
+                "INSERT INTO jobs (user_id, company_id, job_type, params, status) VALUES (?, ?, ?, ?, 'queued')",
+                (user_id, company_id, job_type, json.dumps(params))
+            )
+            job_id = cursor.lastrowid
+            conn.commit()
+            self._futures[job_id] = self._executor.submit(
+                self._run, job_id, job_type, params, database or self.db
+            )
+
+        return self.get(job_id, company_id, user_id)
+
+    def get(self, job_id: int, company_id: Optional[str], user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Get a job of a company by ID, only if ``user_id`` submitted it unless that is None"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM jobs WHERE id = ? AND company_id IS ? AND (? IS NULL OR user_id = ?)",
+                (job_id, company_id, user_id, user_id)
+            )
+            row = cursor.fetchone()
+            return self._to_dict(row) if row else None
+
+    def list_for_user(self, user_id: int, company_id: Optional[str],
+                      whole_company: bool = False) -> List[Dict[str, Any]]:
+        """Get the jobs of a user (or of the user's whole company), newest first"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM jobs WHERE company_id IS ? AND (? OR user_id = ?) ORDER BY id DESC",
+                (company_id, whole_company, user_id)
+            )
+            return [self._to_dict(row) for row in cursor.fetchall()]
+
+    def cancel(self, job_id: int, company_id: Optional[str], user_id: Optional[int] = None) -> bool:
+        """Cancel a queued or running job of a company (and user, unless None)
+
+        Returns False when it already finished or isn't one of those jobs.
+        """
+        job = self.get(job_id, company_id, user_id)
+        if job is None or job['status'] not in ('queued', 'running'):
+            return False
+        with self._lock:
+            # _run finishes a job and drops its future under this lock, so a
+            # job that has one is still queued or running
+            future = self._futures.get(job_id)
+            if future is None:
+                return False
+            if future.cancel():
+                # Never started: finish it here, _run will not be called
+                self._futures.pop(job_id, None)
+                self._update(job_id, status='cancelled', finished=True)
+            else:
+                # Running: the job stops at its next progress report
+                self._cancelled.add(job_id)
+            return True
+
+    def is_cancelled(self, job_id: int) -> bool:
+        return job_id in self._cancelled
+
+    def result_file(self, job: Dict[str, Any]) -> Optional[tuple]:
+        """(path, MIME type) of a finished job's result, None when there is none"""
+        if job['status'] != 'done' or not job['result_path'] or not os.path.exists(job['result_path']):
+            return None
+        return job['result_path'], JOB_TYPES[job['job_type']][2]
+
+    def purge_expired(self):
+        """Delete expired jobs together with their result files"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, result_path FROM jobs WHERE expires_at < CURRENT_TIMESTAMP")
+            expired = cursor.fetchall()
+            for row in expired:
+                if row['result_path'] and os.path.exists(row['result_path']):
+                    os.remove(row['result_path'])
+            cursor.executemany("DELETE FROM jobs WHERE id = ?", [(row['id'],) for row in expired])
+            conn.commit()
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs and cancel the ones that haven't started"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id: int, job_type: str, params: Dict[str, Any], database: Database):
+        function, extension, _ = JOB_TYPES[job_type]
+        os.makedirs(self.result_dir, exist_ok=True)
+        result_path = os.path.join(self.result_dir, f"job-{job_id}.{extension}")
+        self._update(job_id, status='running', started=True)
+        status, error = 'done', None
+        try:
+            function(JobContext(self, job_id, database, params, result_path))
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            status, error = 'failed', str(e)
+        with self._lock:
+            if status == 'done' and job_id in self._cancelled:
+                # Cancelled after its last progress report
+                status = 'cancelled'
+            if status == 'done':
+                self._update(job_id, status=status, progress=1.0, result_path=result_path, finished=True)
+            else:
+                self._remove(result_path)
+                self._update(job_id, status=status, error=error, finished=True)
+            self._futures.pop(job_id, None)
+            self._cancelled.discard(job_id)
+
+    def _update(self, job_id: int, started: bool = False, finished: bool = False, **values):
+        """Update columns of a job row, stamping start/finish/expiry times"""
+        fields = [f"{key} = ?" for key in values]
+        if started:
+            fields.append("started_at = CURRENT_TIMESTAMP")
+        if finished:
+            fields.append("finished_at = CURRENT_TIMESTAMP")
+            fields.append(f"expires_at = datetime('now', '+{int(self.result_ttl)} seconds')")
+        with self.db.get_connection() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(fields)} WHERE id = ?",
+                         list(values.values()) + [job_id])
+            conn.commit()
+
+    @staticmethod
+    def _remove(path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _to_dict(row) -> Dict[str, Any]:
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        return job
\ No newline at end of file
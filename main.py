@@ -1,45 +1,70 @@
 #!/usr/bin/env python3
 """
 Main script to start the Invoice Management System
+
+Run with --profile-startup to print import times and per-phase init timings,
+or with --asgi to serve the API from the asyncio server (uvicorn) instead of
+the threaded WSGI server.
 """
 
+import importlib
 import threading
 import time
-import requests
-from app import start_server
-import signal
 import sys
 
 
-def wait_for_server(port=80, timeout=30):
-    """Wait for the server to start"""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(f'http://localhost:{port}/', timeout=1)
-            if response.status_code == 200:
-                print(f"✓ Server is running on port {port}")
-                return True
-        except requests.exceptions.RequestException:
-            pass
-        time.sleep(1)
+def timed_import(name, timings):
+    """Import a module and record how long the import took"""
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    timings.append((f"import {name}", time.perf_counter() - start))
+    return module
+
+
+def print_startup_profile(timings, total):
+    """Print the collected startup timings"""
+    print("Startup profile:")
+    for phase, seconds in timings:
+        print(f"  {phase:<32} {seconds * 1000:8.1f} ms")
+    print(f"  {'total (ready)':<32} {total * 1000:8.1f} ms")
+
+
+def wait_for_server(ready, server_thread, port=80, timeout=30):
+    """Wait until the server signals that it is accepting connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ready.wait(timeout=0.05):
+            print(f"✓ Server is running on port {port}")
+            return True
+        if not server_thread.is_alive():
+            return False  # the server failed before binding its socket
     return False
 
 
-def start_system():
+def start_system(profile=False):
     """Start the database and API server"""
+    started = time.perf_counter()
+    timings = []
     print("Starting Invoice Management System...")
 
+    # Import the application lazily so the import cost shows up in the profile
+    timed_import('flask', timings)
+    timed_import('database', timings)
+    app = timed_import('app', timings)  # includes Database.init_db
+    ready = threading.Event()
+
     # Start the server in a separate thread
     server_thread = threading.Thread(
-        target=start_server,
-        kwargs={'host': '0.0.0.0', 'port': 80, 'debug': False}
+        target=app.start_server,
+        kwargs={'host': '0.0.0.0', 'port': 80, 'debug': False, 'ready': ready, 'timings': timings}
     )
     server_thread.daemon = True
     server_thread.start()
 
     # Wait for server to start
-    if wait_for_server(port=80):
+    if wait_for_server(ready, server_thread, port=80):
+        if profile:
+            print_startup_profile(timings, time.perf_counter() - started)
         print("✓ System started successfully!")
         print("✓ API is available at http://localhost:80")
         print("✓ Use the following credentials to log in:")
@@ -49,8 +74,8 @@ def start_system():
 
         # Keep the main thread alive
         try:
-            while True:
-                time.sleep(1)
+            while server_thread.is_alive():
+                server_thread.join(timeout=1)
         except KeyboardInterrupt:
             print("\nShutting down server...")
             sys.exit(0)
@@ -59,5 +84,17 @@ def start_system():
         sys.exit(1)
 
 
+def start_asgi_system(port=80):
+    """Serve the API through the ASGI app on uvicorn"""
+    import uvicorn
+
+    print("Starting Invoice Management System (ASGI)...")
+    print(f"✓ API will be available at http://localhost:{port}")
+    uvicorn.run('asgi:application', host='0.0.0.0', port=port, timeout_keep_alive=75)
+
+
 if __name__ == '__main__':
-    start_system()
\ No newline at end of file
+    if '--asgi' in sys.argv[1:]:
+        start_asgi_system()
+    else:
+        start_system(profile='--profile-startup' in sys.argv[1:])
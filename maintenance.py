@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Time-sliced maintenance of the SQLite databases
+
+Each run refreshes the query planner statistics (ANALYZE per table with a
+bounded analysis_limit, then PRAGMA optimize), returns free pages to the file
+system with incremental vacuum and checkpoints the WAL without blocking
+writers. The work is cut into short steps and the scheduler only takes the
+next step while the server is quiet, so maintenance never competes with a
+burst of requests; whatever doesn't fit into a run's time budget is picked
+up by the next run.
+
+Databases created without incremental auto-vacuum are converted once with a
+full VACUUM, but only while they are small enough for that to be quick.
+
+Usage:
+    python maintenance.py run [--db invoices.db ...] [--seconds 60]
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from backup import default_databases
+
+logger = logging.getLogger('maintenance')
+
+# Free pages returned to the file system per step
+DEFAULT_STEP_PAGES = 256
+# Time budget of one run over all databases
+DEFAULT_RUN_SECONDS = 30.0
+# Pause between steps, also the window the request rate is measured over
+DEFAULT_PAUSE = 0.1
+# Requests per second above which maintenance waits
+DEFAULT_MAX_RATE = 5.0
+# Rows ANALYZE samples per index, keeps each ANALYZE step short on big tables
+ANALYSIS_LIMIT = 1000
+# Largest database converted to incremental auto-vacuum (a full VACUUM) on the fly
+CONVERT_MAX_BYTES = 64 * 1024 * 1024
+
+AUTO_VACUUM_NONE, AUTO_VACUUM_INCREMENTAL = 0, 2
+
+
+def _file_bytes(path: str) -> int:
+    """Size of a database including its WAL"""
+    return sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+
+
+def _steps(conn, result: Dict[str, Any], step_pages: int) -> Iterator[None]:
+    """Maintenance work of one database, one short step per iteration"""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        conn.execute(f'ANALYZE "{table}"')
+        result["analyzed_tables"] += 1
+        yield
+    conn.execute("PRAGMA optimize")
+    yield
+
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if auto_vacuum == AUTO_VACUUM_NONE and free_pages and os.path.getsize(result["database"]) <= CONVERT_MAX_BYTES:
+        conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        conn.execute("VACUUM")
+        result["converted_to_incremental"] = True
+        result["vacuumed_pages"] += free_pages
+        yield
+    elif auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+        while free_pages:
+            conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            result["vacuumed_pages"] += free_pages - remaining
+            free_pages = remaining
+            yield
+
+    if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        # PASSIVE copies what it can without waiting for readers or writers
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        result["checkpoint"] = {"busy": bool(busy), "wal_pages": log_pages, "checkpointed_pages": checkpointed}
+
+
+def maintain_database(path: str, proceed: Callable[[], bool] = lambda: True,
+                      step_pages: int = DEFAULT_STEP_PAGES) -> Dict[str, Any]:
+    """Run the maintenance steps of one database while ``proceed()`` allows it
+
+    ``proceed`` is called before every step; once it returns False the run
+    stops and the result has ``completed`` False.
+    """
+    started = time.perf_counter()
+    size_before = _file_bytes(path)
+    result = {"database": path, "analyzed_tables": 0, "vacuumed_pages": 0,
+              "converted_to_incremental": False, "checkpoint": None, "completed": False}
+    # Autocommit, so VACUUM and the pragmas never run inside a transaction
+    conn = sqlite3.connect(path, timeout=1.0, isolation_level=None)
+    try:
+        steps = _steps(conn, result, step_pages)
+        while proceed():
+            try:
+                next(steps)
+            except StopIteration:
+                result["completed"] = True
+                break
+    finally:
+        conn.close()
+    result["reclaimed_bytes"] = size_before - _file_bytes(path)
+    result["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+class MaintenanceScheduler:
+    """Background thread maintaining a set of databases at a fixed interval, while load is low
+
+    ``activity`` returns a counter of handled requests; a step is only taken
+    when fewer than ``max_rate`` requests per second arrived during the pause
+    before it.
+    """
+
+    def __init__(self, paths: Callable[[], List[str]], interval: float,
+                 activity: Optional[Callable[[], int]] = None, max_rate: float = DEFAULT_MAX_RATE,
+                 run_seconds: float = DEFAULT_RUN_SECONDS, pause: float = DEFAULT_PAUSE,
+                 step_pages: int = DEFAULT_STEP_PAGES):
+        self.paths = paths
+        self.interval = interval
+        self.activity = activity
+        self.max_rate = max_rate
+        self.run_seconds = run_seconds
+        self.pause = pause
+        self.step_pages = step_pages
+        self._stop = threading.Event()
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._failures = 0
+        self._deferred_steps = 0
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+    def start(self) -> threading.Thread:
+        if not logger.handlers and not logging.getLogger().handlers:
+            logger.addHandler(logging.StreamHandler())
+            logger.setLevel(logging.INFO)
+        thread = threading.Thread(target=self._loop, name='maintenance-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def trigger(self) -> bool:
+        """Start a run in the background right away, regardless of load; False when one is running"""
+        if not self._running.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self._run(ignore_load=True)
+            finally:
+                self._running.release()
+
+        threading.Thread(target=run, name='maintenance-run', daemon=True).start()
+        return True
+
+    def _proceed(self, deadline: float, ignore_load: bool) -> bool:
+        """Wait for a quiet moment before the next step; False once the run is out of time"""
+        while time.monotonic() < deadline and not self._stop.is_set():
+            before = self.activity() if self.activity and not ignore_load else 0
+            self._stop.wait(self.pause)
+            if not self.activity or ignore_load or self.activity() - before <= self.max_rate * self.pause:
+                return time.monotonic() < deadline
+            with self._lock:
+                self._deferred_steps += 1
+        return False
+
+    def run_once(self, ignore_load: bool = False) -> List[Dict[str, Any]]:
+        """Maintain every database within one run's time budget; a failing database doesn't stop the others"""
+        with self._running:
+            return self._run(ignore_load)
+
+    def _run(self, ignore_load: bool) -> List[Dict[str, Any]]:
+        deadline = time.monotonic() + self.run_seconds
+        results = []
+        for path in self.paths():
+            try:
+                result = maintain_database(path, lambda: self._proceed(deadline, ignore_load), self.step_pages)
+                logger.info("Maintenance of %s: %s in %.3f s, %d bytes reclaimed",
+                            path, 'done' if result['completed'] else 'interrupted',
+                            result['duration_seconds'], result['reclaimed_bytes'])
+            except Exception as e:
+                result = {"database": path, "error": str(e)}
+                logger.warning("Maintenance of %s failed: %s", path, e)
+            with self._lock:
+                self._runs += 1
+                self._failures += 'error' in result
+                self._last[path] = {**result, "finished_at": datetime.datetime.now().isoformat(timespec='seconds')}
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Run counts, steps put off because of load and the last result per database"""
+        with self._lock:
+            return {
+                "interval_seconds": self.interval,
+                "running": self._running.locked(),
+                "runs": self._runs,
+                "failures": self._failures,
+                "deferred_steps": self._deferred_steps,
+                "last": dict(self._last)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANALYZE, optimize, vacuum and checkpoint the SQLite databases")
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--db', action='append', help='Database file (repeatable, default: all present)')
+    parser.add_argument('--seconds', type=float, default=300, help='Time budget of the run')
+    parser.add_argument('--step-pages', type=int, default=DEFAULT_STEP_PAGES)
+    args = parser.parse_args()
+
+    scheduler = MaintenanceScheduler(lambda: list(args.db or default_databases()), 0,
+                                     run_seconds=args.seconds, pause=0, step_pages=args.step_pages)
+    for result in scheduler.run_once():
+        if 'error' in result:
+            print(f"✗ {result['database']}: {result['error']}")
+        else:
+            print(f"{'✓' if result['completed'] else '…'} {result['database']}: "
+                  f"{result['analyzed_tables']} tables analyzed, {result['vacuumed_pages']} pages vacuumed, "
+                  f"{result['reclaimed_bytes']} bytes reclaimed in {result['duration_seconds']} s")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Password storage and a bounded pool for verifying logins
+
+Passwords are stored as salted scrypt hashes (PBKDF2 where the OpenSSL build
+lacks scrypt) in the form ``<kdf>$<parameters>$<salt>$<hash>``. Hashes of
+the old format (unsalted SHA-256 hex) still verify and are reported as
+needing a rehash, so they are upgraded on the user's next login.
+
+A KDF is deliberately slow, so verifications run on a few dedicated threads
+with a bounded queue: a burst of logins waits for those threads or is turned
+away with 503, while the request threads serving the rest of the API stay free.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple
+
+# scrypt: 16 MiB of memory and some 50 ms per hash
+SCRYPT_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+PBKDF2_ITERATIONS = 600000
+KDF = 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256'
+SALT_BYTES = 16
+
+
+def _derive(kdf: str, params: Tuple[int, ...], password: str, salt: bytes) -> bytes:
+    if kdf == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p)
+    if kdf == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params[0])
+    raise ValueError(f"Unknown password hash {kdf}")
+
+
+def _current_params() -> Tuple[int, ...]:
+    if KDF == 'scrypt':
+        return SCRYPT_PARAMS['n'], SCRYPT_PARAMS['r'], SCRYPT_PARAMS['p']
+    return (PBKDF2_ITERATIONS,)
+
+
+def hash_password(password: str) -> str:
+    """Salted hash of a password for storage"""
+    params = _current_params()
+    salt = os.urandom(SALT_BYTES)
+    digest = _derive(KDF, params, password, salt)
+    return f"{KDF}${','.join(map(str, params))}${salt.hex()}${digest.hex()}"
+
+
+def is_legacy_hash(stored: str) -> bool:
+    """Unsalted SHA-256 hex digest of the old storage format"""
+    return '$' not in stored
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    """Check a password against a stored hash; returns (matches, needs_rehash)"""
+    if is_legacy_hash(stored):
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+    try:
+        kdf, params, salt, digest = stored.split('$')
+        params = tuple(int(value) for value in params.split(','))
+        matches = hmac.compare_digest(_derive(kdf, params, password, bytes.fromhex(salt)), bytes.fromhex(digest))
+    except ValueError:
+        return False, False
+    return matches, kdf != KDF or params != _current_params()
+
+
+class VerificationBusy(Exception):
+    """The verification queue is full or the wait for a worker timed out"""
+
+
+class VerificationPool:
+    """A few threads verifying passwords, with at most ``max_queue`` waiting"""
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: float = 5.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        # Verified against for unknown users, so they take as long as known ones
+        self._dummy_hash: Optional[str] = None
+        self._stats_lock = threading.Lock()
+        self._verified = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._in_flight = 0
+        self._total_seconds = 0.0
+
+    def check(self, password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Verify a login
+
+        Returns ``(matches, new_hash)``; ``new_hash`` is set when the password
+        matched a hash in an outdated format and should be stored instead.
+        ``stored`` None (unknown user) never matches. Raises VerificationBusy
+        instead of queueing beyond the limit.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count('_rejected')
+            raise VerificationBusy()
+        with self._stats_lock:
+            self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            future = self._executor.submit(self._verify, password, stored)
+        except BaseException:
+            self._finished(started)
+            raise
+        future.add_done_callback(lambda _: self._finished(started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count('_timed_out')
+            raise VerificationBusy()
+
+    def _verify(self, password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = hash_password('')
+            verify_password(password, self._dummy_hash)
+            return False, None
+        matches, needs_rehash = verify_password(password, stored)
+        return matches, hash_password(password) if matches and needs_rehash else None
+
+    def _finished(self, started: float):
+        with self._stats_lock:
+            self._in_flight -= 1
+            self._verified += 1
+            self._total_seconds += time.perf_counter() - started
+        self._slots.release()
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict:
+        """Verifications done, turned away and in progress, and their mean latency"""
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "verified": self._verified,
+                "rejected_busy": self._rejected,
+                "timed_out": self._timed_out,
+                "mean_ms": round(self._total_seconds / self._verified * 1000, 1) if self._verified else None
+            }
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+On-demand profiling of single requests
+
+A request carrying ``X-Profile: <format>`` (or ``?_profile=<format>``) from
+an allowed caller is profiled and answered with the profile instead of its
+normal response; the original status is kept in the ``X-Profiled-Status``
+header. Requests without the flag only pay for one header lookup.
+
+Formats:
+    text       cProfile summary plus the time spent in each Database method
+    pstats     cProfile dump, for ``python -m pstats`` or snakeviz
+    collapsed  sampled stacks in collapsed format, for flamegraph.pl/speedscope
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+from flask import Flask, Response, g, request
+
+PROFILE_FORMATS = {
+    'text': ('text/plain', 'txt'),
+    'pstats': ('application/octet-stream', 'prof'),
+    'collapsed': ('text/plain', 'collapsed'),
+}
+
+# Interval of the stack sampler behind the collapsed format
+SAMPLE_INTERVAL = 0.001
+
+# Only one request is profiled at a time, the profilers aren't meant to nest
+_profiling = threading.Lock()
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _database_methods(stats: pstats.Stats) -> str:
+    """Calls and times of the methods defined in database.py"""
+    rows = [(cumulative, calls, total, name)
+            for (filename, _, name), (_, calls, total, cumulative, _) in stats.stats.items()
+            if filename.endswith('database.py')]
+    lines = [f"{'calls':>8} {'tottime':>9} {'cumtime':>9}  Database method"]
+    lines += [f"{calls:>8} {total:9.4f} {cumulative:9.4f}  {name}"
+              for cumulative, calls, total, name in sorted(rows, reverse=True)]
+    return '\n'.join(lines) + '\n'
+
+
+def _render(profiler, fmt: str, elapsed: float) -> bytes:
+    if fmt == 'collapsed':
+        return profiler.collapsed().encode()
+    profiler.create_stats()
+    if fmt == 'pstats':
+        return marshal.dumps(profiler.stats)
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    out.write(f"{request.method} {request.full_path.rstrip('?')} took {elapsed * 1000:.1f} ms\n\n")
+    out.write(_database_methods(stats) + '\n')
+    stats.sort_stats('cumulative').print_stats(40)
+    return out.getvalue().encode()
+
+
+def init_profiling(app: Flask, is_allowed: Callable[[], bool]):
+    """Let callers for whom ``is_allowed()`` holds profile their requests on ``app``"""
+
+    @app.before_request
+    def start_profile():
+        fmt = request.headers.get('X-Profile') or request.args.get('_profile')
+        if fmt is None:
+            return None
+        if fmt not in PROFILE_FORMATS:
+            return {"error": f"Unknown profile format. Use one of: {', '.join(PROFILE_FORMATS)}"}, 400
+        if not is_allowed():
+            return {"error": "Profiling is not allowed"}, 403
+        if not _profiling.acquire(blocking=False):
+            return {"error": "Another request is being profiled"}, 409
+
+        profiler = StackSampler(threading.get_ident()) if fmt == 'collapsed' else cProfile.Profile()
+        g.profile = (profiler, fmt, time.perf_counter())
+        profiler.enable()
+        return None
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        profiler, fmt, started = profile
+        try:
+            profiler.disable()
+            body = _render(profiler, fmt, time.perf_counter() - started)
+        finally:
+            _profiling.release()
+        mimetype, extension = PROFILE_FORMATS[fmt]
+        name = (request.endpoint or 'request').replace('.', '-')
+        response.close()
+        return Response(body, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="profile-{name}.{extension}"',
+            'X-Profiled-Status': str(response.status_code)
+        })
+
+    @app.teardown_request
+    def stop_profile(exc=None):
+        # after_request doesn't run when the request failed with an unhandled error
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile[0].disable()
+            _profiling.release()
\ No newline at end of file
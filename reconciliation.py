@@ -0,0 +1,199 @@
+"""
+Bank statement import and automatic payment reconciliation
+
+Statements (CSV exports or the Czech ABO/GPC format) are parsed line by line,
+so even statements with tens of thousands of lines are never held in memory
+as a whole. Each incoming payment is matched on its variable symbol through a
+hash index over the unpaid invoices, checked against the invoice amount, and
+the matched invoices are marked as paid in batched transactions. Lines that
+can't be matched with certainty come back in the report.
+"""
+
+import csv
+import datetime
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from database import Database
+from documents import variable_symbol
+
+STATEMENT_FORMATS = ('csv', 'gpc')
+
+# Normalized CSV header -> field; bank exports name their columns differently
+CSV_COLUMNS = {
+    'variable_symbol': 'variable_symbol', 'vs': 'variable_symbol', 'variabilni_symbol': 'variable_symbol',
+    'amount': 'amount', 'castka': 'amount', 'objem': 'amount',
+    'date': 'date', 'datum': 'date', 'datum_zauctovani': 'date', 'datum_splatnosti': 'date',
+    'counterparty': 'counterparty', 'protiucet': 'counterparty', 'nazev_protiuctu': 'counterparty',
+    'message': 'message', 'zprava': 'message', 'zprava_pro_prijemce': 'message',
+}
+
+# GPC accounting code of incoming payments (1 debit, 2 credit, 4/5 their reversals)
+GPC_CREDIT = '2'
+
+
+class StatementLine(NamedTuple):
+    """One incoming payment of a statement"""
+    line: int  # line number in the statement file
+    variable_symbol: str  # without leading zeros
+    amount: Decimal
+    date: Optional[str]  # YYYY-MM-DD
+    counterparty: str = ''
+    message: str = ''
+
+
+def _normalize_header(name: str) -> str:
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().strip().lower()
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+
+def parse_amount(value: str) -> Decimal:
+    """Amount as written in Czech exports ('1 234,50', '1.234,50' or '1234.50')
+
+    Raises InvalidOperation for anything else, including 'NaN' and 'Infinity'.
+    """
+    value = re.sub(r'[\s ]', '', value)
+    if ',' in value:
+        value = value.replace('.', '').replace(',', '.')
+    amount = Decimal(value)
+    if not amount.is_finite():
+        raise InvalidOperation(f"Not a finite amount: {value}")
+    return amount
+
+
+def parse_date(value: str) -> Optional[str]:
+    """YYYY-MM-DD, DD.MM.YYYY or DD.MM.YY as YYYY-MM-DD"""
+    value = value.strip()
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y', '%d.%m.%y'):
+        try:
+            return datetime.datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[StatementLine]:
+    """Incoming payments (positive amounts) of a CSV statement with a header row"""
+    lines = iter(lines)
+    header = next(lines, '')
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    columns = [CSV_COLUMNS.get(_normalize_header(name)) for name in next(_csv_rows([header], delimiter))]
+    if 'variable_symbol' not in columns or 'amount' not in columns:
+        raise ValueError("CSV statement needs a variable symbol and an amount column")
+
+    for number, row in enumerate(_csv_rows(lines, delimiter), 2):
+        fields = {column: value for column, value in zip(columns, row) if column}
+        try:
+            amount = parse_amount(fields.get('amount', ''))
+        except InvalidOperation:
+            continue
+        if amount <= 0:
+            continue
+        yield StatementLine(number, fields.get('variable_symbol', '').strip().lstrip('0'), amount,
+                            parse_date(fields.get('date', '')), fields.get('counterparty', '').strip(),
+                            fields.get('message', '').strip())
+
+
+def _csv_rows(lines: Iterable[str], delimiter: str) -> Iterator[List[str]]:
+    """csv.reader rows, a malformed file raising ValueError like other invalid statements"""
+    try:
+        yield from csv.reader(lines, delimiter=delimiter)
+    except csv.Error as e:
+        raise ValueError(f"Malformed CSV: {e}") from e
+
+
+def parse_gpc(lines: Iterable[str]) -> Iterator[StatementLine]:
+    """Incoming payments of an ABO/GPC statement (fixed-width '075' transaction records)
+
+    Truncated or garbled records (no numeric amount in columns 49-60) are skipped.
+    """
+    for number, record in enumerate(lines, 1):
+        if not record.startswith('075') or record[60:61] != GPC_CREDIT or not record[48:60].isdigit():
+            continue
+        # Due date (columns 123-128), falling back to the value date (92-97), both DDMMYY
+        date = parse_date(_gpc_date(record[122:128])) or parse_date(_gpc_date(record[91:97]))
+        yield StatementLine(number, record[61:71].strip().lstrip('0'),
+                            Decimal(int(record[48:60])).scaleb(-2), date, record[97:117].strip())
+
+
+def _gpc_date(value: str) -> str:
+    return f"{value[0:2]}.{value[2:4]}.{value[4:6]}" if value.strip().isdigit() else ''
+
+
+def parse_statement(lines: Iterable[str], fmt: Optional[str] = None) -> Iterator[StatementLine]:
+    """Incoming payments of a statement; the format is detected when not given"""
+    lines = iter(lines)
+    if fmt is None:
+        first = next(lines, '')
+        fmt = 'gpc' if first.startswith('074') else 'csv'
+        lines = _chain(first, lines)
+    if fmt not in STATEMENT_FORMATS:
+        raise ValueError(f"Unknown statement format: {fmt}")
+    return parse_gpc(lines) if fmt == 'gpc' else parse_csv(lines)
+
+
+def _chain(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def _cents(value) -> Decimal:
+    return Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def reconcile(database: Database, payments: Iterable[StatementLine], dry_run: bool = False,
+              batch_size: int = 1000) -> Dict[str, Any]:
+    """Match payments to unpaid invoices and mark the matched ones as paid
+
+    A payment matches when exactly one unpaid invoice has its variable symbol
+    and amount. Everything else is reported as unmatched or ambiguous instead
+    of being guessed.
+    """
+    # variable symbol -> unpaid invoices, built once per statement
+    index: Dict[str, List[Dict[str, Any]]] = {}
+    for invoice in database.get_unpaid_invoice_amounts():
+        invoice['amount'] = _cents(invoice['total_amount'])
+        index.setdefault(variable_symbol(invoice['invoice_number']).lstrip('0'), []).append(invoice)
+
+    matched, unmatched, ambiguous = [], [], []
+    paid_ids = set()
+    total = 0
+    for payment in payments:
+        total += 1
+        candidates = index.get(payment.variable_symbol, []) if payment.variable_symbol else []
+        same_amount = [invoice for invoice in candidates if invoice['amount'] == payment.amount]
+        report = {"line": payment.line, "variable_symbol": payment.variable_symbol,
+                  "amount": str(payment.amount), "date": payment.date, "counterparty": payment.counterparty}
+
+        if not candidates:
+            unmatched.append({**report, "reason": "No unpaid invoice with this variable symbol"})
+        elif not same_amount:
+            unmatched.append({**report, "reason": "Amount differs from the invoice",
+                              "invoice_amounts": [str(invoice['amount']) for invoice in candidates]})
+        elif len(same_amount) > 1:
+            ambiguous.append({**report, "invoice_numbers": [invoice['invoice_number'] for invoice in same_amount]})
+        elif same_amount[0]['id'] in paid_ids:
+            unmatched.append({**report, "reason": "Invoice already paid by an earlier line",
+                              "invoice_number": same_amount[0]['invoice_number']})
+        elif payment.date is None:
+            unmatched.append({**report, "reason": "Missing or invalid payment date"})
+        else:
+            invoice = same_amount[0]
+            paid_ids.add(invoice['id'])
+            matched.append({**report, "invoice_id": invoice['id'], "invoice_number": invoice['invoice_number']})
+
+    updated = 0
+    if not dry_run:
+        updated = database.mark_invoices_paid([(match['invoice_id'], match['date']) for match in matched],
+                                              batch_size=batch_size)
+    return {
+        "payments": total,
+        "matched": len(matched),
+        "updated": updated,
+        "dry_run": dry_run,
+        "matches": matched,
+        "unmatched": unmatched,
+        "ambiguous": ambiguous
+    }
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+Reporting snapshots: report queries read a periodically refreshed copy
+
+Each database the reports are asked for gets a copy in the snapshot
+directory, made with the online backup API in small steps (see backup.py) and
+swapped in once complete. Every copy gets new files numbered by its generation
+instead of being renamed over the previous one, which Windows refuses while a
+report still reads it; the files of a replaced copy are deleted once no report
+holds it any more. Reports read the copy while it is younger than the
+staleness bound, so long report queries never hold locks on the live file
+that invoice writes have to wait for. A copy that got too old (or isn't made
+yet) is refreshed in the background while reports fall back to the live
+database, so answers are never staler than the bound.
+
+The archive database is copied along with the hot one, so invoices moved to
+the archive while a snapshot is made are counted exactly once. Copies are
+skipped while neither live file has changed since the last one; the
+snapshot then only counts as fresh again.
+"""
+
+import datetime
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backup import DEFAULT_MAX_RESTARTS, DEFAULT_PAGES_PER_STEP, DEFAULT_STEP_PAUSE, BackupError, copy_database
+from coherence import generation_path
+from database import Database
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get('INVOICE_REPORT_SNAPSHOT_DIR', 'report_snapshots')
+
+# Files of a snapshot generation next to the snapshot base name (invoices.3.db, invoices.3_archive.db-wal, ...)
+GENERATION_FILE_PATTERN = re.compile(r'^\.(\d+)(_archive)?\.(db(-journal|-wal|-shm|\.partial)?|generations)$')
+
+
+def _file_state(path: str) -> Tuple:
+    """Modification time and size of a database and its WAL, to notice writes"""
+    state = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+            state.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            state.append(None)
+    return tuple(state)
+
+
+def _snapshot_files(path: str, archive_path: str) -> List[str]:
+    """Files of one snapshot generation: both copies with their journals, and the generation file"""
+    return ([name + suffix for name in (path, archive_path) for suffix in ('', '-journal', '-wal', '-shm')]
+            + [generation_path(path)])
+
+
+class ReportSnapshot:
+    """Copy of one database for the report queries, kept under the base name ``path``"""
+
+    def __init__(self, database: Database, path: str):
+        self.database = database
+        self.path = path
+        self.snapshot: Optional[Database] = None
+        self.as_of: Optional[float] = None  # wall clock time the snapshot's data is from
+        self._source_state = None
+        self._lock = threading.Lock()  # held for a whole refresh
+        self._refreshing = threading.Lock()  # held while a background refresh is pending
+        # Files of replaced generations not deleted yet, left over ones of a previous run included
+        # (and the unnumbered copies written before snapshots had generations)
+        self._retired = [name for name in _snapshot_files(path, os.path.splitext(path)[0] + '_archive.db')
+                         if os.path.exists(name)]
+        self._retired_lock = threading.Lock()
+        self._generation = 0
+        prefix = os.path.basename(os.path.splitext(path)[0])
+        for name in glob.glob(glob.escape(os.path.splitext(path)[0]) + '.*'):
+            match = GENERATION_FILE_PATTERN.match(os.path.basename(name)[len(prefix):])
+            if match:
+                self._retired.append(name)
+                self._generation = max(self._generation, int(match.group(1)))
+        self._copies = 0
+        self._skipped = 0
+        self._failures = 0
+        self._last_copy_seconds: Optional[float] = None
+
+    def refresh(self):
+        """Copy the live database and its archive unless neither changed since the last copy"""
+        with self._lock:
+            started = time.time()
+            state = (_file_state(self.database.db_path), _file_state(self.database.archive_path))
+            if self.snapshot is not None and state == self._source_state:
+                self.as_of = started
+                self._skipped += 1
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._remove_retired()
+            self._generation += 1
+            path, archive_path = self._generation_paths(self._generation)
+            try:
+                self._copy(path, archive_path)
+            except Exception:
+                self._failures += 1
+                raise
+            previous, self.snapshot = self.snapshot, Database(path, archive_path=archive_path, cache_size=0)
+            if previous is not None:
+                # Queries in flight keep reading the previous copy; its files go once they drop it
+                # (previous._release rather than previous.close, which would keep it alive)
+                weakref.finalize(previous, self._retire, _snapshot_files(previous.db_path, previous.archive_path),
+                                 previous._release)
+            self._source_state = state
+            self.as_of = started
+            self._copies += 1
+            self._last_copy_seconds = round(time.time() - started, 3)
+
+    def _generation_paths(self, number: int) -> Tuple[str, str]:
+        """Files of a snapshot generation: invoices.db -> invoices.3.db and invoices.3_archive.db"""
+        base = f"{os.path.splitext(self.path)[0]}.{number}"
+        return base + '.db', base + '_archive.db'
+
+    def _copy(self, path: str, archive_path: str):
+        """Copy the hot database, then the archive, retrying while invoices are moved between them"""
+        partial, archive_partial = path + '.partial', archive_path + '.partial'
+        source_archive = self.database.archive_path
+        # Moving invoices commits to both files at once, so an archive that didn't
+        # change while both were copied pairs with the hot copy
+        watch = None
+        try:
+            for _ in range(DEFAULT_MAX_RESTARTS + 1):
+                if watch is None and os.path.exists(source_archive):
+                    watch = sqlite3.connect(source_archive)
+                version = watch.execute("PRAGMA data_version").fetchone()[0] if watch else None
+                copy_database(self.database.db_path, partial, DEFAULT_PAGES_PER_STEP, DEFAULT_STEP_PAUSE)
+                if not watch:
+                    if not os.path.exists(source_archive):
+                        break
+                    continue  # the first invoices were archived meanwhile
+                copy_database(source_archive, archive_partial, DEFAULT_PAGES_PER_STEP, DEFAULT_STEP_PAUSE)
+                if watch.execute("PRAGMA data_version").fetchone()[0] == version:
+                    break
+            else:
+                raise BackupError(f"Invoices of {self.database.db_path} kept moving to or from the archive")
+            if watch:
+                os.replace(archive_partial, archive_path)
+            os.replace(partial, path)
+        finally:
+            if watch:
+                watch.close()
+            for name in (partial, archive_partial):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def _retire(self, files: List[str], close: Callable[[], None]):
+        """Delete the files of a replaced snapshot, called once no report holds it"""
+        close()
+        with self._retired_lock:
+            self._retired += files
+        self._remove_retired()
+
+    def _remove_retired(self):
+        """Delete retired files; one still open elsewhere (on Windows) is retried on the next refresh"""
+        with self._retired_lock:
+            retired, self._retired = self._retired, []
+        kept = []
+        for name in retired:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                kept.append(name)
+        with self._retired_lock:
+            self._retired += kept
+
+    def refresh_in_background(self):
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name='report-snapshot', daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        with self._retired_lock:
+            retired = len(self._retired)
+        return {
+            "snapshot": snapshot.db_path if snapshot else None,
+            "archive_snapshot": snapshot.archive_path if snapshot and os.path.exists(snapshot.archive_path) else None,
+            "generation": self._generation,
+            "retired_files_pending": retired,
+            "as_of": datetime.datetime.fromtimestamp(self.as_of).isoformat(timespec='seconds') if self.as_of else None,
+            "age_seconds": round(time.time() - self.as_of, 1) if self.as_of else None,
+            "copies": self._copies,
+            "unchanged_skips": self._skipped,
+            "failures": self._failures,
+            "last_copy_seconds": self._last_copy_seconds
+        }
+
+
+class ReportSnapshots:
+    """Reporting snapshots of every database reports were asked for
+
+    With ``max_staleness`` 0 snapshots are disabled and reports read the
+    live databases.
+    """
+
+    def __init__(self, max_staleness: float, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+        self.max_staleness = max_staleness
+        self.snapshot_dir = snapshot_dir
+        self._snapshots: Dict[str, ReportSnapshot] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_staleness > 0
+
+    def snapshot_path(self, db_path: str) -> str:
+        """Base name of a database's snapshots (shards/acme.db -> <snapshot_dir>/shards_acme.db,
+        whose generations are shards_acme.1.db, shards_acme.2.db, ...)"""
+        return os.path.join(self.snapshot_dir, os.path.normpath(db_path).lstrip(os.sep).replace(os.sep, '_'))
+
+    def source(self, database: Database) -> Tuple[Database, float]:
+        """Database the reports of ``database`` read, and the time its data is from"""
+        if not self.enabled:
+            return database, time.time()
+        with self._lock:
+            snapshot = self._snapshots.get(database.db_path)
+            if snapshot is None:
+                snapshot = self._snapshots[database.db_path] = ReportSnapshot(
+                    database, self.snapshot_path(database.db_path)
+                )
+        snapshot_db, as_of = snapshot.snapshot, snapshot.as_of
+        if snapshot_db is not None and time.time() - as_of <= self.max_staleness:
+            return snapshot_db, as_of
+        snapshot.refresh_in_background()
+        return database, time.time()
+
+    def start(self) -> threading.Thread:
+        """Refresh every snapshot twice per staleness bound, so reports normally stay on them"""
+        thread = threading.Thread(target=self._loop, name='report-snapshots', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.max_staleness / 2):
+            with self._lock:
+                snapshots = list(self._snapshots.values())
+            for snapshot in snapshots:
+                try:
+                    snapshot.refresh()
+                except Exception:
+                    pass  # counted in the snapshot's failures, the live database serves meanwhile
+
+    def stats(self) -> Dict[str, Any]:
+        """Staleness bound and the age and copy counts of each snapshot"""
+        with self._lock:
+            snapshots = dict(self._snapshots)
+        return {
+            "max_staleness_seconds": self.max_staleness,
+            "snapshots": {path: snapshot.stats() for path, snapshot in snapshots.items()}
+        }
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Compact query results: plain tuples sharing one tuple of column names
+
+A list of dicts repeats every column name in a hash table per row, which for
+large listings dominates memory use and keeps the garbage collector busy.
+``Rows`` keeps the tuples sqlite3 returns without a row factory plus a
+single ``columns`` tuple. Named records are only built when a row is looked
+at, and iter_json() serializes in chunks, so a large listing is never held as
+dicts or as one JSON string.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Rows turned into dicts and encoded at once while serializing
+JSON_CHUNK_ROWS = 1000
+
+
+@lru_cache(maxsize=64)
+def record_type(columns: Tuple[str, ...]):
+    """Namedtuple class of rows with these columns, one per distinct column list"""
+    return namedtuple('Record', columns, rename=True)
+
+
+class Rows:
+    """Query result as a list of tuples plus their shared column names"""
+
+    __slots__ = ('columns', 'data')
+
+    def __init__(self, columns: Sequence[str], data: List[tuple]):
+        self.columns = tuple(columns)
+        self.data = data
+
+    @classmethod
+    def from_cursor(cls, cursor) -> 'Rows':
+        """All remaining rows of a cursor executed without a row factory"""
+        return cls([column[0] for column in cursor.description], cursor.fetchall())
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index: int):
+        return record_type(self.columns)._make(self.data[index])
+
+    def __iter__(self) -> Iterator:
+        return map(record_type(self.columns)._make, self.data)
+
+    def column(self, name: str) -> List[Any]:
+        """All values of one column"""
+        index = self.columns.index(name)
+        return [row[index] for row in self.data]
+
+    def dicts(self) -> List[Dict[str, Any]]:
+        """Rows as dicts, for callers that need the classic shape"""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.data]
+
+    def iter_json(self, dumps: Callable[[Any], str], chunk_rows: int = JSON_CHUNK_ROWS) -> Iterator[str]:
+        """JSON array of row objects, in pieces; ``dumps`` must produce compact output"""
+        columns = self.columns
+        yield '['
+        for start in range(0, len(self.data), chunk_rows):
+            chunk = dumps([dict(zip(columns, row)) for row in self.data[start:start + chunk_rows]])
+            yield (',' if start else '') + chunk[1:-1]
+        yield ']'
+
+
+def iter_json_object(body: Dict[str, Any], dumps: Callable[[Any], str], sort_keys: bool = True) -> Iterator[str]:
+    """JSON of a dict, streaming its Rows values; same text as ``dumps(body)`` with rows as dicts"""
+    yield '{'
+    for position, key in enumerate(sorted(body) if sort_keys else body):
+        yield (',' if position else '') + dumps(key) + ':'
+        value = body[key]
+        if isinstance(value, Rows):
+            yield from value.iter_json(dumps)
+        else:
+            yield dumps(value)
+    yield '}'
\ No newline at end of file
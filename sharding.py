@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Per-company database sharding for the Invoice Management System
+
+Every company (tenant) gets its own SQLite file in the shard directory, so a
+large tenant neither slows down the reports of the others nor holds their
+write locks. Users without a company keep using the default database. The
+archives of old paid invoices live in the archive/ subdirectory, so they are
+never taken for tenants.
+
+Admin tooling:
+    python sharding.py list
+    python sharding.py migrate [--workers N]
+    python sharding.py vacuum [--workers N]
+"""
+
+import argparse
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from database import Database
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Subdirectory of the shard directory holding each tenant's archive database
+ARCHIVE_DIR = 'archive'
+
+
+class ShardRouter:
+    """Route each tenant to its own Database, opened lazily and kept in an LRU"""
+
+    def __init__(self, shard_dir: str = 'shards', default: Optional[Database] = None,
+                 max_open: int = 64):
+        self.shard_dir = shard_dir
+        self.default = default
+        self.max_open = max_open
+        self._open: 'OrderedDict[str, Database]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def shard_path(self, tenant_id: str) -> str:
+        """Path of the SQLite file holding the given tenant's data"""
+        if not TENANT_ID_PATTERN.match(tenant_id):
+            raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+        return os.path.join(self.shard_dir, f"{tenant_id}.db")
+
+    def archive_path(self, tenant_id: str) -> str:
+        """Path of the SQLite file holding the given tenant's archived invoices"""
+        if not TENANT_ID_PATTERN.match(tenant_id):
+            raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+        return os.path.join(self.shard_dir, ARCHIVE_DIR, f"{tenant_id}.db")
+
+    def open_shard(self, tenant_id: str) -> Database:
+        """Open (and migrate) a tenant's database outside the LRU, with its archive in place"""
+        archive_path = self.archive_path(tenant_id)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        # Archives used to be written next to the shard as <tenant>_archive.db
+        legacy = os.path.join(self.shard_dir, f"{tenant_id}_archive.db")
+        if os.path.exists(legacy) and not os.path.exists(archive_path):
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.replace(legacy + suffix, archive_path + suffix)
+                except FileNotFoundError:
+                    pass
+        return Database(self.shard_path(tenant_id), archive_path=archive_path)
+
+    def get(self, tenant_id: Optional[str]) -> Database:
+        """Get the database of a tenant, opening (and migrating) it on first use"""
+        if tenant_id is None:
+            return self.default
+
+        with self._lock:
+            shard = self._open.get(tenant_id)
+            if shard is not None:
+                self._open.move_to_end(tenant_id)
+                return shard
+
+        # Opening runs init_db, so do it outside the lock to not block other tenants
+        os.makedirs(self.shard_dir, exist_ok=True)
+        shard = self.open_shard(tenant_id)
+
+        with self._lock:
+            shard = self._open.setdefault(tenant_id, shard)
+            self._open.move_to_end(tenant_id)
+            # Drop the least recently used shards beyond the limit; a dropped Database
+            # releases its generation file once the requests still using it are done
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return shard
+
+    def open_tenants(self) -> List[str]:
+        """Tenants whose shards are currently open, least recently used first"""
+        with self._lock:
+            return list(self._open)
+
+    def tenants(self) -> List[str]:
+        """All tenants that have a shard file on disk"""
+        if not os.path.isdir(self.shard_dir):
+            return []
+        names = {name[:-3] for name in os.listdir(self.shard_dir)
+                 if name.endswith('.db') and TENANT_ID_PATTERN.match(name[:-3])}
+        # Not yet moved archives of the old layout (<tenant>_archive.db) aren't tenants
+        return sorted(name for name in names
+                      if not (name.endswith('_archive') and name[:-len('_archive')] in names))
+
+    def database_paths(self) -> List[str]:
+        """Files of every shard and of the archives present, for backups and maintenance"""
+        paths = []
+        for tenant_id in self.tenants():
+            paths.append(self.shard_path(tenant_id))
+            if os.path.exists(self.archive_path(tenant_id)):
+                paths.append(self.archive_path(tenant_id))
+        return paths
+
+    def list_shards(self) -> List[Dict[str, Any]]:
+        """Describe every shard on disk"""
+        open_tenants = set(self.open_tenants())
+        return [
+            {
+                "tenant_id": tenant_id,
+                "path": self.shard_path(tenant_id),
+                "size_bytes": os.path.getsize(self.shard_path(tenant_id)),
+                "open": tenant_id in open_tenants
+            }
+            for tenant_id in self.tenants()
+        ]
+
+    def migrate_all(self, workers: int = 4) -> Dict[str, Dict[str, Any]]:
+        """Bring the schema of every shard up to date and backfill its customers table"""
+        def migrate(tenant_id):
+            # Database() runs the schema migrations on open
+            shard = self.open_shard(tenant_id)
+            try:
+                return {"customers_migrated": shard.migrate_customers()}
+            finally:
+                shard.close()
+
+        return self._run_parallel(migrate, workers)
+
+    def vacuum_all(self, workers: int = 4) -> Dict[str, Dict[str, Any]]:
+        """VACUUM every shard and report the space reclaimed"""
+        def vacuum(tenant_id):
+            path = self.shard_path(tenant_id)
+            size_before = os.path.getsize(path)
+            shard = self.open_shard(tenant_id)
+            try:
+                shard.vacuum()
+            finally:
+                shard.close()
+            return {"reclaimed_bytes": size_before - os.path.getsize(path)}
+
+        return self._run_parallel(vacuum, workers)
+
+    def _run_parallel(self, task: Callable[[str], Optional[Dict[str, Any]]],
+                      workers: int) -> Dict[str, Dict[str, Any]]:
+        """Run a task for every shard on a thread pool, collecting per-shard results"""
+        def run(tenant_id):
+            started = time.perf_counter()
+            try:
+                result = {"ok": True, **(task(tenant_id) or {})}
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            return tenant_id, result
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(run, self.tenants()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage per-company invoice database shards")
+    parser.add_argument('command', choices=['list', 'migrate', 'vacuum'])
+    parser.add_argument('--shard-dir', default=os.environ.get('INVOICE_SHARD_DIR', 'shards'))
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    router = ShardRouter(args.shard_dir)
+    if args.command == 'list':
+        for shard in router.list_shards():
+            print(f"{shard['tenant_id']:<32} {shard['size_bytes']:>12} B  {shard['path']}")
+        return
+
+    results = router.migrate_all(args.workers) if args.command == 'migrate' else router.vacuum_all(args.workers)
+    for tenant_id, result in results.items():
+        status = "✓" if result["ok"] else f"✗ {result['error']}"
+        extra = f" reclaimed {result['reclaimed_bytes']} B" if "reclaimed_bytes" in result else ""
+        print(f"{status} {tenant_id} ({result['seconds']} s){extra}")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+Single-flight coalescing of identical concurrent computations
+
+While a computation for a key is running, other callers asking for the same
+key wait for its result instead of starting their own. Errors of the
+computation are raised in every waiting caller.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when waiting for an in-flight computation takes too long"""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._executions = 0
+        self._coalesced = 0
+        self._errors = 0
+        self._timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: float = 30.0,
+           on_wait: Optional[Callable[[], None]] = None) -> Any:
+        """Return ``fn()``, or the result of an identical call already in flight
+
+        ``on_wait`` is called before a caller starts waiting for another
+        caller's computation.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                call.waiters += 1
+                self._coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self._errors += 1
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            if on_wait:
+                on_wait()
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self._timeouts += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout} s waiting for {key!r}")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """Executions, coalesced calls (queries saved), errors and timeouts"""
+        with self._lock:
+            return {
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "errors": self._errors,
+                "timeouts": self._timeouts,
+                "in_flight": len(self._calls)
+            }
\ No newline at end of file
@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from admission import AdmissionController, RouteLimit, TokenBuckets
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('admission.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buckets = TokenBuckets(stripes=2)
+        self.limit = RouteLimit(rate=2, burst=3)
+
+    def test_burst_then_wait_for_refill(self):
+        self.assertEqual([self.buckets.take('anna', self.limit) for _ in range(3)], [0.0] * 3)
+        self.assertAlmostEqual(self.buckets.take('anna', self.limit), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(self.buckets.take('anna', self.limit), 0.0)
+        self.assertAlmostEqual(self.buckets.take('anna', self.limit), 0.5)
+
+    def test_refill_stops_at_burst(self):
+        self.buckets.take('anna', self.limit)
+        self.clock.now += 3600
+        self.assertEqual([self.buckets.take('anna', self.limit) for _ in range(3)], [0.0] * 3)
+        self.assertGreater(self.buckets.take('anna', self.limit), 0)
+
+    def test_keys_are_independent(self):
+        for _ in range(3):
+            self.buckets.take('anna', self.limit)
+        self.assertGreater(self.buckets.take('anna', self.limit), 0)
+        self.assertEqual(self.buckets.take('petr', self.limit), 0.0)
+
+    def test_idle_buckets_are_pruned(self):
+        buckets = TokenBuckets(stripes=1, max_keys_per_stripe=2)
+        for key in ('a', 'b'):
+            buckets.take(key, self.limit)
+        self.clock.now += 10
+        for _ in range(4):
+            buckets.take('c', self.limit)  # the refusal prunes the full buckets of 'a' and 'b'
+        self.assertEqual(list(buckets._stripes[0][0]), ['c'])
+
+
+class AdmissionControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('admission.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admission = AdmissionController(default=RouteLimit(rate=10, burst=5),
+                                             routes={'login': RouteLimit(rate=0.5, burst=1)},
+                                             max_expensive=1)
+
+    def test_rate_limited_with_retry_after(self):
+        self.assertEqual(self.admission.admit('anna', 'login', '/api/login'), (None, False))
+        rejection, holds_slot = self.admission.admit('anna', 'login', '/api/login')
+        body, status, headers = rejection
+        self.assertEqual((status, headers), (429, {"Retry-After": "2"}))
+        self.assertFalse(holds_slot)
+        # The route limit doesn't hold back the user's other requests
+        self.assertEqual(self.admission.admit('anna', 'get_invoices', '/api/invoices'), (None, False))
+        self.assertEqual(self.admission.stats()['shed'], {"rate_limited": {"login": 1}, "overloaded": {}})
+
+    def test_expensive_routes_share_a_concurrency_limit(self):
+        self.assertEqual(self.admission.admit('anna', 'get_unpaid_invoices', '/api/reports/unpaid'), (None, True))
+        rejection, holds_slot = self.admission.admit('petr', 'get_overdue_invoices', '/api/reports/overdue')
+        self.assertEqual(rejection[1:], (503, {"Retry-After": "1"}))
+        self.assertFalse(holds_slot)
+
+        self.admission.release()
+        self.assertEqual(self.admission.admit('petr', 'get_overdue_invoices', '/api/reports/overdue'), (None, True))
+        self.assertEqual(self.admission.stats()['expensive_in_flight'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from analytics import PERCENTILES, _percentiles
+
+
+def percentiles_of(days):
+    """_percentiles of a list of day values, counted the way payment_stats counts them"""
+    days = np.array(days)
+    offset = int(days.min())
+    return _percentiles(np.bincount(days - offset), offset)
+
+
+class PercentilesTestCase(unittest.TestCase):
+    def assert_matches_numpy(self, days):
+        expected = np.percentile(days, PERCENTILES)
+        result = percentiles_of(days)
+        self.assertEqual(list(result), [f"p{p}" for p in PERCENTILES])
+        for value, want in zip(result.values(), expected):
+            self.assertAlmostEqual(value, want)
+
+    def test_empty(self):
+        """No values give no percentiles"""
+        self.assertEqual(_percentiles(np.array([], dtype=np.int64), 0), {f"p{p}": None for p in PERCENTILES})
+        self.assertEqual(_percentiles(np.zeros(3, dtype=np.int64), 5), {f"p{p}": None for p in PERCENTILES})
+
+    def test_single_value(self):
+        """Every percentile of one value is that value"""
+        self.assertEqual(set(percentiles_of([12]).values()), {12.0})
+        self.assert_matches_numpy([12])
+
+    def test_even_count(self):
+        """Between two middle values the median interpolates, as np.percentile does"""
+        self.assertEqual(percentiles_of([1, 2, 3, 4])['p50'], 2.5)
+        self.assert_matches_numpy([1, 2, 3, 4])
+        self.assert_matches_numpy([0, 0, 7, 30, 30, 31, 90, 120])
+
+    def test_repeated_and_negative_days(self):
+        """Repeated days and payments before the issue date (negative days) count correctly"""
+        self.assert_matches_numpy([-3, -3, 0, 5, 5, 5, 14])
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
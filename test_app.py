@@ -0,0 +1,322 @@
+import importlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from admission import AdmissionController, RouteLimit
+from database import Database
+from jobs import JobRunner
+from sharding import ShardRouter
+
+
+class AppTestCase(unittest.TestCase):
+    """Endpoints of app.py on a scratch database, without rate limits"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Import the app in a scratch directory, it creates its database on import"""
+        cls.import_dir = tempfile.mkdtemp(prefix='app-')
+        cwd = os.getcwd()
+        os.chdir(cls.import_dir)
+        try:
+            cls.app = importlib.import_module('app')
+        finally:
+            os.chdir(cwd)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.import_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='app-')
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+        self.db.create_user('owner', 'owner123', 'owner')
+        self.shards = ShardRouter(os.path.join(self.work_dir, 'shards'), default=self.db)
+        self.patch('db', self.db)
+        self.patch('shards', self.shards)
+        self.patch('admission', AdmissionController(default=RouteLimit(rate=1e9, burst=10 ** 9)))
+        self.client = self.app.app.test_client()
+
+    def patch(self, name, value):
+        patcher = mock.patch.object(self.app, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, username='owner', password='owner123', client=None):
+        response = (client or self.client).post('/api/login', json={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response
+
+    def create_invoice(self, database=None, **data):
+        return (database or self.db).create_invoice({
+            'issue_date': '2025-01-10', 'due_date': '2025-01-24', 'total_amount': 1000,
+            'customer_name': 'Acme s.r.o.', 'customer_ic': '12345678', **data
+        })
+
+
+class InvoiceChangesEndpointTestCase(AppTestCase):
+    def test_compacted_cursor_gets_410_and_resync_pages_through(self):
+        self.login()
+        kept, deleted = self.create_invoice(), self.create_invoice()
+        cursor = self.client.get('/api/invoices').get_json()['last_seq']
+        self.db.update_invoice(kept['id'], {'total_amount': 1100})
+        self.db.delete_invoice(deleted['id'])
+        with self.db.get_connection() as conn:
+            conn.execute("UPDATE invoice_changes SET changed_at = datetime('now', '-100 days')")
+        self.db.compact_invoice_changes()
+
+        response = self.client.get(f'/api/invoices/changes?since={cursor}')
+        self.assertEqual(response.status_code, 410)
+        purged_through = response.get_json()['purged_through']
+        self.assertGreater(purged_through, cursor)
+
+        since, changes = 0, []
+        while True:
+            page = self.client.get(f'/api/invoices/changes?since={since}&limit=1&resync=1').get_json()
+            changes += page['changes']
+            since = page['last_seq']
+            if not page['has_more']:
+                break
+        self.assertEqual([change['invoice_id'] for change in changes], [kept['id']])
+        self.assertGreaterEqual(since, purged_through)
+        self.assertEqual(self.client.get(f'/api/invoices/changes?since={since}').status_code, 200)
+
+    def test_list_returns_cursor(self):
+        self.login()
+        self.create_invoice()
+        body = self.client.get('/api/invoices').get_json()
+        self.assertEqual(len(body['invoices']), 1)
+        self.assertEqual(self.client.get(f"/api/invoices/changes?since={body['last_seq']}").get_json()['changes'], [])
+
+    def test_invalid_parameters(self):
+        self.login()
+        for query in ('since=x', 'since=-1', 'limit=0', 'limit=100000'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/invoices/changes?{query}').status_code, 400)
+
+
+class FieldsTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.invoice = self.create_invoice()
+        self.create_invoice(customer_name='Beta a.s.', customer_ic='87654321', total_amount=3000)
+
+    def test_list_is_projected(self):
+        invoices = self.client.get('/api/invoices?fields=invoice_number, total_amount').get_json()['invoices']
+        self.assertEqual(len(invoices), 2)
+        self.assertTrue(all(set(invoice) == {'invoice_number', 'total_amount'} for invoice in invoices))
+
+    def test_detail_is_projected(self):
+        body = self.client.get(f"/api/invoices/{self.invoice['id']}?fields=customer_name,id").get_json()
+        self.assertEqual(body, {'id': self.invoice['id'], 'customer_name': 'Acme s.r.o.'})
+
+    def test_reports_are_projected(self):
+        debtors = self.client.get('/api/reports/largest-debtors?fields=customer_ic,total_debt').get_json()['debtors']
+        self.assertEqual(debtors, [{'customer_ic': '87654321', 'total_debt': 3000},
+                                   {'customer_ic': '12345678', 'total_debt': 1000}])
+        unpaid = self.client.get('/api/reports/unpaid?fields=id').get_json()['invoices']
+        self.assertEqual(sorted(invoice['id'] for invoice in unpaid), [self.invoice['id'], self.invoice['id'] + 1])
+        overdue = self.client.get('/api/reports/overdue?fields=id,days_overdue').get_json()['invoices']
+        self.assertTrue(all(set(invoice) == {'id', 'days_overdue'} for invoice in overdue))
+
+    def test_unknown_fields_are_rejected(self):
+        for path in ('/api/invoices?fields=id,password', '/api/invoices?fields=', '/api/invoices?fields=,',
+                     f"/api/invoices/{self.invoice['id']}?fields=id;DROP TABLE invoices",
+                     '/api/reports/largest-debtors?fields=invoice_number',
+                     '/api/reports/unpaid?fields=days_overdue'):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('fields must be', response.get_json()['error'])
+        self.assertEqual(len(self.db.get_all_invoices()), 2)
+
+    def test_database_selects_only_the_fields(self):
+        rows = self.db.get_all_invoices(fields=('id', 'customer_ic'), compact=True)
+        self.assertEqual(rows.columns, ('id', 'customer_ic'))
+
+
+class BatchTestCase(AppTestCase):
+    def batch(self, *requests):
+        return self.client.post('/api/batch', json={"requests": list(requests)})
+
+    def test_responses_in_request_order_with_their_status(self):
+        self.login()
+        invoice = self.create_invoice()
+        response = self.batch(
+            {"path": f"/api/invoices/{invoice['id']}?fields=id"},
+            {"path": "/api/invoices/99999"},
+            {"method": "post", "path": "/api/invoices",
+             "body": {"customer_name": "Beta a.s.", "issue_date": "2025-02-01", "total_amount": 500}},
+            {"method": "POST", "path": "/api/invoices", "body": {"issue_date": "2025-02-01"}},
+            {"path": "/api/invoices?fields=customer_name"},
+        )
+        self.assertEqual(response.status_code, 200)
+        responses = response.get_json()['responses']
+        self.assertEqual([sub['status'] for sub in responses], [200, 404, 201, 400, 200])
+        self.assertEqual(responses[0]['body'], {'id': invoice['id']})
+        self.assertEqual(responses[2]['body']['customer_name'], 'Beta a.s.')
+        # A GET after a write runs after it and sees its result
+        self.assertEqual(len(responses[4]['body']['invoices']), 2)
+
+    def test_sub_requests_keep_the_roles_of_the_user(self):
+        self.db.create_user('ucetni', 'ucetni123', 'accountant')
+        self.login('ucetni', 'ucetni123')
+        invoice = self.create_invoice()
+        responses = self.batch({"method": "DELETE", "path": f"/api/invoices/{invoice['id']}"},
+                               {"path": "/api/me"}).get_json()['responses']
+        self.assertEqual([sub['status'] for sub in responses], [403, 200])
+        self.assertEqual(responses[1]['body']['username'], 'ucetni')
+        self.assertIsNotNone(self.db.get_invoice_by_id(invoice['id']))
+
+    def test_invalid_batches(self):
+        self.assertEqual(self.batch({"path": "/api/me"}).status_code, 401)
+        self.login()
+        for body in ({}, {"requests": []}, {"requests": "GET /api/me"},
+                     {"requests": [{"path": "/api/me"}] * (self.app.MAX_BATCH_REQUESTS + 1)},
+                     {"requests": [{"path": "/admin"}]}, {"requests": [{"method": "GET"}]},
+                     {"requests": [{"path": "/api/batch"}]}, {"requests": [{"path": "/api/logout"}]}):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post('/api/batch', json=body).status_code, 400)
+
+
+class AdmissionEndpointTestCase(AppTestCase):
+    def test_requests_over_the_limit_get_429_with_retry_after(self):
+        self.login()
+        self.patch('admission', AdmissionController(default=RouteLimit(rate=0.1, burst=2)))
+        self.assertEqual([self.client.get('/api/me').status_code for _ in range(2)], [200, 200])
+        response = self.client.get('/api/me')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '10')
+        self.assertEqual(self.app.admission.stats()['shed']['rate_limited'], {'get_current_user': 1})
+
+    def test_every_sub_request_of_a_batch_is_charged(self):
+        self.login()
+        self.patch('admission', AdmissionController(default=RouteLimit(rate=0.1, burst=3)))
+        responses = self.client.post('/api/batch', json={"requests": [{"path": "/api/me"}] * 3}).get_json()
+        self.assertEqual([sub['status'] for sub in responses['responses']], [200, 200, 429])
+
+    def test_report_concurrency_limit(self):
+        self.login()
+        admission = AdmissionController(default=RouteLimit(rate=1e9, burst=10 ** 9), max_expensive=1)
+        self.patch('admission', admission)
+        admission.admit('someone else', 'get_unpaid_invoices', '/api/reports/unpaid')  # holds the only slot
+        self.assertEqual(self.client.get('/api/reports/unpaid').status_code, 503)
+        admission.release()
+        self.assertEqual(self.client.get('/api/reports/unpaid').status_code, 200)
+        self.assertEqual(admission.stats()['expensive_in_flight'], 0)
+
+
+class TenantRoutingTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.create_user('acme', 'acme123', 'owner', company_id='acme')
+        self.db.create_user('globex', 'globex123', 'owner', company_id='globex')
+
+    def post_invoice(self, client, customer_name):
+        response = client.post('/api/invoices', json={"customer_name": customer_name, "issue_date": "2025-02-01",
+                                                      "total_amount": 100})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()
+
+    def test_company_users_read_and_write_their_shard(self):
+        acme, globex = self.app.app.test_client(), self.app.app.test_client()
+        self.login('acme', 'acme123', acme)
+        self.login('globex', 'globex123', globex)
+        self.login()
+
+        acme_invoice = self.post_invoice(acme, 'Acme customer')
+        self.post_invoice(globex, 'Globex customer')
+        self.post_invoice(self.client, 'Default customer')
+
+        for client, name in ((acme, 'Acme customer'), (globex, 'Globex customer'), (self.client, 'Default customer')):
+            invoices = client.get('/api/invoices?fields=customer_name').get_json()['invoices']
+            self.assertEqual(invoices, [{'customer_name': name}])
+        self.assertEqual(self.shards.get('acme').get_invoice_by_id(acme_invoice['id'])['customer_name'],
+                         'Acme customer')
+        self.assertTrue(os.path.exists(self.shards.shard_path('acme')))
+        self.assertEqual(sorted(self.shards.open_tenants()), ['acme', 'globex'])
+
+    def test_same_ids_in_other_companies_are_other_invoices(self):
+        acme, globex = self.app.app.test_client(), self.app.app.test_client()
+        self.login('acme', 'acme123', acme)
+        self.login('globex', 'globex123', globex)
+        invoice = self.post_invoice(acme, 'Acme customer')
+
+        self.post_invoice(globex, 'Globex customer')  # globex's first invoice gets the same id
+        self.assertEqual(globex.get(f"/api/invoices/{invoice['id']}").get_json()['customer_name'], 'Globex customer')
+        self.assertEqual(globex.delete(f"/api/invoices/{invoice['id']}").status_code, 200)
+        self.assertIsNotNone(self.shards.get('acme').get_invoice_by_id(invoice['id']))
+
+
+
+class BankStatementTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.create_invoice()
+
+    def import_statement(self, statement):
+        return self.client.post('/api/bank-statements?format=csv', data=statement.encode())
+
+    def test_non_finite_amount_is_skipped(self):
+        response = self.import_statement('VS;Částka\n2025001;NaN\n2025001;Infinity\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['matched'], 0)
+
+    def test_malformed_csv_is_rejected(self):
+        for statement in ('VS;Částka\n2025001;"' + 'x' * 200000 + '"\n', 'Datum;Zpráva\n2025-01-10;platba\n'):
+            with self.subTest(statement=statement[:30]):
+                response = self.import_statement(statement)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid bank statement', response.get_json()['error'])
+
+
+class JobsEndpointTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.jobs = JobRunner(self.db, os.path.join(self.work_dir, 'job_results'))
+        self.addCleanup(self.jobs.shutdown)
+        self.patch('jobs', self.jobs)
+        self.login()
+        self.create_invoice()
+
+    def wait_for_job(self, job_id):
+        deadline = time.monotonic() + 5
+        while True:
+            job = self.client.get(f'/api/jobs/{job_id}').get_json()
+            if job['status'] not in ('queued', 'running'):
+                return job
+            self.assertLess(time.monotonic(), deadline, "job did not finish")
+            time.sleep(0.01)
+
+    def test_export_then_cancel_finished_job(self):
+        response = self.client.post('/api/jobs', json={'type': 'export_invoices', 'params': {}})
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(response.get_json()['id'])
+        self.assertEqual(job['status'], 'done')
+        self.assertNotIn('result_path', job)
+
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result.status_code, 200)
+        self.assertIn(b'Acme s.r.o.', result.data)
+        result.close()
+
+        response = self.client.delete(f"/api/jobs/{job['id']}")
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('done', response.get_json()['error'])
+        self.assertEqual(self.client.get(f"/api/jobs/{job['id']}").get_json()['status'], 'done')
+
+    def test_unknown_type_and_other_companies_job(self):
+        self.assertEqual(self.client.post('/api/jobs', json={'type': 'nope'}).status_code, 400)
+        job = self.jobs.submit(1, 'reports', {}, company_id='acme')
+        self.assertEqual(self.client.get(f"/api/jobs/{job['id']}").status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/jobs/{job['id']}").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
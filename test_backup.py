@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from backup import backup_database, restore_database, restore_target
+from sharding import ShardRouter
+
+
+class RestoreTargetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='backup-')
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.router = ShardRouter(os.path.join(self.work_dir, 'shards'))
+        self.backup_dir = os.path.join(self.work_dir, 'backups')
+
+    def create_shard(self, tenant_id):
+        database = self.router.open_shard(tenant_id)
+        database.create_invoice({'issue_date': '2025-01-10', 'due_date': '2025-01-24', 'total_amount': 1000,
+                                 'customer_name': 'Acme s.r.o.', 'customer_ic': '12345678'})
+        database.close()
+
+    def test_default_databases(self):
+        for name in ('invoices', 'invoices_archive', 'app'):
+            with self.subTest(name=name):
+                self.assertEqual(restore_target(f'backups/{name}-20250101-020000.db', self.router), f'{name}.db')
+
+    def test_shard_and_its_archive(self):
+        self.create_shard('acme')
+        self.assertEqual(restore_target('acme-20250101-020000.db', self.router), self.router.shard_path('acme'))
+        self.assertEqual(restore_target('acme_archive-20250101-020000.db', self.router),
+                         self.router.archive_path('acme'))
+
+    def test_unknown_ambiguous_and_misnamed_backups(self):
+        self.create_shard('invoices')
+        for backup in ('globex-20250101-020000.db', 'invoices-20250101-020000.db', 'acme.db'):
+            with self.subTest(backup=backup):
+                with self.assertRaises(ValueError):
+                    restore_target(backup, self.router)
+
+    def test_shard_backup_restores_into_the_shard(self):
+        self.create_shard('acme')
+        path = self.router.shard_path('acme')
+        backup = backup_database(path, self.backup_dir, pause=0)['backup']
+        database = self.router.open_shard('acme')
+        database.delete_invoice(database.get_all_invoices()[0]['id'])
+        database.close()
+
+        restore_database(backup, restore_target(backup, self.router), pause=0)
+        database = self.router.open_shard('acme')
+        self.addCleanup(database.close)
+        self.assertEqual(len(database.get_all_invoices()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import ChangesCompacted, Database
+
+
+class InvoiceChangesTestCase(unittest.TestCase):
+    def setUp(self):
+        """Create an empty database"""
+        self.work_dir = tempfile.mkdtemp(prefix='changes-')
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def create_invoice(self, issue_date='2025-01-10', customer_ic='12345678', **data):
+        return self.db.create_invoice({'issue_date': issue_date, 'due_date': issue_date, 'total_amount': 1000,
+                                       'customer_name': 'Acme s.r.o.', 'customer_ic': customer_ic, **data})
+
+    def age_change_log(self, days=100):
+        with self.db.get_connection() as conn:
+            conn.execute("UPDATE invoice_changes SET changed_at = datetime('now', ?)", (f'-{days} days',))
+
+    def sync(self, since=0, limit=2, resync=False):
+        """Page through the change log from ``since``; returns (changes, last_seq)"""
+        changes = []
+        while True:
+            page = self.db.get_invoice_changes(since, limit, resync)
+            changes += page['changes']
+            since = page['last_seq']
+            if not page['has_more']:
+                return changes, since
+
+    def test_list_cursor_continues_with_later_changes(self):
+        """A delta sync from the list's last_seq returns exactly the writes made after the list"""
+        first = self.create_invoice()
+        invoices, last_seq = self.db.get_invoices_with_last_seq()
+        self.assertEqual([invoice['id'] for invoice in invoices], [first['id']])
+        self.assertEqual(self.db.get_invoice_changes(last_seq)['changes'], [])
+
+        second = self.create_invoice()
+        self.db.update_invoice(first['id'], {'total_amount': 1500})
+        self.db.delete_invoice(second['id'])
+        changes, _ = self.sync(last_seq)
+        self.assertEqual([(c['invoice_id'], c['operation']) for c in changes],
+                         [(second['id'], 'insert'), (first['id'], 'update'), (second['id'], 'delete')])
+        self.assertEqual(changes[1]['invoice']['total_amount'], 1500)
+        self.assertIsNone(changes[0]['invoice'])  # deleted later on, its tombstone follows
+
+    def test_paging(self):
+        for _ in range(5):
+            self.create_invoice()
+        page = self.db.get_invoice_changes(0, 2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(page['last_seq'], page['changes'][-1]['seq'])
+        changes, last_seq = self.sync(0, 2)
+        self.assertEqual(len(changes), 5)
+        self.assertEqual(self.db.get_invoice_changes(last_seq), {"changes": [], "last_seq": last_seq,
+                                                                 "has_more": False})
+
+    def test_compacted_tombstones_need_a_resync(self):
+        kept = self.create_invoice()
+        deleted = self.create_invoice()
+        _, cursor = self.sync()
+        self.db.update_invoice(kept['id'], {'total_amount': 1100})
+        self.db.delete_invoice(deleted['id'])
+        self.age_change_log()
+        self.assertEqual(self.db.compact_invoice_changes(), 3)
+
+        with self.assertRaises(ChangesCompacted) as raised:
+            self.db.get_invoice_changes(cursor)
+        purged_through = raised.exception.purged_through
+        self.assertGreater(purged_through, cursor)
+
+        # A client starting from scratch may page across the gap
+        changes, last_seq = self.sync(0, 1, resync=True)
+        self.assertEqual([(c['invoice_id'], c['operation']) for c in changes], [(kept['id'], 'update')])
+        self.assertGreaterEqual(last_seq, purged_through)
+        self.assertEqual(self.db.get_invoice_changes(last_seq)['changes'], [])
+
+        # Bootstrapping from the list works the same
+        _, list_seq = self.db.get_invoices_with_last_seq()
+        self.assertGreaterEqual(list_seq, purged_through)
+        self.create_invoice()
+        self.assertEqual(len(self.db.get_invoice_changes(list_seq)['changes']), 1)
+
+    def test_customer_edit_logs_archived_invoices(self):
+        """Archived invoices of an edited customer are reported as changed"""
+        archived = self.create_invoice('2015-01-10', payment_status='zaplaceno', payment_date='2015-01-20')
+        hot = self.create_invoice()
+        self.db.archive_paid_invoices('2020-01-01')
+        _, cursor = self.sync()
+
+        self.db.update_customer('12345678', {'address': 'Brno'})
+        changes, _ = self.sync(cursor)
+        self.assertEqual(sorted(c['invoice_id'] for c in changes), sorted([archived['id'], hot['id']]))
+        self.assertTrue(all(c['invoice']['customer_address'] == 'Brno' for c in changes))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
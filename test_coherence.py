@@ -0,0 +1,96 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+import coherence
+from coherence import generation, generation_path, release
+from database import Database
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_in_other_process(code: str):
+    """Run Python code in a fresh interpreter with the repo importable"""
+    subprocess.run([sys.executable, '-c', f"import sys; sys.path.insert(0, {REPO_DIR!r})\n{textwrap.dedent(code)}"],
+                   check=True)
+
+
+class GenerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='coherence-')
+        self.db_path = os.path.join(self.work_dir, 'invoices.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_counters_are_separate_and_shared(self):
+        invoices, users = generation(self.db_path, 'invoices'), generation(self.db_path, 'users')
+        self.addCleanup(release, invoices, users)
+        self.assertEqual(invoices.bump(), (0, 1))
+        self.assertEqual((invoices.value(), users.value()), (1, 0))
+        self.assertIs(generation(self.db_path, 'invoices').file, invoices.file)
+        release(invoices)  # the extra reference taken just above
+
+    def test_bumps_of_other_processes_are_seen(self):
+        counter = generation(self.db_path, 'invoices')
+        self.addCleanup(release, counter)
+        run_in_other_process(f'''
+            from coherence import generation
+            for _ in range(3):
+                generation({self.db_path!r}, 'invoices').bump()
+        ''')
+        self.assertEqual(counter.value(), 3)
+
+    def test_release_closes_the_file_with_the_last_counter(self):
+        path = os.path.abspath(generation_path(self.db_path))
+        first, second = generation(self.db_path, 'invoices'), generation(self.db_path, 'users')
+        release(first)
+        self.assertIn(path, coherence._files)
+        release(second)
+        self.assertNotIn(path, coherence._files)
+
+
+class CrossProcessCacheTestCase(unittest.TestCase):
+    """A write in another process empties this process's caches of the database"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='coherence-')
+        self.db_path = os.path.join(self.work_dir, 'invoices.db')
+        self.db = Database(self.db_path)
+        self.addCleanup(self.db.close)
+        self.invoice = self.db.create_invoice({'issue_date': '2025-01-10', 'due_date': '2025-01-24',
+                                               'total_amount': 1000, 'customer_name': 'Acme s.r.o.'})
+        self.db.get_invoice_by_id(self.invoice['id'])
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_invoice_update_elsewhere(self):
+        run_in_other_process(f'''
+            from database import Database
+            Database({self.db_path!r}).update_invoice({self.invoice['id']}, {{'total_amount': 2500}})
+        ''')
+        self.assertEqual(self.db.get_invoice_by_id(self.invoice['id'])['total_amount'], 2500)
+        self.assertEqual(self.db.invoice_cache.stats()['remote_clears'], 1)
+
+    def test_user_change_elsewhere(self):
+        user = self.db.create_user('anna', 'secret123', 'accountant')
+        password = self.db.get_user_by_id(user['id'])['password']
+        run_in_other_process(f'''
+            from database import Database
+            Database({self.db_path!r}).update_user_password({user['id']}, 'changed456')
+        ''')
+        self.assertNotEqual(self.db.get_user_by_id(user['id'])['password'], password)
+
+    def test_own_writes_are_not_remote_clears(self):
+        self.db.update_invoice(self.invoice['id'], {'total_amount': 1200})
+        self.db.get_invoice_by_id(self.invoice['id'])
+        self.assertEqual(self.db.invoice_cache.stats()['remote_clears'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import Database
+
+
+class CustomerTestCase(unittest.TestCase):
+    def setUp(self):
+        """Create an empty database"""
+        self.work_dir = tempfile.mkdtemp(prefix='customers-')
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def create_invoice(self, **customer):
+        return self.db.create_invoice({'issue_date': '2025-01-10', 'due_date': '2025-01-24',
+                                       'total_amount': 1000, **customer})
+
+    def test_new_invoice_does_not_rewrite_existing_customer(self):
+        """An existing IČ with a differently spelled name keeps the customer's details"""
+        first = self.create_invoice(customer_name='Alpha s.r.o.', customer_ic='12345678',
+                                    customer_address='Praha 1')
+        second = self.create_invoice(customer_name='ALPHA sro', customer_ic='123 456 78',
+                                     customer_address='Brno')
+
+        self.assertEqual(second['customer_id'], first['customer_id'])
+        for invoice_id in (first['id'], second['id']):
+            invoice = self.db.get_invoice_by_id(invoice_id)
+            self.assertEqual((invoice['customer_name'], invoice['customer_address']), ('Alpha s.r.o.', 'Praha 1'))
+
+    def test_moving_invoice_to_another_ic_keeps_that_customer(self):
+        """Changing an invoice's IČ to another customer's points it there without renaming them"""
+        alpha = self.create_invoice(customer_name='Alpha s.r.o.', customer_ic='12345678')
+        beta = self.create_invoice(customer_name='Beta a.s.', customer_ic='87654321')
+
+        moved = self.db.update_invoice(alpha['id'], {'customer_ic': '87654321'})
+        self.assertEqual(moved['customer_id'], beta['customer_id'])
+        self.assertEqual(moved['customer_name'], 'Beta a.s.')
+        self.assertEqual(self.db.get_invoice_by_id(beta['id'])['customer_name'], 'Beta a.s.')
+        self.assertEqual(self.db.get_customer_by_ic('12345678')['name'], 'Alpha s.r.o.')
+
+    def test_invoice_edit_with_same_ic_edits_customer(self):
+        """New details on an invoice that keeps its IČ show on every invoice of the customer"""
+        first = self.create_invoice(customer_name='Alpha s.r.o.', customer_ic='12345678')
+        second = self.create_invoice(customer_name='Alpha s.r.o.', customer_ic='12345678')
+        self.db.get_invoice_by_id(second['id'])  # cached
+
+        self.db.update_invoice(first['id'], {'customer_address': 'Ostrava'})
+        self.assertEqual(self.db.get_invoice_by_id(second['id'])['customer_address'], 'Ostrava')
+
+    def test_explicit_customer_edit(self):
+        invoice = self.create_invoice(customer_name='Alpha s.r.o.', customer_ic='12345678')
+        self.db.get_invoice_by_id(invoice['id'])  # cached
+
+        customer = self.db.update_customer('12345678', {'name': 'Alpha a.s.', 'dic': 'CZ12345678'})
+        self.assertEqual((customer['name'], customer['dic']), ('Alpha a.s.', 'CZ12345678'))
+        self.assertEqual(self.db.get_invoice_by_id(invoice['id'])['customer_name'], 'Alpha a.s.')
+        self.assertIsNone(self.db.update_customer('99999999', {'name': 'Nobody'}))
+
+    def test_customers_without_ic_are_told_apart_by_their_details(self):
+        """Same name, other address: a separate customer, and the invoice shows its own address"""
+        prague = self.create_invoice(customer_name='Jan Novák', customer_address='Praha')
+        brno = self.create_invoice(customer_name='Jan Novák', customer_address='Brno')
+        again = self.create_invoice(customer_name='Jan Novák', customer_address='Praha')
+
+        self.assertNotEqual(prague['customer_id'], brno['customer_id'])
+        self.assertEqual(again['customer_id'], prague['customer_id'])
+        self.assertEqual(brno['customer_address'], 'Brno')
+
+    def test_new_address_on_invoice_without_ic(self):
+        """A changed address is saved without changing the invoices of the old details"""
+        first = self.create_invoice(customer_name='Jan Novák', customer_address='Praha')
+        second = self.create_invoice(customer_name='Jan Novák', customer_address='Praha')
+
+        updated = self.db.update_invoice(first['id'], {'customer_address': 'Plzeň'})
+        self.assertEqual(updated['customer_address'], 'Plzeň')
+        self.assertEqual(self.db.get_invoice_by_id(first['id'])['customer_address'], 'Plzeň')
+        self.assertEqual(self.db.get_invoice_by_id(second['id'])['customer_address'], 'Praha')
+        self.assertEqual(self.create_invoice(customer_name='Jan Novák', customer_address='Plzeň')['customer_id'],
+                         updated['customer_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
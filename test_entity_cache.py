@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import Database
+from entity_cache import EntityCache
+
+
+class EntityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = EntityCache(max_entries=2, key='id', alt_key='number')
+        self.loads = 0
+
+    def loader(self, entity):
+        def load():
+            self.loads += 1
+            return dict(entity) if entity else None
+        return load
+
+    def test_hit_by_either_key(self):
+        entity = {'id': 1, 'number': 'F1'}
+        self.assertEqual(self.cache.get_or_load('id', 1, self.loader(entity)), entity)
+        self.assertEqual(self.cache.get_or_load('number', 'F1', self.loader(None)), entity)
+        self.assertEqual(self.loads, 1)
+
+    def test_returned_entities_are_copies(self):
+        self.cache.get_or_load('id', 1, self.loader({'id': 1, 'number': 'F1'}))['number'] = 'changed'
+        self.assertEqual(self.cache.get_or_load('id', 1, self.loader(None))['number'], 'F1')
+
+    def test_missing_entities_are_not_cached(self):
+        self.assertIsNone(self.cache.get_or_load('id', 1, self.loader(None)))
+        self.assertIsNone(self.cache.get_or_load('id', 1, self.loader(None)))
+        self.assertEqual(self.loads, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        for n in (1, 2):
+            self.cache.get_or_load('id', n, self.loader({'id': n, 'number': f'F{n}'}))
+        self.cache.get_or_load('id', 1, self.loader(None))  # 2 is now the oldest
+        self.cache.get_or_load('id', 3, self.loader({'id': 3, 'number': 'F3'}))
+
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.cache.get_or_load('number', 'F2', self.loader({'id': 2, 'number': 'F2'}))
+        self.assertEqual(self.loads, 4)
+
+    def test_invalidate_drops_both_keys(self):
+        self.cache.get_or_load('id', 1, self.loader({'id': 1, 'number': 'F1'}))
+        self.cache.invalidate([1])
+        self.cache.get_or_load('number', 'F1', self.loader({'id': 1, 'number': 'F1'}))
+        self.assertEqual(self.loads, 2)
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        """An entity loaded while a write invalidated it may be stale, so it isn't kept"""
+        def load():
+            self.cache.invalidate([1])  # a writer commits while the load runs
+            return {'id': 1, 'number': 'F1'}
+
+        self.cache.get_or_load('id', 1, load)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class InvoiceCacheTestCase(unittest.TestCase):
+    """The invoice cache of a Database never serves an invoice older than the last write"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='entity-cache-')
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+        self.invoice = self.db.create_invoice({'issue_date': '2025-01-10', 'due_date': '2025-01-24',
+                                               'total_amount': 1000, 'customer_name': 'Acme s.r.o.',
+                                               'customer_ic': '12345678'})
+        self.db.get_invoice_by_id(self.invoice['id'])
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_cached_after_first_read(self):
+        self.db.get_invoice_by_number(self.invoice['invoice_number'])
+        self.assertEqual(self.db.invoice_cache.stats()['hits'], 1)
+
+    def test_update_invalidates(self):
+        self.db.update_invoice(self.invoice['id'], {'total_amount': 2000})
+        self.assertEqual(self.db.get_invoice_by_id(self.invoice['id'])['total_amount'], 2000)
+        self.assertEqual(self.db.get_invoice_by_number(self.invoice['invoice_number'])['total_amount'], 2000)
+
+    def test_renumbering_invalidates_the_old_number(self):
+        self.db.update_invoice(self.invoice['id'], {'invoice_number': 'F2025100'})
+        self.assertIsNone(self.db.get_invoice_by_number(self.invoice['invoice_number']))
+        self.assertEqual(self.db.get_invoice_by_number('F2025100')['id'], self.invoice['id'])
+
+    def test_delete_invalidates(self):
+        self.assertTrue(self.db.delete_invoice(self.invoice['id']))
+        self.assertIsNone(self.db.get_invoice_by_id(self.invoice['id']))
+        self.assertIsNone(self.db.get_invoice_by_number(self.invoice['invoice_number']))
+
+    def test_new_customer_keeps_the_cache(self):
+        self.db.create_invoice({'issue_date': '2025-01-11', 'due_date': '2025-01-25', 'total_amount': 500,
+                                'customer_name': 'Nova s.r.o.', 'customer_ic': '87654321'})
+        self.assertEqual(self.db.invoice_cache.stats()['entries'], 1)
+
+    def test_customer_edit_clears_the_customers_invoices(self):
+        self.db.update_customer('12345678', {'name': 'Acme a.s.'})
+        self.assertEqual(self.db.get_invoice_by_id(self.invoice['id'])['customer_name'], 'Acme a.s.')
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
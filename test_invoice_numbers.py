@@ -0,0 +1,51 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from database import Database
+
+
+class InvoiceNumberTestCase(unittest.TestCase):
+    def setUp(self):
+        """Create an empty database"""
+        self.work_dir = tempfile.mkdtemp(prefix='invoice-numbers-')
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def create_invoice(self, issue_date='2025-01-10', **data):
+        return self.db.create_invoice({'issue_date': issue_date, 'due_date': issue_date, 'total_amount': 1000,
+                                       'customer_name': 'Acme s.r.o.', 'customer_ic': '12345678', **data})
+
+    def test_allocation_continues_after_a_chosen_number(self):
+        self.assertEqual(self.create_invoice()['invoice_number'], 'F2025001')
+        self.create_invoice(invoice_number='F2025010')
+        self.assertEqual(self.create_invoice()['invoice_number'], 'F2025011')
+
+    def test_allocation_after_renumbering(self):
+        """A number given to an existing invoice is never allocated again"""
+        invoice = self.create_invoice()
+        self.db.update_invoice(invoice['id'], {'invoice_number': 'F2025002'})
+        self.assertEqual(self.create_invoice()['invoice_number'], 'F2025003')
+
+        self.db.update_invoice(invoice['id'], {'invoice_number': 'F2025020'})
+        self.assertEqual(self.create_invoice()['invoice_number'], 'F2025021')
+
+    def test_renumbering_to_an_archived_number(self):
+        archived = self.create_invoice('2015-03-01', payment_status='zaplaceno', payment_date='2015-03-05')
+        self.assertEqual(self.db.archive_paid_invoices('2020-01-01'), 1)
+        invoice = self.create_invoice()
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.update_invoice(invoice['id'], {'invoice_number': archived['invoice_number']})
+        # An archived invoice may keep its own number while it's edited
+        updated = self.db.update_invoice(archived['id'], {'invoice_number': archived['invoice_number'],
+                                                          'total_amount': 1200})
+        self.assertEqual((updated['invoice_number'], updated['total_amount']), (archived['invoice_number'], 1200))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
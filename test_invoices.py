@@ -7,6 +7,7 @@ Run this script to test all API endpoints
 import requests
 import json
 import sys
+import time
 from typing import Dict, Any
 
 
@@ -134,6 +135,31 @@ class InvoiceAPITester:
         response = self.session.get(f"{self.base_url}/api/reports/overdue")
         return self.print_response(response, "Get overdue invoices")
 
+    # === JOB TESTS ===
+    def submit_job(self, job_type, params=None):
+        """Submit a background job"""
+        print(f"⚙️ Submitting job {job_type}...")
+        response = self.session.post(f"{self.base_url}/api/jobs", json={"type": job_type, "params": params or {}})
+        return self.print_response(response, f"Submit job {job_type}")
+
+    def wait_for_job(self, job_id, timeout=30):
+        """Poll a job until it finishes"""
+        print(f"⏳ Waiting for job {job_id}...")
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = self.session.get(f"{self.base_url}/api/jobs/{job_id}")
+            if response.status_code != 200 or response.json()['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+        return self.print_response(response, f"Job {job_id} status")
+
+    def get_job_result(self, job_id):
+        """Download the result of a finished job"""
+        print(f"📥 Downloading result of job {job_id}...")
+        response = self.session.get(f"{self.base_url}/api/jobs/{job_id}/result")
+        print(f"Status: {response.status_code}, {len(response.content)} bytes ({response.headers.get('Content-Type')})")
+        return response
+
     def run_comprehensive_test(self):
         """Run comprehensive test suite"""
         print("🚀 Starting Comprehensive Invoice API Tests")
@@ -191,6 +217,16 @@ class InvoiceAPITester:
             # Delete the invoice (owner only)
             self.delete_invoice(invoice_id)
 
+        # Run a heavy export as a background job
+        job = self.submit_job("export_invoices", {"since": "2025-01-01"})
+        if job.status_code == 202:
+            finished = self.wait_for_job(job.json()['id'])
+            if finished.status_code == 200 and finished.json()['status'] == 'done':
+                print("✅ Background export finished")
+                self.get_job_result(job.json()['id'])
+            else:
+                print("❌ Background export did not finish")
+
         # Test automatic due date calculation (14 days after issue date)
         print("\n" + "=" * 80)
         print("📅 TESTING AUTOMATIC DUE DATE CALCULATION")
@@ -1,5 +1,7 @@
 import unittest
 import json
+import os
+from unittest import mock
 from app_api import app, db, ItemModel
 
 class ItemsAPITestCase(unittest.TestCase):
@@ -38,6 +40,19 @@ class ItemsAPITestCase(unittest.TestCase):
             self.assertEqual(len(data), 1)
             self.assertEqual(data[0]['title'], 'Test Item')
 
+    def test_get_items_page(self):
+        """Test GET /items endpoint with ?limit=&offset= and X-Total-Count"""
+        with app.app_context():
+            for i in range(4):
+                db.session.add(ItemModel(title=f"Paged Item {i}"))
+            db.session.commit()
+
+            response = self.app.get('/items?limit=2&offset=1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['X-Total-Count'], '5')
+            data = json.loads(response.data)
+            self.assertEqual(len(data), 2)
+
     def test_get_item_by_id(self):
         """Test GET /items/{id} endpoint"""
         with app.app_context():
@@ -131,5 +146,23 @@ class ItemsAPITestCase(unittest.TestCase):
             response = self.app.delete('/items/999')
             self.assertEqual(response.status_code, 404)
 
+    def test_profile_request(self):
+        """Test that X-Profile returns the profile of the request"""
+        with mock.patch.dict(os.environ, {'ITEMS_PROFILE_TOKEN': 'secret'}):
+            response = self.app.get('/items', headers={'X-Profile': 'text', 'X-Profile-Token': 'secret'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['X-Profiled-Status'], '200')
+            self.assertIn('attachment', response.headers['Content-Disposition'])
+            self.assertIn(b'cumtime', response.data)
+
+            response = self.app.get('/items', headers={'X-Profile': 'text', 'X-Profile-Token': 'wrong'})
+            self.assertEqual(response.status_code, 403)
+
+    def test_profile_disabled_without_token(self):
+        """Test that profiling is refused when no token is configured"""
+        with mock.patch.dict(os.environ, {}, clear=True):
+            response = self.app.get('/items', headers={'X-Profile': 'text'})
+            self.assertEqual(response.status_code, 403)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
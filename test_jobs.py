@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import jobs
+from database import Database
+from jobs import JobRunner
+
+
+class JobRunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='jobs-')
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.db = Database(os.path.join(self.work_dir, 'invoices.db'))
+        self.user_id = self.db.create_user('owner', 'owner123', 'owner')['id']
+        self.runner = JobRunner(self.db, os.path.join(self.work_dir, 'results'), workers=1)
+        self.addCleanup(self.runner.shutdown)
+
+        # 'wait' jobs report progress once, then block until released
+        self.started, self.release = threading.Event(), threading.Event()
+        patcher = mock.patch.dict(jobs.JOB_TYPES, {'wait': (self.wait_job, 'txt', 'text/plain')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+
+    def wait_job(self, ctx):
+        ctx.progress(1, 2)
+        self.started.set()
+        self.assertTrue(self.release.wait(5))
+        with open(ctx.result_path, 'w') as f:
+            f.write('done')
+
+    def submit(self, job_type='wait', company_id=None):
+        return self.runner.submit(self.user_id, job_type, {}, company_id=company_id)
+
+    def wait_for(self, job, status):
+        deadline = time.monotonic() + 5
+        while self.runner.get(job['id'], job['company_id'])['status'] != status:
+            self.assertLess(time.monotonic(), deadline, f"job did not become {status}")
+            time.sleep(0.01)
+
+    def test_finished_job_cannot_be_cancelled(self):
+        job = self.submit('export_invoices')
+        self.wait_for(job, 'done')
+        self.assertFalse(self.runner.cancel(job['id'], None))
+        finished = self.runner.get(job['id'], None)
+        self.assertEqual(finished['status'], 'done')
+        self.assertIsNotNone(self.runner.result_file(finished))
+
+    def test_cancel_queued_job(self):
+        running, queued = self.submit(), self.submit()
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(self.runner.cancel(queued['id'], None))
+        self.assertEqual(self.runner.get(queued['id'], None)['status'], 'cancelled')
+        self.assertFalse(self.runner.cancel(queued['id'], None))
+        self.release.set()
+        self.wait_for(running, 'done')
+
+    def test_cancel_after_last_progress_report(self):
+        job = self.submit()
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(self.runner.cancel(job['id'], None))
+        self.release.set()
+        self.wait_for(job, 'cancelled')
+        self.assertIsNone(self.runner.result_file(self.runner.get(job['id'], None)))
+        self.assertFalse(os.path.exists(os.path.join(self.runner.result_dir, f"job-{job['id']}.txt")))
+
+    def test_jobs_of_other_companies_are_not_found(self):
+        job = self.submit(company_id='acme')
+        self.assertIsNone(self.runner.get(job['id'], 'globex'))
+        self.assertIsNone(self.runner.get(job['id'], None))
+        self.assertFalse(self.runner.cancel(job['id'], 'globex'))
+        self.assertIn(self.runner.get(job['id'], 'acme')['status'], ('queued', 'running'))
+        self.assertTrue(self.runner.cancel(job['id'], 'acme'))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+import time
+import unittest
+from unittest import mock
+
+import passwords
+from passwords import VerificationBusy, VerificationPool, hash_password, verify_password
+
+
+class PasswordHashTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        stored = hash_password('tajne heslo')
+        self.assertEqual(stored.split('$')[0], passwords.KDF)
+        self.assertEqual(verify_password('tajne heslo', stored), (True, False))
+        self.assertEqual(verify_password('jine heslo', stored), (False, False))
+
+    def test_salted(self):
+        self.assertNotEqual(hash_password('heslo'), hash_password('heslo'))
+
+    def test_legacy_sha256_needs_rehash(self):
+        legacy = hashlib.sha256('heslo'.encode()).hexdigest()
+        self.assertEqual(verify_password('heslo', legacy), (True, True))
+        self.assertEqual(verify_password('jine', legacy)[0], False)
+
+    def test_outdated_parameters_need_rehash(self):
+        with mock.patch.dict(passwords.SCRYPT_PARAMS, n=2 ** 10), mock.patch.object(passwords, 'PBKDF2_ITERATIONS', 1000):
+            weaker = hash_password('heslo')
+        self.assertEqual(verify_password('heslo', weaker), (True, True))
+
+    def test_other_kdf_needs_rehash(self):
+        salt = b'0123456789abcdef'
+        other = 'scrypt' if passwords.KDF == 'pbkdf2_sha256' else 'pbkdf2_sha256'
+        params = (2 ** 10, 8, 1) if other == 'scrypt' else (1000,)
+        digest = passwords._derive(other, params, 'heslo', salt)
+        stored = f"{other}${','.join(map(str, params))}${salt.hex()}${digest.hex()}"
+        self.assertEqual(verify_password('heslo', stored), (True, True))
+
+    def test_malformed_hash_never_matches(self):
+        for stored in ('scrypt$x$zz$00', 'scrypt$16384,8,1$abc', 'md5$1$00$00'):
+            with self.subTest(stored=stored):
+                self.assertEqual(verify_password('heslo', stored), (False, False))
+
+
+class VerificationPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = VerificationPool(workers=1, max_queue=1, timeout=5.0)
+        self.addCleanup(self.pool._executor.shutdown)
+
+    def test_match_and_mismatch(self):
+        stored = hash_password('heslo')
+        self.assertEqual(self.pool.check('heslo', stored), (True, None))
+        self.assertEqual(self.pool.check('jine', stored), (False, None))
+        self.assertEqual(self.pool.stats()['verified'], 2)
+
+    def test_legacy_match_returns_new_hash(self):
+        matches, new_hash = self.pool.check('heslo', hashlib.sha256(b'heslo').hexdigest())
+        self.assertTrue(matches)
+        self.assertEqual(verify_password('heslo', new_hash), (True, False))
+
+    def test_unknown_user_never_matches(self):
+        self.assertEqual(self.pool.check('heslo', None), (False, None))
+
+    def test_full_queue_is_turned_away(self):
+        release, started = threading.Event(), threading.Event()
+
+        def blocking_verify(password, stored):
+            started.set()
+            release.wait(5)
+            return True, False
+
+        with mock.patch.object(passwords, 'verify_password', blocking_verify):
+            waiting = [threading.Thread(target=self.pool.check, args=('heslo', 'legacy')) for _ in range(2)]
+            waiting[0].start()
+            started.wait(5)
+            waiting[1].start()  # queued behind the first
+            deadline = time.monotonic() + 5
+            while self.pool.stats()['in_flight'] < 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            with self.assertRaises(VerificationBusy):
+                self.pool.check('heslo', 'legacy')
+            release.set()
+            for thread in waiting:
+                thread.join(5)
+        self.assertEqual(self.pool.stats()['rejected_busy'], 1)
+        self.assertEqual(self.pool.stats()['in_flight'], 0)
+
+    def test_timeout(self):
+        self.pool.timeout = 0.05
+        release = threading.Event()
+        with mock.patch.object(passwords, 'verify_password', lambda password, stored: release.wait(5) and (True, False)):
+            with self.assertRaises(VerificationBusy):
+                self.pool.check('heslo', 'legacy')
+            release.set()
+        self.assertEqual(self.pool.stats()['timed_out'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,167 @@
+import csv
+import unittest
+from decimal import Decimal, InvalidOperation
+
+from reconciliation import StatementLine, parse_amount, parse_gpc, parse_statement, reconcile
+
+# ABO/GPC '075' record fields in order, with their widths (1-based columns in comments)
+GPC_FIELDS = [
+    ('type', 3),             # 1-3
+    ('account', 16),         # 4-19
+    ('counter_account', 16), # 20-35
+    ('record_id', 13),       # 36-48
+    ('amount', 12),          # 49-60, in hellers
+    ('code', 1),             # 61: 1 debit, 2 credit, 4/5 reversals
+    ('variable_symbol', 10), # 62-71
+    ('constant_symbol', 10), # 72-81
+    ('specific_symbol', 10), # 82-91
+    ('value_date', 6),       # 92-97, DDMMYY
+    ('counterparty', 20),    # 98-117
+    ('zero', 1),             # 118
+    ('currency', 4),         # 119-122
+    ('due_date', 6),         # 123-128, DDMMYY
+]
+
+
+def gpc_record(**values):
+    """A 128 column '075' record; numbers are zero-padded, texts space-padded"""
+    defaults = {'type': '075', 'account': '123456789', 'counter_account': '987654321',
+                'record_id': '1', 'amount': '0', 'code': '2', 'variable_symbol': '',
+                'constant_symbol': '308', 'specific_symbol': '0', 'value_date': '150125',
+                'counterparty': 'Odberatel s.r.o.', 'zero': '0', 'currency': '0203', 'due_date': '150125'}
+    defaults.update(values)
+    record = ''
+    for name, width in GPC_FIELDS:
+        value = str(defaults[name])
+        record += value.ljust(width) if name == 'counterparty' else value.rjust(width, '0')
+    assert len(record) == 128
+    return record
+
+
+class ParseAmountTestCase(unittest.TestCase):
+    def test_formats(self):
+        """Czech and plain amount notations"""
+        cases = [
+            ('1234.50', Decimal('1234.50')),
+            ('1 234,50', Decimal('1234.50')),
+            ('1 234,50', Decimal('1234.50')),  # non-breaking space as thousands separator
+            ('1.234,50', Decimal('1234.50')),
+            ('12,5', Decimal('12.5')),
+            ('-500', Decimal('-500')),
+            (' 42 ', Decimal('42')),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(parse_amount(value), expected)
+
+    def test_invalid(self):
+        for value in ['', 'abc', '12,5,0', 'NaN', 'sNaN', 'Infinity', '-inf']:
+            with self.subTest(value=value), self.assertRaises(InvalidOperation):
+                parse_amount(value)
+
+
+class ParseCsvTestCase(unittest.TestCase):
+    def test_non_finite_amounts_are_skipped(self):
+        lines = ['VS;Částka', '2025001;NaN', '2025002;Infinity', '2025003;1 210,00']
+        self.assertEqual([(line.variable_symbol, line.amount) for line in parse_statement(lines)],
+                         [('2025003', Decimal('1210.00'))])
+
+    def test_malformed_csv_is_invalid(self):
+        lines = ['VS;Částka', '2025001;"' + 'x' * (csv.field_size_limit() + 1) + '"']
+        with self.assertRaises(ValueError):
+            list(parse_statement(lines))
+
+
+class ParseGpcTestCase(unittest.TestCase):
+    def test_credit_record(self):
+        """A '075' credit record yields its variable symbol, amount, date and counterparty"""
+        lines = ['0741234567890123456Firma s.r.o.', gpc_record(amount='1210050', variable_symbol='2025001',
+                                                                due_date='310125', value_date='300125')]
+        self.assertEqual(list(parse_statement(lines)), [
+            StatementLine(2, '2025001', Decimal('12100.50'), '2025-01-31', 'Odberatel s.r.o.')
+        ])
+
+    def test_records(self):
+        """Which records count as incoming payments, and what they parse to"""
+        cases = [
+            ('credit', gpc_record(amount='100', variable_symbol='0000000042'),
+             [('42', Decimal('1.00'), '2025-01-15')]),
+            ('debit', gpc_record(code='1', amount='100', variable_symbol='42'), []),
+            ('credit reversal', gpc_record(code='5', amount='100', variable_symbol='42'), []),
+            ('due date missing, value date used', gpc_record(amount='100', due_date='      ', value_date='020225'),
+             [('', Decimal('1.00'), '2025-02-02')]),
+            ('invalid dates', gpc_record(amount='100', due_date='999999', value_date='000000'),
+             [('', Decimal('1.00'), None)]),
+            ('other record type', '076' + gpc_record()[3:], []),
+            ('empty line', '', []),
+            ('truncated', gpc_record(amount='100')[:55], []),
+            ('garbled amount', gpc_record()[:48] + '12x4' + gpc_record()[52:], []),
+        ]
+        for name, record, expected in cases:
+            with self.subTest(name):
+                parsed = [(line.variable_symbol, line.amount, line.date) for line in parse_gpc([record])]
+                self.assertEqual(parsed, expected)
+
+
+class FakeDatabase:
+    """The two Database methods reconcile() uses"""
+
+    def __init__(self, invoices):
+        self.invoices = invoices
+        self.paid = []
+
+    def get_unpaid_invoice_amounts(self):
+        return [dict(invoice) for invoice in self.invoices]
+
+    def mark_invoices_paid(self, payments, batch_size=1000):
+        self.paid.extend(payments)
+        return len(payments)
+
+
+class ReconcileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = FakeDatabase([
+            {'id': 1, 'invoice_number': 'F2025001', 'total_amount': 1210.0},
+            {'id': 2, 'invoice_number': 'F2025002', 'total_amount': 500.0},
+            {'id': 3, 'invoice_number': 'X-2025003', 'total_amount': 300.0},
+            {'id': 4, 'invoice_number': 'Y2025003', 'total_amount': 300.0},
+        ])
+
+    def payment(self, line, symbol, amount, date='2025-02-01'):
+        return StatementLine(line, symbol, Decimal(amount), date)
+
+    def test_outcomes(self):
+        """Exact matches are paid; everything else is reported with a reason"""
+        result = reconcile(self.database, [
+            self.payment(1, '2025001', '1210.00'),           # matched
+            self.payment(2, '2025002', '250.00'),            # partial payment
+            self.payment(3, '9999999', '100.00'),            # unknown symbol
+            self.payment(4, '2025003', '300.00'),            # two invoices share symbol and amount
+            self.payment(5, '2025001', '1210.00'),           # invoice paid by line 1 already
+            self.payment(6, '2025002', '500.00', date=None),  # no payment date
+            self.payment(7, '', '500.00'),                   # no symbol
+        ])
+
+        self.assertEqual(result['payments'], 7)
+        self.assertEqual([(match['line'], match['invoice_id']) for match in result['matches']], [(1, 1)])
+        self.assertEqual(self.database.paid, [(1, '2025-02-01')])
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual({item['line']: item['reason'] for item in result['unmatched']}, {
+            2: "Amount differs from the invoice",
+            3: "No unpaid invoice with this variable symbol",
+            5: "Invoice already paid by an earlier line",
+            6: "Missing or invalid payment date",
+            7: "No unpaid invoice with this variable symbol",
+        })
+        self.assertEqual(result['unmatched'][0]['invoice_amounts'], ['500.00'])
+        self.assertEqual([(item['line'], item['invoice_numbers']) for item in result['ambiguous']],
+                         [(4, ['X-2025003', 'Y2025003'])])
+
+    def test_dry_run(self):
+        """A dry run reports matches without marking anything paid"""
+        result = reconcile(self.database, [self.payment(1, '2025001', '1210.00')], dry_run=True)
+        self.assertEqual((result['matched'], result['updated'], self.database.paid), (1, 0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from database import Database
+from reporting import ReportSnapshot
+
+
+class ReportSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        """Create a database with three paid invoices, two of them old enough to archive"""
+        self.work_dir = tempfile.mkdtemp(prefix='report-snapshot-')
+        self.database = Database(os.path.join(self.work_dir, 'invoices.db'))
+        for issue_date in ('2014-01-10', '2016-01-10', '2025-01-10'):
+            self.database.create_invoice({
+                'issue_date': issue_date,
+                'due_date': issue_date,
+                'customer_name': 'Acme s.r.o.',
+                'customer_ic': '12345678',
+                'total_amount': 1000,
+                'payment_status': 'zaplaceno',
+                'payment_date': '2025-02-10'
+            })
+        self.snapshot = ReportSnapshot(self.database, os.path.join(self.work_dir, 'snapshots', 'invoices.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_archiving_after_a_copy_keeps_the_snapshot_consistent(self):
+        """Invoices archived after the copy are neither lost nor counted twice in the snapshot"""
+        self.assertEqual(self.database.archive_paid_invoices('2015-01-01'), 1)
+        self.snapshot.refresh()
+        expected = self.snapshot.snapshot.get_average_payment_time()
+
+        self.assertEqual(self.database.archive_paid_invoices('2020-01-01'), 1)
+        self.assertEqual(self.snapshot.snapshot.get_average_payment_time(), expected)
+
+    def test_snapshot_includes_the_archive(self):
+        """A copy made after archiving reads the archived invoices from its own archive copy"""
+        self.database.archive_paid_invoices('2020-01-01')
+        self.snapshot.refresh()
+
+        self.assertEqual(self.snapshot.snapshot.get_archive_status()['archived_invoices'], 2)
+        self.assertEqual(self.snapshot.stats()['archive_snapshot'], self.snapshot.snapshot.archive_path)
+        self.assertEqual(self.snapshot.snapshot.get_average_payment_time(),
+                         self.database.get_average_payment_time())
+
+    def test_unchanged_databases_are_not_copied_again(self):
+        """A refresh without writes to the hot database or the archive is skipped"""
+        self.database.archive_paid_invoices('2020-01-01')
+        self.snapshot.refresh()
+        self.snapshot.refresh()
+        self.assertEqual(self.snapshot.stats()['copies'], 1)
+        self.assertEqual(self.snapshot.stats()['unchanged_skips'], 1)
+
+
+    def snapshot_files(self):
+        return sorted(os.listdir(os.path.dirname(self.snapshot.path)))
+
+    def test_replaced_generation_is_deleted_once_readers_drop_it(self):
+        """A new copy gets new files; the previous ones stay while a report reads them"""
+        self.database.archive_paid_invoices('2015-01-01')
+        self.snapshot.refresh()
+        reader = self.snapshot.snapshot
+        self.database.archive_paid_invoices('2020-01-01')
+        self.snapshot.refresh()
+
+        self.assertEqual(self.snapshot.stats()['generation'], 2)
+        self.assertTrue(os.path.exists(reader.db_path))
+        self.assertEqual(reader.get_archive_status()['archived_invoices'], 1)
+        self.assertEqual(self.snapshot.snapshot.get_archive_status()['archived_invoices'], 2)
+
+        del reader
+        self.assertEqual([name for name in self.snapshot_files() if name.endswith('.db')],
+                         ['invoices.2.db', 'invoices.2_archive.db'])
+
+    def test_files_still_open_are_removed_on_the_next_refresh(self):
+        """A file Windows won't delete yet (PermissionError) is retried later"""
+        self.snapshot.refresh()
+        self.database.archive_paid_invoices('2015-01-01')
+        with mock.patch('reporting.os.remove', side_effect=PermissionError):
+            self.snapshot.refresh()
+        self.assertGreater(self.snapshot.stats()['retired_files_pending'], 0)
+        self.assertIn('invoices.1.db', self.snapshot_files())
+
+        self.database.archive_paid_invoices('2020-01-01')
+        self.snapshot.refresh()
+        self.assertEqual(self.snapshot.stats()['retired_files_pending'], 0)
+        self.assertEqual([name for name in self.snapshot_files() if name.endswith('.db')],
+                         ['invoices.3.db', 'invoices.3_archive.db'])
+
+    def test_files_left_by_a_previous_run_are_removed(self):
+        """Generations of an earlier process are deleted and not reused"""
+        self.snapshot.refresh()
+        self.snapshot = ReportSnapshot(self.database, self.snapshot.path)
+        self.database.create_invoice({'issue_date': '2025-03-10', 'due_date': '2025-03-24', 'total_amount': 500,
+                                      'customer_name': 'Acme s.r.o.', 'customer_ic': '12345678'})
+        self.snapshot.refresh()
+        self.assertEqual([name for name in self.snapshot_files() if name.endswith('.db')], ['invoices.2.db'])
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
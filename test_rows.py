@@ -0,0 +1,81 @@
+import datetime
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import jsonify
+
+import rows
+from rows import Rows
+
+COLUMNS = ('id', 'invoice_number', 'customer_name', 'total_amount', 'issue_date', 'paid_at', 'note')
+
+ROWS = [
+    (1, '2025001', 'Žluťoučký kůň s.r.o.', 1210.5, '2025-01-10', None, None),
+    (2, '2025002', 'Müller & Söhne GmbH "Nord"', 0.1 + 0.2, datetime.date(2025, 1, 11),
+     datetime.datetime(2025, 2, 1, 8, 30, 15), 'řádek\nnový\ttab  '),
+    (3, None, '日本語 \U0001F600', 1e21, None, datetime.date(2024, 12, 31), ''),
+    (4, '2025004', 'Acme', -0.0, '2025-01-12', None, '\\ / \x00'),
+]
+
+
+class StreamedJSONTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Import the app in a scratch directory, it creates its database on import"""
+        cls.work_dir = tempfile.mkdtemp(prefix='rows-')
+        cwd = os.getcwd()
+        os.chdir(cls.work_dir)
+        try:
+            cls.app = importlib.import_module('app')
+        finally:
+            os.chdir(cwd)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def assert_same_bytes(self, body_of):
+        """json_response() of a body with Rows gives the bytes jsonify() gives with dicts"""
+        with self.app.app.test_request_context():
+            streamed = self.app.json_response(body_of(Rows(COLUMNS, list(ROWS)))).get_data()
+            expected = jsonify(body_of([dict(zip(COLUMNS, row)) for row in ROWS])).get_data()
+        self.assertEqual(streamed, expected)
+
+    def test_rows_only(self):
+        self.assert_same_bytes(lambda invoices: {"invoices": invoices})
+
+    def test_rows_among_other_values(self):
+        self.assert_same_bytes(lambda invoices: {
+            "total": 4, "last_seq": None, "invoices": invoices, "as_of": datetime.date(2025, 3, 1),
+            "filters": {"customer": "Žluťoučký", "status": ["zaplaceno", "nezaplaceno"]}
+        })
+
+    def test_empty_rows(self):
+        with self.app.app.test_request_context():
+            streamed = self.app.json_response({"invoices": Rows(COLUMNS, [])}).get_data()
+            expected = jsonify({"invoices": []}).get_data()
+        self.assertEqual(streamed, expected)
+
+    def test_chunk_boundaries(self):
+        """Chunks of any size join into the same text as one encoding"""
+        data = ROWS * 7
+        expected = self.app.compact_dumps([dict(zip(COLUMNS, row)) for row in data])
+        for chunk_rows in (1, 2, 3, len(data) - 1, len(data), len(data) + 1):
+            with self.subTest(chunk_rows=chunk_rows), self.app.app.test_request_context():
+                streamed = ''.join(Rows(COLUMNS, data).iter_json(self.app.compact_dumps, chunk_rows))
+                self.assertEqual(streamed, expected)
+
+    def test_default_chunk_size(self):
+        data = [(n, f"{n:07d}", 'Ž' * (n % 5), n / 3, None, None, None)
+                for n in range(rows.JSON_CHUNK_ROWS * 2 + 1)]
+        with self.app.app.test_request_context():
+            streamed = self.app.json_response({"invoices": Rows(COLUMNS, data)}).get_data()
+            expected = jsonify({"invoices": [dict(zip(COLUMNS, row)) for row in data]}).get_data()
+        self.assertEqual(streamed, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import coherence
+from coherence import generation_path
+from sharding import ShardRouter
+
+
+class ShardRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        """Create an empty shard directory"""
+        self.shard_dir = tempfile.mkdtemp(prefix='shards-')
+        self.router = ShardRouter(self.shard_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+
+    def create_paid_invoice(self, database, issue_date='2015-01-10'):
+        return database.create_invoice({
+            'issue_date': issue_date,
+            'due_date': issue_date,
+            'customer_name': 'Acme s.r.o.',
+            'customer_ic': '12345678',
+            'total_amount': 1000,
+            'payment_status': 'zaplaceno',
+            'payment_date': issue_date
+        })
+
+    def test_archived_shard_is_not_a_tenant(self):
+        """Archiving a shard doesn't add its archive to the tenants"""
+        shard = self.router.get('acme')
+        self.create_paid_invoice(shard)
+        self.assertEqual(shard.archive_paid_invoices('2020-01-01'), 1)
+
+        self.assertEqual(self.router.tenants(), ['acme'])
+        self.assertTrue(os.path.exists(self.router.archive_path('acme')))
+        self.assertEqual(self.router.database_paths(),
+                         [self.router.shard_path('acme'), self.router.archive_path('acme')])
+
+    def test_legacy_archive_is_moved(self):
+        """An archive of the old layout (<tenant>_archive.db) is skipped and moved on open"""
+        shard = self.router.open_shard('acme')
+        self.create_paid_invoice(shard)
+        shard.archive_paid_invoices('2020-01-01')
+        legacy = os.path.join(self.shard_dir, 'acme_archive.db')
+        os.replace(self.router.archive_path('acme'), legacy)
+
+        self.assertEqual(self.router.tenants(), ['acme'])
+        shard = self.router.open_shard('acme')
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(shard.get_archive_status()['archived_invoices'], 1)
+
+    def test_evicted_shard_closes_generation_file(self):
+        """A shard dropped from the LRU unmaps its generation file"""
+        router = ShardRouter(self.shard_dir, max_open=1)
+        path = os.path.abspath(generation_path(router.shard_path('acme')))
+        router.get('acme')
+        self.assertIn(path, coherence._files)
+
+        router.get('globex')
+        self.assertNotIn(path, coherence._files)
+        self.assertEqual(router.open_tenants(), ['globex'])
+
+    def test_shared_generation_file_outlives_one_database(self):
+        """Closing one Database keeps the file mapped for another one of the same shard"""
+        shard = self.router.open_shard('acme')
+        self.router.open_shard('acme').close()
+        path = os.path.abspath(generation_path(shard.db_path))
+        self.assertIn(path, coherence._files)
+
+        self.create_paid_invoice(shard)
+        shard.close()
+        self.assertNotIn(path, coherence._files)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import threading
+import unittest
+
+from singleflight import SingleFlight, SingleFlightTimeout
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    WAITERS = 3
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.waiting = threading.Semaphore(0)
+        self.calls = 0
+
+    def blocking(self, result=None, error=None):
+        """Computation that runs until released, counting its executions"""
+        def fn():
+            self.calls += 1
+            self.release.wait(5)
+            if error:
+                raise error
+            return result
+        return fn
+
+    def run_concurrently(self, fn, timeout=5.0):
+        """Start a leader and WAITERS waiters on one key; returns their outcomes once released"""
+        outcomes = []
+        lock = threading.Lock()
+
+        def call(on_wait):
+            try:
+                outcome = self.flight.do('report', fn, timeout=timeout, on_wait=on_wait)
+            except Exception as e:
+                outcome = e
+            with lock:
+                outcomes.append(outcome)
+
+        leader = threading.Thread(target=call, args=(None,))
+        leader.start()
+        while self.flight.stats()['in_flight'] == 0:
+            threading.Event().wait(0.001)
+        waiters = [threading.Thread(target=call, args=(self.waiting.release,)) for _ in range(self.WAITERS)]
+        for waiter in waiters:
+            waiter.start()
+        for _ in waiters:
+            self.assertTrue(self.waiting.acquire(timeout=5))
+        return leader, waiters, outcomes
+
+    def finish(self, leader, waiters):
+        self.release.set()
+        for thread in [leader] + waiters:
+            thread.join(5)
+
+    def test_waiters_get_the_leaders_result(self):
+        """Concurrent calls run the computation once and all get its result"""
+        result = object()
+        leader, waiters, outcomes = self.run_concurrently(self.blocking(result))
+        self.finish(leader, waiters)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [result] * (self.WAITERS + 1))
+        stats = self.flight.stats()
+        self.assertEqual((stats['executions'], stats['coalesced'], stats['in_flight']), (1, self.WAITERS, 0))
+
+    def test_error_reaches_every_waiter(self):
+        """The leader's exception is raised in the leader and in every waiter"""
+        error = RuntimeError('database is locked')
+        leader, waiters, outcomes = self.run_concurrently(self.blocking(error=error))
+        self.finish(leader, waiters)
+
+        self.assertEqual(outcomes, [error] * (self.WAITERS + 1))
+        self.assertEqual(self.flight.stats()['errors'], 1)
+
+    def test_key_is_released_after_failure(self):
+        """A failed computation doesn't stick: the next call for the key runs again"""
+        self.release.set()
+        with self.assertRaises(ValueError):
+            self.flight.do('report', self.blocking(error=ValueError('boom')))
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+
+        self.assertEqual(self.flight.do('report', self.blocking('fresh')), 'fresh')
+        self.assertEqual(self.calls, 2)
+
+    def test_waiter_times_out(self):
+        """A waiter gives up after its timeout while the leader still finishes"""
+        leader, waiters, outcomes = self.run_concurrently(self.blocking('late'), timeout=0.05)
+        for waiter in waiters:
+            waiter.join(5)
+
+        self.assertEqual(len(outcomes), self.WAITERS)
+        self.assertTrue(all(isinstance(outcome, SingleFlightTimeout) for outcome in outcomes))
+        self.assertEqual(self.flight.stats()['timeouts'], self.WAITERS)
+        self.finish(leader, [])
+        self.assertEqual(outcomes[-1], 'late')
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file